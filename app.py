@@ -3,13 +3,25 @@ import pandas as pd, numpy as np
 
 import dash
 from dash import Dash, dcc, html
-from dash import Input, Output, State, callback, ctx
+from dash import Input, Output, State, callback, clientside_callback, ClientsideFunction, ctx
 from dash.exceptions import PreventUpdate
 
 import dash_bootstrap_components as dbc
 
-from ui.utils_opt import (ID_HEADER, VARIABLE_NAME_HEADER, EDITABLE_COLS, WELL_NAME_HEADER)
-from ui.ui_component_opt import (make_left_panel, make_main_datatable, make_right_panel)
+from ui.utils_opt import (ID_HEADER, VARIABLE_NAME_HEADER, EDITABLE_COLS)
+from ui.ui_component_opt import (make_left_panel, make_main_datatable, make_right_panel,
+                                 make_subset_page, make_subset_title, make_ui_metadata)
+from ui.session_store import SessionStore, make_backend
+from ui.journal import make_journal
+from ui.table_model import TableModel
+from ui.table_edits import changed_cells
+from ui.bulk import has_parameters
+from ui.dataset import DatasetLoader
+from ui.schema import SCHEMA, compact_frame
+from ui.persistence import make_writer
+from ui.metrics import instrument, timed
+from ui.profiling import install_profiler, session_table
+from ui.encoding import install_encoder
 
 DATA_PATH = os.path.join(os.path.dirname(__file__), 'data')
 UI_PATH = os.path.join(os.path.dirname(__file__), 'ui')
@@ -18,13 +30,56 @@ ORIGINAL_DATASET = "OptimizationVariablesTable.csv"
 MODIFIED_DATASET = "OptimizationVariablesTable.csv"
 
 
+# datasets are parsed once, resets get copy-on-write copies of the cached table
+pd.set_option('mode.copy_on_write', True)
+LOADER = DatasetLoader(DATA_PATH, prepare=compact_frame, schema=SCHEMA)
+
 def get_dataset(dataset_name):
-    df = pd.read_csv(os.path.join(DATA_PATH, dataset_name))
+    df = LOADER.load(dataset_name)
     df.reset_index(drop=True, inplace=True)
     if ID_HEADER in df.columns: df.drop(labels=ID_HEADER, axis=1, inplace=True)
     df.insert(0, ID_HEADER, df.index)
     return df
 
+def subset_outputs():
+
+    """ What selecting a well changes in the right panel, which is built once """
+
+    return [Output('datatable-subset', "data", allow_duplicate=True),
+            Output('datatable-subset', 'page_count', allow_duplicate=True),
+            Output("subset-title", "children", allow_duplicate=True),
+            Output("subset-header", "style", allow_duplicate=True),
+            Output("update-all", "disabled", allow_duplicate=True),
+            Output('datatable-subset', 'page_current', allow_duplicate=True),
+            Output('datatable-subset', 'sort_by', allow_duplicate=True),
+            Output('datatable-subset', 'filter_query', allow_duplicate=True),
+            Output('datatable-subset', 'active_cell', allow_duplicate=True),
+            Output('datatable-subset', 'selected_cells', allow_duplicate=True)]
+
+def subset_states():
+    return [State('datatable-subset', 'page_current'),
+            State('datatable-subset', 'page_size'),
+            State('datatable-subset', 'sort_by'),
+            State('datatable-subset', 'filter_query')]
+
+def subset_update(model, state, page_current, page_size, sort_by, filter_query):
+
+    """
+    Values of subset_outputs for the active well of the state: the first page, unsorted
+    and unfiltered. When the table is paged, sorted or filtered, only these are reset
+    and render_sub_page sends the page.
+    """
+
+    well = state['active_well']
+    header = [make_subset_title(well), {} if well is not None else {'display': 'none'}, well is None]
+
+    if page_current or sort_by or filter_query:
+        return [dash.no_update, dash.no_update] + header + [0, [], '', None, []]
+
+    data, page_count = make_subset_page(model, well, 0, page_size,
+                                        session=state['session'], version=STORE.version(state['session']))
+    return [data, page_count] + header + [dash.no_update, dash.no_update, dash.no_update, None, []]
+
 app = Dash(
     __name__,
     external_stylesheets=[
@@ -33,198 +88,345 @@ app = Dash(
     suppress_callback_exceptions=True
 )
 
-df_init = get_dataset(MODIFIED_DATASET)
+# time and payload sizes of the callback requests, served on /metrics
+METRICS = instrument(app)
 
-state_dict = {'df': df_init.to_dict(),
-              'active_well': None
-              }
+# responses are encoded with orjson when it is installed, the large ones are gzipped
+ENCODER = install_encoder(app)
 
-layout = dbc.Container(
-    id='main-layout',
-    children=[
-        dcc.Location(id='url'),
-        dbc.Row(html.Br()),
-        dbc.Row(
-            id="load-panels"),
-        dcc.Store(id="state-store", data=state_dict)
-    ],
-    fluid=True,
-)
+# saves go to a table partitioned by well, new sessions start from the last one
+WRITER = make_writer(os.path.splitext(MODIFIED_DATASET)[0], prepare=compact_frame)
+
+def load_model():
+    saved = WRITER.load()
+    if saved is None:
+        return TableModel(get_dataset(MODIFIED_DATASET))
+    df, generation = saved
+    model = TableModel(df)
+    # the next save only writes what the session changes
+    model.dirty.clear(generation)
+    return model
 
-app.layout = layout
+# tables are kept on the server, the browser only holds the session token,
+# edits are journaled so a restart doesn't lose them
+STORE = SessionStore(loader=load_model, backend=make_backend('optimization'), journal=make_journal('optimization'))
 
-## Load initial page
+# profiles of single callback requests on demand, listed on /_profiles (TABLE_PROFILE=on)
+PROFILER = install_profiler(app, describe=session_table(STORE))
+
+# the version changes with every edit and triggers the callbacks following the table,
+# the server keys its caches on its own (see SessionStore.version), never on the one sent back
+state_dict = {'session': None,
+              'version': 0,
+              'active_well': None
+              }
+
+def serve_layout():
+
+    """
+    Layout of a page load, an empty shell: start_page resumes the session the tab kept in its
+    session storage, or starts a new one, and renders the panels in one round trip.
+    A reload or a restored tab gets its session back, its edits are recovered from the journal.
+    """
+
+    state = dict(state_dict)
+
+    return dbc.Container(
+        id='main-layout',
+        children=[
+            dcc.Location(id='url'),
+            dbc.Row(html.Br()),
+            dbc.Row(
+                id="load-panels"),
+            dcc.Store(id="state-store", data=state, storage_type='session'),
+            # table metadata of the clientside callbacks (see make_ui_metadata)
+            dcc.Store(id="ui-metadata")
+        ],
+        fluid=True,
+    )
+
+app.layout = serve_layout
+
+## Load initial page: both panels, with the first page of the main table
 @callback(
     Output('load-panels', 'children'),
+    Output("ui-metadata", "data"),
+    Output("state-store", "data", allow_duplicate=True),
     Input('url', 'pathname'),
-    State("state-store", "data")
+    State("state-store", "data"),
+    prevent_initial_call='initial_duplicate'
 )
+@timed
 def start_page(_, state):
 
-    df = pd.DataFrame(state['df'])
+    # the state the tab kept, or the one of the layout for a new tab
+    session = STORE.resume(state['session'])
+    model = STORE.get(session)
+    state = dict(state, session=session, version=STORE.version(session))
 
+    if state['active_well'] not in model.wells:
+        state['active_well'] = None
     well = state['active_well']
 
     children = [
-        dbc.Col(id="left-panel", children=make_left_panel(), width=3),
-        dbc.Col(id="right-panel", children=[make_right_panel(df, well)]),
+        dbc.Col(id="left-panel", children=make_left_panel(model), width=3),
+        dbc.Col(id="right-panel", children=[make_right_panel(model, well)]),
     ]
 
-    return children
+    return children, make_ui_metadata(model), state
 
-## Render main datatable
+## Render main datatable, its first page comes with the panels
 @callback(
     Output('datatable-main', 'data'),
     Output('datatable-main', 'columns'),
-    Input('load-panels', 'children'),
-    State("state-store", "data")
+    Output('datatable-main', 'page_count'),
+    Input('datatable-main', 'page_current'),
+    Input('datatable-main', 'page_size'),
+    Input('datatable-main', 'sort_by'),
+    Input('datatable-main', 'filter_query'),
+    State("state-store", "data"),
+    prevent_initial_call=True
 )
-def render_main_table(_, state):
+@timed
+def render_main_table(page_current, page_size, sort_by, filter_query, state):
 
-    # get dataframe
-    df = pd.DataFrame(state['df'])
+    # get table
+    model = STORE.get(state['session'])
 
-    # update the table
-    data_df, columns = make_main_datatable(df)
+    # update the table, only the visible page is sent
+    data_df, columns, page_count = make_main_datatable(model, page_current, page_size,
+                                                       sort_by, filter_query)
 
-    return data_df, columns
+    return data_df, columns, page_count
 
-## Load panel with time step table (the right panel)
+## Show the parameters of the selected well (the right panel)
 @callback(
-    Output("right-panel", 'children', allow_duplicate=True),
     Output("state-store", "data", allow_duplicate=True),
-    Output("update-all", "disabled"),
+    *subset_outputs(),
     Input('datatable-main',  'active_cell'),
     Input("confirm-reset-table", "n_clicks"),
     State("state-store", "data"),
+    *subset_states(),
     prevent_initial_call=True
 )
-def render_sub_table(active_cell, confirm_n, state):
+@timed
+def render_sub_table(active_cell, confirm_n, state, *subset_page):
 
     if ("confirm-reset-table" == ctx.triggered_id):
-        df = get_dataset(ORIGINAL_DATASET)
-        child = make_right_panel(df, None)
-        disable_button = True
-        state['df'] = df.to_dict()
+        model = TableModel(get_dataset(ORIGINAL_DATASET))
+        state['version'] = STORE.replace(state['session'], model)
+        state['active_well'] = None
 
-    elif not active_cell:
+    elif not active_cell or active_cell['row_id'] == state['active_well']:
+        # nothing selected, or the same parameters already shown
         raise PreventUpdate
 
     else:
-        df = pd.DataFrame(state['df'])
-        well = state['active_well'] = active_cell['row_id']
-        child = make_right_panel(df, well)
-        disable_button = False
+        model = STORE.get(state['session'])
+        state['active_well'] = active_cell['row_id']
+
+    return state, *subset_update(model, state, *subset_page)
+
+## Page, sort and filter the optimization parameters table
+@callback(
+    Output('datatable-subset', "data", allow_duplicate=True),
+    Output('datatable-subset', 'page_count'),
+    Input('datatable-subset', 'page_current'),
+    Input('datatable-subset', 'page_size'),
+    Input('datatable-subset', 'sort_by'),
+    Input('datatable-subset', 'filter_query'),
+    State("state-store", "data"),
+    prevent_initial_call=True
+)
+@timed
+def render_sub_page(page_current, page_size, sort_by, filter_query, state):
 
-    return child, state, disable_button
+    model = STORE.get(state['session'])
+
+    return make_subset_page(model, state['active_well'], page_current, page_size, sort_by, filter_query,
+                            session=state['session'], version=STORE.version(state['session']))
 
 ## Change time step table input
 @callback(
     Output("state-store", "data", allow_duplicate=True),
     Output('datatable-subset', "data", allow_duplicate=True),
 
-    Input('datatable-subset', 'active_cell'),
+    Input('datatable-subset', 'data_timestamp'),
     Input("confirm-update-all", "n_clicks"),
 
     State("state-store", "data"),
     State('datatable-subset', "data"),
+    State('datatable-subset', "data_previous"),
     State("control-input", "value"),
+    State("control-input-end", "value"),
     State("param-select", "value"),
+    State("bulk-operation", "value"),
+    State("bulk-scope", "value"),
+    State("bulk-source", "value"),
 
     prevent_initial_call=True
 )
-def table_editing(active_cell, confirm_n, state,
-                  rows, control_input, param_select):
+@timed
+def table_editing(data_timestamp, confirm_n, state, rows, previous_rows,
+                  control_input, control_input_end, param_select, operation, scope, source):
 
     # get stored state
     well = state['active_well']
-    df = pd.DataFrame(state['df'])
-
-    # get app values
-    new_rows = pd.DataFrame(rows)
-
-    # initialize variables
-    new_values = None
-    col = None
-    
-    if "confirm-update-all" == ctx.triggered_id and control_input:
-        # update with constant values (confirm button in update-all modal)
-        new_values = [np.float64(control_input)] * len(df.loc[df[WELL_NAME_HEADER] == well])
-        col = param_select
-        
-    elif not active_cell:
-        # no action needed if there is no active cell
-        raise PreventUpdate
 
-    elif well is None:
-        # no action needed if there is no well or scenario selected
+    if well is None:
+        # no action needed if there is no well selected
         raise PreventUpdate
 
-    elif active_cell['column_id'] in EDITABLE_COLS:
-        # update from table input (user changes values manually)
-        if ID_HEADER not in rows[0].keys(): PreventUpdate
-        new_values = new_rows[active_cell['column_id']].values
-        col = active_cell['column_id']
-    
-    else:
-        raise PreventUpdate
+    subset_table_update = dash.no_update
+
+    with STORE.edit(state['session']) as model:
+        if "confirm-update-all" == ctx.triggered_id:
+            if not param_select or not has_parameters(operation, value=control_input,
+                                                      end=control_input_end, source=source):
+                raise PreventUpdate
+            # bulk operation of the update-all modal, one array operation over the rows of the scope
+            model.apply_bulk(param_select, model.row_set(scope, well), operation,
+                             value=control_input, end=control_input_end, source=source)
+
+            # place new values in the app table cache
+            if rows:
+                values = model.column_values(param_select)[model.index.positions([row[ID_HEADER] for row in rows])]
+                subset_table_update = [dict(row, **{param_select: float(value)}) for row, value in zip(rows, values)]
+
+        else:
+            # update from table input (user changes values manually)
+            # only the edited cells are applied, the table already shows them
+            changes = changed_cells(rows, previous_rows, EDITABLE_COLS)
+            if not changes: raise PreventUpdate
+
+            # undone as one action
+            with model.history.action():
+                for col, (row_ids, new_values) in changes.items():
+                    if col == VARIABLE_NAME_HEADER:
+                        model.set_row_values(row_ids, col, new_values)
+                    else:
+                        model.set_row_values(row_ids, col, np.float64(new_values))
+
+        state['version'] = STORE.put(state['session'], model)
+
+    return state, subset_table_update
+
+## Undo or redo the last edit of the session, the time step table is reloaded
+@callback(
+    Output("state-store", "data", allow_duplicate=True),
+    Output('datatable-subset', "data", allow_duplicate=True),
+    Output('datatable-subset', 'page_count', allow_duplicate=True),
+    Input("undo", "n_clicks"),
+    Input("redo", "n_clicks"),
+    State("state-store", "data"),
+    State('datatable-subset', 'page_current'),
+    State('datatable-subset', 'page_size'),
+    State('datatable-subset', 'sort_by'),
+    State('datatable-subset', 'filter_query'),
+    prevent_initial_call=True
+)
+@timed
+def undo_redo(undo_n, redo_n, state, page_current, page_size, sort_by, filter_query):
 
-    # place new values in the app table cache
-    new_rows[col] = new_values
-    
-    # update values in the state
-    if col == VARIABLE_NAME_HEADER:
-        df.loc[df[WELL_NAME_HEADER] == well, VARIABLE_NAME_HEADER] = new_values
-    else:
-        df.loc[df[WELL_NAME_HEADER] == well, col] = np.float64(new_values)
+    with STORE.edit(state['session']) as model:
+        history = model.history
+        if not (history.undo(model) if "undo" == ctx.triggered_id else history.redo(model)):
+            raise PreventUpdate
 
-    new_rows = new_rows.to_dict('records') 
-    state['df'] = df.to_dict()
+        state['version'] = STORE.put(state['session'], model)
 
-    return state, new_rows
+    data, page_count = make_subset_page(model, state['active_well'], page_current, page_size,
+                                        sort_by, filter_query, session=state['session'],
+                                        version=STORE.version(state['session']))
+
+    return state, data, page_count
+
+## Enable / disable undo and redo, both start disabled
+@callback(
+    Output("undo", "disabled"),
+    Output("redo", "disabled"),
+    Input("state-store", "data"),
+    prevent_initial_call=True
+)
+@timed
+def enable_undo_redo(state):
+    history = STORE.get(state['session']).history
+    return not history.can_undo, not history.can_redo
 
 
 ## Open or close popup to change time step table input
-@app.callback(
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='toggleModalClearInput'),
     Output("modal-update-all", "is_open"),
     Output("control-input", "value"),
     Input("update-all", "n_clicks"),
     Input("confirm-update-all", "n_clicks"),
     Input('cancel-update-all', 'n_clicks'),
     State("modal-update-all", "is_open"),
-    State("control-input", "value")
 )
-def toggle_modal_update_all(update_all_n, confirm_n, cancel_n, is_open, control_input):
-    if update_all_n or cancel_n or confirm_n:
-        return not is_open, None
-    return is_open, None
 
 
 ## Enable / disable button to confirm change in time step table input
-@app.callback(
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='confirmParameterUpdateDisabled'),
     Output("confirm-update-all", "disabled"),
     Input("control-input", "value"),
+    Input("control-input-end", "value"),
+    Input("bulk-operation", "value"),
+    Input("bulk-source", "value"),
+    Input("param-select", "value"),
+    State("ui-metadata", "data"),
+)
+
+## Update lower / upper bound frame
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='showBounds'),
+    Output('bound-frame', 'children'),
+    Input('datatable-subset', 'active_cell'),
+    State('datatable-subset', 'data'),
+    State("ui-metadata", "data"),
 )
-def enable_confirm_button_update_all(control_input):
-    if control_input:
-        return False
-    return True
 
-## Save table
+## Save table: the wells changed since the last save are written in the background
 @app.callback(
-    Output("save-table-toast", "is_open"),
+    Output("save-job", "data"),
+    Output("save-poll", "disabled"),
+    Output("state-store", "data", allow_duplicate=True),
     Input("save-table", "n_clicks"),
     State("state-store", "data"),
     prevent_initial_call=True
 )
+@timed
 def save_table_to_file(_, state):
-    #df = pd.DataFrame(state['df'])
-    #table_handle = dataiku.Dataset(MODIFIED_DATASET)
-    #table_handle.write_with_schema(df) 
-    return True
+    with STORE.edit(state['session']) as model:
+        job = WRITER.save(model)
+        # the model is stored with its cleared dirty set
+        state['version'] = STORE.put(state['session'], model)
+    return job, False, state
 
-## Open or close popup to confirm reset table
+## Report the save once it is on disk
 @app.callback(
+    Output("save-table-toast", "is_open"),
+    Output("save-table-toast", "header"),
+    Output("save-table-toast", "children"),
+    Output("save-poll", "disabled", allow_duplicate=True),
+    Input("save-poll", "n_intervals"),
+    State("save-job", "data"),
+    prevent_initial_call=True
+)
+@timed
+def report_save(_, job):
+    result = WRITER.poll(job)
+    if result is None:
+        raise PreventUpdate
+    saved, message = result
+    if saved:
+        return True, "Success", [html.P("Table has been saved!", className="mb-0"), html.Small(message)], True
+    return True, "Error", html.P(message, className="mb-0"), True
+
+## Open or close popup to confirm reset table
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='toggleModal'),
     Output("modal-reset-table", "is_open"),
     Input("reset-table", "n_clicks"),
     Input("confirm-reset-table", "n_clicks"),
@@ -232,10 +434,6 @@ def save_table_to_file(_, state):
     State("modal-reset-table", "is_open"),
     prevent_initial_call=True
 )
-def toggle_modal_reset_table(reset_n, confirm_n, cancel_n, is_open):
-    if reset_n or cancel_n or confirm_n:
-        return not is_open
-    return is_open
 
 if __name__ == '__main__':
     app.run(debug=True)
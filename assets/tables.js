@@ -0,0 +1,87 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    tables: {
+        // scenario columns (the deletable ones) removed since the last render of the main table,
+        // the server only hears about the table columns when one was deleted
+        removedScenarios: function(columns, previous) {
+            const noUpdate = window.dash_clientside.no_update;
+            if (!columns) {
+                return [noUpdate, noUpdate];
+            }
+            const scenarios = columns.filter(col => col.deletable).map(col => col.id);
+            const removed = (previous || []).filter(name => !scenarios.includes(name));
+            if (!removed.length) {
+                return [scenarios, noUpdate];
+            }
+            // the timestamp makes deleting a scenario with a reused name an event again
+            return [scenarios, {scenarios: removed, timestamp: Date.now()}];
+        },
+
+        scenarioOptions: function(scenarios) {
+            return (scenarios || []).map(name => ({label: name, value: name}));
+        },
+
+        // n_clicks of the buttons opening or closing the modal, then its is_open
+        toggleModal: function(...args) {
+            const isOpen = args[args.length - 1];
+            return args.slice(0, -1).some(Boolean) ? !isOpen : isOpen;
+        },
+
+        // same, and the input of the modal is cleared
+        toggleModalClearInput: function(...args) {
+            return [window.dash_clientside.tables.toggleModal(...args), null];
+        },
+
+        // the button that opened the update-all modal picks the bulk scope (see make_ui_metadata)
+        toggleModalUpdateAll: function(updateAll, updateSelection, confirm, cancel, isOpen, metadata) {
+            const dc = window.dash_clientside;
+            const scope = metadata ? metadata.modal_scopes[dc.callback_context.triggered_id] : undefined;
+            return [dc.tables.toggleModal(updateAll, updateSelection, confirm, cancel, isOpen),
+                    null, scope === undefined ? dc.no_update : scope];
+        },
+
+        // as ui.bulk.has_parameters
+        hasParameters: function(operation, params, metadata) {
+            const names = metadata ? metadata.bulk_parameters[operation] : undefined;
+            return names !== undefined && names.every(name => params[name] !== null
+                                                         && params[name] !== undefined
+                                                         && params[name] !== '');
+        },
+
+        confirmUpdateAllDisabled: function(value, end, operation, source, metadata) {
+            return !window.dash_clientside.tables.hasParameters(operation, {value, end, source}, metadata);
+        },
+
+        confirmParameterUpdateDisabled: function(value, end, operation, source, param, metadata) {
+            return !(param && window.dash_clientside.tables.hasParameters(operation, {value, end, source}, metadata));
+        },
+
+        // a new scenario needs a name not used by a column or a scenario, ignoring case
+        confirmAddScenarioDisabled: function(name, scenarios, metadata) {
+            if (!name || !metadata) {
+                return true;
+            }
+            const names = metadata.columns.concat(scenarios || []).map(col => col.toLowerCase());
+            return names.includes(name.toLowerCase());
+        },
+
+        // bounds of the clicked time step, read from the rows of the page shown,
+        // cleared with the active cell when another well or scenario is shown
+        showBounds: function(activeCell, rows, metadata) {
+            if (!activeCell) {
+                return '';
+            }
+            if (!metadata) {
+                return window.dash_clientside.no_update;
+            }
+            const row = (rows || []).find(row => row.id === activeCell.row_id);
+            if (!row) {
+                return window.dash_clientside.no_update;
+            }
+            // floats as written by python
+            const format = value => value === null || value === undefined ? 'nan'
+                : Number.isInteger(value) ? value.toFixed(1) : String(value);
+            const [lower, upper] = metadata.bounds;
+            return `Lower Bound:  **${format(row[lower])}**  \nUpper Bound:  **${format(row[upper])}**`;
+        }
+    }
+});
@@ -0,0 +1,347 @@
+"""
+Latency, peak memory and payload size of the server callbacks of an app on synthetic tables,
+from tens of rows to 100k+ (see benchmarks.synthetic). Each callback is called directly,
+bypassing Flask, with a stand-in for dash.ctx, on a session holding the synthetic table.
+Read-only cases keep the state version, so their server caches are warm as in a session
+browsing the table; edits change it on every call.
+
+Request bytes are the JSON body the renderer would post, response bytes the JSON Dash
+would send back (0 when the callback prevents the update). Peak memory is measured by
+tracemalloc over one extra call, outside the timed ones.
+
+Results go to a JSON file, to compare against the results of another version:
+
+    python -m benchmarks.bench_callbacks --app main --wells 100 5000 --out callbacks.json
+    python -m benchmarks.bench_callbacks --app main --wells 100 5000 --compare callbacks.json
+
+The journal is off unless TABLE_JOURNAL is set. Clientside callbacks (show_bounds, the modals)
+don't run on the server and are listed as such.
+"""
+import argparse, importlib, json, os, platform, subprocess, sys, time, tracemalloc
+from types import SimpleNamespace
+
+import numpy as np, pandas as pd
+import dash
+from dash import Patch
+from dash.exceptions import PreventUpdate
+from plotly.io.json import to_json_plotly
+
+from benchmarks.synthetic import make_forecast_table, make_optimization_table
+from ui.utils import (ID_HEADER, WELL_TYPE_HEADER, VALUE_HEADER, DEFAULT_SCENARIO_COL, TIME_HEADER,
+                      PAGE_SIZE)
+from ui.utils_opt import INIT_VALUE_HEADER
+from ui.bulk import SCOPE_WELL, SCOPE_TYPE, SCOPE_SELECTION
+from ui.schema import compact_frame
+
+# the columns added and dropped by the scenario cases
+BENCH_SCENARIO = 'Bench scenario'
+SELECTION_QUERY = f'`{WELL_TYPE_HEADER}` == "Injector" and `{TIME_HEADER}` >= 600'
+PERCENTILES = [50, 90, 99]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Case:
+
+    """
+    One callback call: args(i) gives the arguments of the i-th call, after setup(i) which
+    is not timed. triggered is the id dash.ctx.triggered_id returns, or a function of i.
+    """
+
+    def __init__(self, name, callback, args, triggered=None, setup=None):
+        self.name = name
+        self.callback = callback
+        self.args = args
+        self.triggered = triggered
+        self.setup = setup
+
+    def triggered_id(self, i):
+        return self.triggered(i) if callable(self.triggered) else self.triggered
+
+
+class Bench:
+
+    """ Callbacks of an app module, called on a session holding a given table model """
+
+    def __init__(self, module):
+        self.module = module
+        # the first request sets the server up, with the callbacks registered by @callback
+        module.app.server.test_client().get('/')
+        self.callbacks = {}
+        for key, spec in module.app.callback_map.items():
+            if 'callback' in spec:
+                function = getattr(spec['callback'], '__wrapped__', spec['callback'])
+                self.callbacks[function.__name__] = (key, spec, function)
+        self.clientside = [spec['clientside_function']['function_name'] for spec in module.app._callback_list
+                           if spec.get('clientside_function')]
+
+    def start(self, model):
+        self.token = self.module.STORE.create(model)
+
+    @property
+    def model(self):
+        return self.module.STORE.get(self.token)
+
+    def state(self, **values):
+        return dict(self.module.state_dict, session=self.token, version=self.module.STORE.version(self.token),
+                    **values)
+
+    def request_bytes(self, name, args):
+        key, spec, _ = self.callbacks[name]
+        n_inputs = len(spec['inputs'])
+        assert len(args) == n_inputs + len(spec['state']), f"{name}: {len(args)} arguments"
+        body = {'output': key,
+                'inputs': [dict(dep, value=value) for dep, value in zip(spec['inputs'], args)],
+                'state': [dict(dep, value=value) for dep, value in zip(spec['state'], args[n_inputs:])]}
+        return len(to_json_plotly(body))
+
+    def response_bytes(self, name, outputs):
+        key, _, _ = self.callbacks[name]
+        if key.startswith('..'):
+            keys = key[2:-2].split('...')
+        else:
+            keys, outputs = [key], [outputs]
+        response = {}
+        for output, value in zip(keys, outputs):
+            if value is dash.no_update: continue
+            component_id, prop = output.split('@')[0].rsplit('.', 1)
+            response.setdefault(component_id, {})[prop] = value.to_plotly_json() if isinstance(value, Patch) else value
+        return len(to_json_plotly({'multi': True, 'response': response})) if response else 0
+
+    def call(self, case, i):
+        _, _, function = self.callbacks[case.callback]
+        if case.setup is not None: case.setup(i)
+        args = case.args(i)
+        ctx = self.module.ctx
+        self.module.ctx = SimpleNamespace(triggered_id=case.triggered_id(i))
+        try:
+            start = time.perf_counter()
+            try:
+                outputs = function(*args)
+            except PreventUpdate:
+                outputs = PreventUpdate
+            elapsed = time.perf_counter() - start
+        finally:
+            self.module.ctx = ctx
+        return args, outputs, elapsed
+
+    def run(self, case, repeat, warmup):
+        for i in range(warmup):
+            self.call(case, i)
+        times = []
+        for i in range(warmup, warmup + repeat):
+            args, outputs, elapsed = self.call(case, i)
+            times.append(elapsed)
+
+        tracemalloc.start()
+        try:
+            self.call(case, warmup + repeat)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        times = 1e3 * np.array(times)
+        result = {f'p{q}_ms': float(np.percentile(times, q)) for q in PERCENTILES}
+        result.update(max_ms=float(times.max()), peak_mb=peak / 2**20,
+                      request_bytes=self.request_bytes(case.callback, args),
+                      response_bytes=0 if outputs is PreventUpdate else self.response_bytes(case.callback, outputs),
+                      prevented=outputs is PreventUpdate)
+        return result
+
+
+def subset_page_args():
+    return [0, PAGE_SIZE, [], '']
+
+
+def forecast_cases(bench, components):
+
+    """ Cases of main.py: the forecast controls table, wells x time steps x scenarios """
+
+    model = bench.model
+    wells = model.wells
+    well = lambda i: wells[(7 * i) % len(wells)]
+    scenario = DEFAULT_SCENARIO_COL
+    sort_by = [{'column_id': scenario, 'direction': 'desc'}]
+    main_row_ids = wells[:PAGE_SIZE]
+
+    def edit_args(i):
+        state = bench.state(active_well=main_row_ids[i % len(main_row_ids)], active_scenario=scenario)
+        rows, _ = components.make_subset_page(bench.model, state['active_well'], scenario)
+        previous = [dict(row) for row in rows]
+        rows[0] = dict(rows[0], **{VALUE_HEADER: float(rows[0][VALUE_HEADER]) + 1})
+        return [i, None, state, rows, previous, None, None, None, None, None, None, None, main_row_ids]
+
+    def bulk_args(operation, value, scope):
+        def args(i):
+            state = bench.state(active_well=main_row_ids[0], active_scenario=scenario)
+            rows, _ = components.make_subset_page(bench.model, state['active_well'], scenario)
+            return [None, i, state, rows, rows, value, None, operation, scope, None,
+                    SELECTION_QUERY, [scenario], main_row_ids]
+        return args
+
+    def without_bench_scenario(i):
+        if BENCH_SCENARIO in bench.model.scenarios:
+            bench.model.drop_scenarios([BENCH_SCENARIO])
+
+    def with_bench_scenario(i):
+        if BENCH_SCENARIO not in bench.model.scenarios:
+            bench.model.add_scenario(BENCH_SCENARIO, parent=scenario)
+
+    return [
+        Case('start_page', 'start_page', lambda i: [None, bench.state()]),
+        Case('render_main_table', 'render_main_table',
+             lambda i: [None, 0, PAGE_SIZE, [], '', None, bench.state()], 'datatable-main'),
+        Case('render_main_table sorted', 'render_main_table',
+             lambda i: [None, 1, PAGE_SIZE, sort_by, '', None, bench.state()], 'datatable-main'),
+        Case('render_main_table selection', 'render_main_table',
+             lambda i: [None, 0, PAGE_SIZE, [], '', SELECTION_QUERY, bench.state()], 'selection-query'),
+        Case('show_selection', 'show_selection',
+             lambda i: [SELECTION_QUERY, [scenario], bench.state()], 'selection-query'),
+        Case('render_sub_table', 'render_sub_table',
+             lambda i: [{'row': 0, 'column': 0, 'row_id': well(i), 'column_id': scenario}, bench.state(),
+                        *subset_page_args()], 'datatable-main'),
+        Case('render_sub_page sorted', 'render_sub_page',
+             lambda i: [1, PAGE_SIZE, sort_by, '', bench.state(active_well=well(i), active_scenario=scenario)],
+             'datatable-subset'),
+        Case('table_editing cell', 'table_editing', edit_args, 'datatable-subset'),
+        Case('table_editing well', 'table_editing', bulk_args('offset', 1, SCOPE_WELL), 'confirm-update-all'),
+        Case('table_editing type', 'table_editing', bulk_args('scale', 1.001, SCOPE_TYPE), 'confirm-update-all'),
+        Case('table_editing selection', 'table_editing', bulk_args('offset', 1, SCOPE_SELECTION),
+             'confirm-update-all'),
+        Case('undo_redo', 'undo_redo',
+             lambda i: [i, i, bench.state(), *subset_page_args()], lambda i: 'undo' if i % 2 == 0 else 'redo'),
+        Case('trigger_main_table_update add', 'trigger_main_table_update',
+             lambda i: [i, None, bench.state(), BENCH_SCENARIO, *subset_page_args()], 'confirm-add-scenario',
+             setup=without_bench_scenario),
+        Case('synch_state', 'synch_state',
+             lambda i: [{'scenarios': [BENCH_SCENARIO]}, bench.state(), *subset_page_args()], 'removed-scenarios',
+             setup=with_bench_scenario),
+    ]
+
+
+def optimization_cases(bench, components):
+
+    """ Cases of app.py: the optimization variables table, wells x time steps """
+
+    wells = bench.model.wells
+    well = lambda i: wells[(7 * i) % len(wells)]
+    sort_by = [{'column_id': INIT_VALUE_HEADER, 'direction': 'desc'}]
+
+    def edit_args(i):
+        state = bench.state(active_well=well(i))
+        rows, _ = components.make_subset_page(bench.model, state['active_well'])
+        previous = [dict(row) for row in rows]
+        rows[0] = dict(rows[0], **{INIT_VALUE_HEADER: float(rows[0][INIT_VALUE_HEADER]) + 1})
+        return [i, None, state, rows, previous, None, None, None, None, None, None]
+
+    def bulk_args(operation, value, scope):
+        def args(i):
+            state = bench.state(active_well=wells[0])
+            rows, _ = components.make_subset_page(bench.model, state['active_well'])
+            return [None, i, state, rows, rows, value, None, INIT_VALUE_HEADER, operation, scope, None]
+        return args
+
+    return [
+        Case('start_page', 'start_page', lambda i: [None, bench.state()]),
+        Case('render_main_table', 'render_main_table',
+             lambda i: [0, PAGE_SIZE, [], '', bench.state()], 'datatable-main'),
+        Case('render_main_table sorted', 'render_main_table',
+             lambda i: [1, PAGE_SIZE, [{'column_id': ID_HEADER, 'direction': 'desc'}], '', bench.state()],
+             'datatable-main'),
+        Case('render_sub_table', 'render_sub_table',
+             lambda i: [{'row': 0, 'column': 0, 'row_id': well(i), 'column_id': ID_HEADER}, None, bench.state(),
+                        *subset_page_args()], 'datatable-main'),
+        Case('render_sub_page sorted', 'render_sub_page',
+             lambda i: [1, PAGE_SIZE, sort_by, '', bench.state(active_well=well(i))], 'datatable-subset'),
+        Case('table_editing cell', 'table_editing', edit_args, 'datatable-subset'),
+        Case('table_editing well', 'table_editing', bulk_args('offset', 1, SCOPE_WELL), 'confirm-update-all'),
+        Case('table_editing type', 'table_editing', bulk_args('scale', 1.001, SCOPE_TYPE), 'confirm-update-all'),
+        Case('undo_redo', 'undo_redo',
+             lambda i: [i, i, bench.state(), *subset_page_args()], lambda i: 'undo' if i % 2 == 0 else 'redo'),
+    ]
+
+
+APPS = {
+    'main': ('ui.ui_components', lambda args, wells: make_forecast_table(wells, args.steps, args.scenarios),
+             forecast_cases),
+    'app': ('ui.ui_component_opt', lambda args, wells: make_optimization_table(wells, args.steps),
+            optimization_cases),
+}
+
+
+def compare(results, baseline):
+
+    """ Ratio of each p50 / peak memory to the baseline's, for the sizes and cases both have """
+
+    print(f"\nagainst {baseline['meta'].get('git_revision')} ({baseline['meta'].get('date')}):")
+    old = {(run['rows'], case['name']): case for run in baseline['runs'] for case in run['cases']}
+    common = [(run, case) for run in results['runs'] for case in run['cases'] if (run['rows'], case['name']) in old]
+    if not common:
+        print("  no table size and case in common")
+    for run, case in common:
+        before = old[run['rows'], case['name']]
+        print(f"  {run['rows']:>8} rows  {case['name']:<32} p50 x{case['p50_ms'] / max(before['p50_ms'], 1e-6):5.2f}"
+              f"  peak x{case['peak_mb'] / max(before['peak_mb'], 1e-6):5.2f}"
+              f"  response x{case['response_bytes'] / max(before['response_bytes'], 1):5.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', default='main', choices=sorted(APPS), help="module of the Dash app")
+    parser.add_argument('--wells', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--scenarios', type=int, default=3, help="scenarios of the forecast table")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--cases', nargs='*', help="only the cases starting with these names")
+    parser.add_argument('--out', help="JSON file of the results")
+    parser.add_argument('--compare', help="JSON file of earlier results")
+    args = parser.parse_args()
+
+    os.environ.setdefault('TABLE_JOURNAL', 'off')
+    module = importlib.import_module(args.app)
+    components_name, make_table, make_cases = APPS[args.app]
+    components = importlib.import_module(components_name)
+    bench = Bench(module)
+
+    results = {'meta': {'app': args.app, 'steps': args.steps, 'scenarios': args.scenarios,
+                        'repeat': args.repeat, 'warmup': args.warmup, 'git_revision': git_revision(),
+                        'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+                        'pandas': pd.__version__, 'numpy': np.__version__, 'dash': dash.__version__,
+                        'platform': platform.platform(), 'clientside': bench.clientside},
+               'runs': []}
+
+    for n_wells in args.wells:
+        df = make_table(args, n_wells)
+        bench.start(module.ScenarioTableModel(compact_frame(df)) if args.app == 'main'
+                    else module.TableModel(compact_frame(df)))
+        run = {'wells': n_wells, 'rows': len(df), 'cases': []}
+        print(f"{args.app}: {n_wells} wells, {len(df)} rows")
+        for case in make_cases(bench, components):
+            if args.cases and not any(case.name.startswith(name) for name in args.cases): continue
+            result = dict(bench.run(case, args.repeat, args.warmup), name=case.name, callback=case.callback)
+            run['cases'].append(result)
+            print(f"  {case.name:<32} p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+                  f"peak {result['peak_mb']:7.2f} MB  request {result['request_bytes']:>8} B  "
+                  f"response {result['response_bytes']:>8} B{'  (prevented)' if result['prevented'] else ''}")
+        module.STORE.drop(bench.token)
+        results['runs'].append(run)
+
+    print(f"clientside, not measured: {len(bench.clientside)} callbacks")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
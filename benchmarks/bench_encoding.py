@@ -0,0 +1,104 @@
+"""
+Encoding time and size of the ForecastControls table as callback payloads, from 10k to 1M cells
+(see benchmarks.synthetic), with the JSON engines Dash can encode its responses with (see ui.encoding).
+
+Payloads are the table as the state used to carry it, to_dict() columns of {index: value}, and as
+DataTable data, records built by to_dict('records') or by ui.encoding.records. Each is encoded by
+plotly's to_json_plotly, as Dash does, with the json and orjson engines, and by pandas' to_json
+straight from the frame, without the Python objects. Build is the time to make the payload from
+the frame, gzip the time to compress the encoded bytes at the level of the app.
+
+    python -m benchmarks.bench_encoding --cells 10000 100000 1000000 --out encoding.json
+"""
+import argparse, gzip, json, time
+
+import numpy as np, pandas as pd
+import plotly.io as pio
+from plotly.io.json import to_json_plotly
+
+from benchmarks.synthetic import make_forecast_table
+from benchmarks.bench_callbacks import git_revision
+from ui.encoding import GZIP_LEVEL, records
+from ui.schema import compact_frame
+
+PAYLOADS = {
+    'state to_dict()': (lambda df: df.to_dict(), 'columns'),
+    "records to_dict('records')": (lambda df: df.to_dict('records'), 'records'),
+    'records ui.encoding.records': (records, 'records'),
+}
+
+
+def engines():
+    names = ['json']
+    try:
+        import orjson
+        names.append('orjson')
+    except ImportError:
+        print("orjson is not installed, only the json engine is measured")
+    return names
+
+
+def best_ms(func, repeat):
+    times, value = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        times.append(1e3 * (time.perf_counter() - start))
+    return min(times), value
+
+
+def measure(df, repeat):
+    results = []
+    default_engine = pio.json.config.default_engine
+    try:
+        for payload, (build, orient) in PAYLOADS.items():
+            build_ms, value = best_ms(lambda: build(df), repeat)
+            for engine in engines():
+                pio.json.config.default_engine = engine
+                encode_ms, encoded = best_ms(lambda: to_json_plotly(value), repeat)
+                results.append(result(payload, engine, build_ms, encode_ms, encoded.encode(), repeat))
+            encode_ms, encoded = best_ms(lambda: df.to_json(orient=orient), repeat)
+            results.append(result(payload, 'pandas to_json', 0.0, encode_ms, encoded.encode(), repeat))
+    finally:
+        pio.json.config.default_engine = default_engine
+    return results
+
+
+def result(payload, engine, build_ms, encode_ms, data, repeat):
+    gzip_ms, compressed = best_ms(lambda: gzip.compress(data, compresslevel=GZIP_LEVEL), max(repeat // 2, 1))
+    return {'payload': payload, 'engine': engine, 'build_ms': build_ms, 'encode_ms': encode_ms,
+            'total_ms': build_ms + encode_ms, 'bytes': len(data), 'gzip_bytes': len(compressed), 'gzip_ms': gzip_ms}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cells', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--scenarios', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3, help="the best time of the repeats is kept")
+    parser.add_argument('--out', help="JSON file of the results")
+    args = parser.parse_args()
+
+    n_columns = len(make_forecast_table(1, args.steps, args.scenarios).columns)
+    results = {'meta': {'steps': args.steps, 'scenarios': args.scenarios, 'repeat': args.repeat,
+                        'git_revision': git_revision(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'pandas': pd.__version__, 'numpy': np.__version__, 'engines': engines()},
+               'runs': []}
+
+    for cells in args.cells:
+        n_wells = max(round(cells / (args.steps * n_columns)), 1)
+        df = compact_frame(make_forecast_table(n_wells, args.steps, args.scenarios))
+        run = {'cells': df.size, 'rows': len(df), 'columns': len(df.columns), 'results': measure(df, args.repeat)}
+        print(f"{df.size} cells: {len(df)} rows x {len(df.columns)} columns")
+        for r in run['results']:
+            print(f"  {r['payload']:<28} {r['engine']:<15} build {r['build_ms']:8.1f} ms  encode {r['encode_ms']:8.1f} ms"
+                  f"  {r['bytes']:>11} B  gzip {r['gzip_bytes']:>10} B in {r['gzip_ms']:7.1f} ms")
+        results['runs'].append(run)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Round trips and time to interactive of a page load, replaying what the Dash renderer does
+against the app in process: the index, the layout with the dependencies, then the waves of
+server callbacks fired by the initial render and by the props they set, until none is left.
+Callbacks of one wave run in parallel in the browser, so a wave costs its slowest request.
+Clientside callbacks are counted, they don't need the server.
+Time to interactive is the server time on that critical path plus a network round trip
+time (--rtt) per sequential request.
+
+    python -m benchmarks.bench_page_load --app main --repeat 5 --rtt 50
+"""
+import argparse, importlib, json, statistics, time
+
+# guard against callbacks triggering each other
+MAX_WAVES = 20
+
+
+def walk(node, components):
+
+    """ Props of the components with an id in a layout (sub)tree, by id """
+
+    if isinstance(node, list):
+        for child in node:
+            walk(child, components)
+    elif isinstance(node, dict) and 'props' in node:
+        props = node['props']
+        if isinstance(props.get('id'), str):
+            components[props['id']] = props
+        for value in props.values():
+            walk(value, components)
+    return components
+
+
+def parse_outputs(key):
+    outputs = key[2:-2].split('...') if key.startswith('..') else [key]
+    return [dict(zip(('id', 'property'), output.split('@')[0].split('.', 1))) for output in outputs]
+
+
+class PageLoad:
+
+    """ One page load of an app through its Flask test client """
+
+    def __init__(self, app):
+        self.app = app
+        self.client = app.server.test_client()
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        start = time.perf_counter()
+        response = getattr(self.client, method)(url, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.requests.append((url, elapsed, len(response.data)))
+        return response, elapsed
+
+    def call(self, dependency, changed):
+        ins = [dict(dep, value=self.components.get(dep['id'], {}).get(dep['property']))
+               for dep in dependency['inputs']]
+        states = [dict(dep, value=self.components.get(dep['id'], {}).get(dep['property']))
+                  for dep in dependency['state']]
+        outputs = parse_outputs(dependency['output'])
+        body = {'output': dependency['output'], 'outputs': outputs if len(outputs) > 1 else outputs[0],
+                'inputs': ins, 'state': states, 'changedPropIds': sorted(changed)}
+        response, elapsed = self.request('post', '/_dash-update-component', data=json.dumps(body),
+                                         content_type='application/json')
+        if response.status_code == 204:
+            return {}, elapsed
+        assert response.status_code == 200, response.data[:500]
+        return response.json['response'], elapsed
+
+    def run(self):
+        waves, clientside = [], 0
+        self.request('get', '/')
+        layout = self.request('get', '/_dash-layout')[0].json
+        dependencies = self.request('get', '/_dash-dependencies')[0].json
+        self.components = walk(layout, {})
+
+        # initial render: every callback with its inputs in the layout
+        inserted, changed = set(self.components), set()
+        while len(waves) < MAX_WAVES:
+            fired = []
+            for dependency in dependencies:
+                input_ids = {dep['id'] for dep in dependency['inputs']}
+                if not input_ids or not input_ids <= set(self.components): continue
+                triggers = {f"{dep['id']}.{dep['property']}" for dep in dependency['inputs']} & changed
+                initial = (input_ids & inserted) and dependency.get('prevent_initial_call') is not True
+                if triggers or initial:
+                    fired.append((dependency, triggers))
+            if not fired: break
+
+            server = [(dependency, triggers) for dependency, triggers in fired if 'clientside_function' not in dependency
+                      or not dependency['clientside_function']]
+            clientside += len(fired) - len(server)
+            if not server: break
+
+            inserted, changed, times = set(), set(), []
+            for dependency, triggers in server:
+                response, elapsed = self.call(dependency, triggers)
+                times.append(elapsed)
+                for component_id, props in response.items():
+                    for prop, value in props.items():
+                        self.components.setdefault(component_id, {})[prop] = value
+                        changed.add(f'{component_id}.{prop}')
+                        new = walk(value, {})
+                        self.components.update(new)
+                        inserted |= set(new)
+            waves.append(([dependency['output'] for dependency, _ in server], max(times)))
+
+        # the layout and the dependencies are requested together
+        fetch = self.requests[0][1] + max(self.requests[1][1], self.requests[2][1])
+        return {'round_trips': 2 + len(waves),
+                'callback_requests': len(self.requests) - 3,
+                'clientside_callbacks': clientside,
+                'bytes': sum(nbytes for _, _, nbytes in self.requests),
+                'layout_bytes': self.requests[1][2],
+                'server_ms': 1e3 * (fetch + sum(wave_time for _, wave_time in waves)),
+                'waves': [outputs for outputs, _ in waves]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', default='main', help="module of the Dash app: main or app")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--rtt', type=float, default=50, help="network round trip time in ms")
+    args = parser.parse_args()
+
+    app = importlib.import_module(args.app).app
+    # the first request sets the server up
+    app.server.test_client().get('/')
+    results = [PageLoad(app).run() for _ in range(args.repeat)]
+
+    last = results[-1]
+    print(f"{args.app}: {last['round_trips']} sequential round trips, {last['callback_requests']} callback requests, "
+          f"{last['clientside_callbacks']} clientside callbacks, {last['bytes']} bytes "
+          f"(layout {last['layout_bytes']})")
+    server_ms = statistics.median(r['server_ms'] for r in results)
+    print(f"time to interactive {server_ms + args.rtt * last['round_trips']:.1f} ms: "
+          f"{server_ms:.1f} ms on the server (median of {args.repeat}) + {last['round_trips']} x {args.rtt:g} ms")
+    for i, outputs in enumerate(last['waves'], 1):
+        print(f"  wave {i}: {', '.join(outputs)}")
+
+
+if __name__ == '__main__':
+    main()
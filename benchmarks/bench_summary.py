@@ -0,0 +1,56 @@
+"""
+Compare the main table summary (get_avg_df) against the per-well lambda aggregation.
+
+    python -m benchmarks.bench_summary --wells 10000 --steps 20 --scenarios 30
+"""
+import argparse, time
+
+import pandas as pd
+
+from ui.utils import WELL_NAME_HEADER, WELL_TYPE_HEADER, get_avg_df, get_scenario_cols
+from benchmarks.synthetic import make_forecast_table
+
+
+def well_agg_main_table(x: pd.Series):
+    all_equal = all(abs(item - x.iloc[0])<1e-10 for item in x.values)
+    if all_equal: return x.iloc[0]
+    else: return "varying"
+
+
+def legacy_avg_df(df):
+    scenario_columns = get_scenario_cols(df)
+    cols = [WELL_NAME_HEADER, WELL_TYPE_HEADER] + scenario_columns
+    return df[cols].groupby(by=[WELL_NAME_HEADER, WELL_TYPE_HEADER])[scenario_columns].agg(func=well_agg_main_table).reset_index()
+
+
+def best_time(func, df, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(df)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wells', type=int, default=10000)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--scenarios', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_forecast_table(args.wells, args.steps, args.scenarios)
+    print(f"{args.wells} wells x {args.steps} steps x {args.scenarios} scenarios ({len(df)} rows)")
+
+    legacy_time, legacy = best_time(legacy_avg_df, df, args.repeat)
+    vectorized_time, vectorized = best_time(get_avg_df, df, args.repeat)
+
+    same = vectorized.drop(columns=['id']).reset_index(drop=True).astype(str).equals(legacy.astype(str))
+    print(f"per-well lambda: {legacy_time * 1000:10.1f} ms")
+    print(f"vectorized:      {vectorized_time * 1000:10.1f} ms  ({legacy_time / vectorized_time:.0f}x faster)")
+    print(f"identical results: {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,428 @@
+"""
+Load test of the Dash endpoints with concurrent simulated users.
+
+User sessions (clicking through wells, editing a time step, update all, adding and deleting
+a scenario) are first recorded as the callback requests the renderer would post, by scripting
+a page of the app in process. They are then replayed by N users at once, each loading its own
+page (a new server session) and threading the state-store value of the responses through its
+requests, against:
+
+    client     the Flask test client, users as threads of this process
+    threads    a local server, one thread per request (werkzeug, threaded)
+    processes  a local server, one process per request (werkzeug, forking); sessions then
+               have to be kept on disk, TABLE_STORE_BACKEND defaults to disk
+
+Reported per server and number of users: throughput, latency percentiles of the callback
+requests and the server CPU time per request (the whole process for the test client).
+
+    python -m benchmarks.load_test --app main --users 1 8 32 --server client threads processes --wells 2000
+    python -m benchmarks.load_test --app app --sessions click edit --users 16 --out load.json
+
+The journal is off unless TABLE_JOURNAL is set.
+"""
+import argparse, importlib, json, os, random, socket, subprocess, sys, tempfile, threading, time
+import logging
+
+import numpy as np, psutil, requests
+
+from benchmarks.bench_page_load import walk, parse_outputs
+from benchmarks.synthetic import make_forecast_table, make_optimization_table
+from ui.utils import ID_HEADER, VALUE_HEADER, DEFAULT_SCENARIO_COL
+from ui.utils_opt import INIT_VALUE_HEADER
+from ui.bulk import SCOPE_WELL, SCOPE_ALL
+from ui.schema import compact_frame
+
+STATE = 'state-store.data'
+LOAD_TEST_SCENARIO = 'Load test'
+# wells clicked through by a session
+CLICKS = 5
+SERVER_START_TIMEOUT_S = 60
+PERCENTILES = [50, 90, 99]
+
+
+def configure(module, app_name, wells, steps, scenarios):
+
+    """ Sessions of the app start from a synthetic table of that many wells, the dataset without """
+
+    if not wells: return
+    if app_name == 'main':
+        df = compact_frame(make_forecast_table(wells, steps, scenarios))
+        module.STORE.loader = lambda: module.ScenarioTableModel(df)
+    else:
+        df = compact_frame(make_optimization_table(wells, steps))
+        module.STORE.loader = lambda: module.TableModel(df)
+
+
+class TestClientTransport:
+
+    def __init__(self, app):
+        self.client = app.server.test_client()
+
+    def get(self, url):
+        response = self.client.get(url)
+        return response.status_code, response.get_json(silent=True), len(response.data)
+
+    def post(self, url, body):
+        response = self.client.post(url, data=body, content_type='application/json')
+        return response.status_code, response.get_json(silent=True), len(response.data)
+
+
+class HTTPTransport:
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def get(self, url):
+        response = self.session.get(self.base_url + url)
+        return response.status_code, response.json() if response.content else None, len(response.content)
+
+    def post(self, url, body):
+        response = self.session.post(self.base_url + url, data=body, headers={'Content-Type': 'application/json'})
+        return response.status_code, response.json() if response.status_code == 200 else None, len(response.content)
+
+
+class Page:
+
+    """
+    A page of the app as the browser holds it: the props of its components, updated by the
+    responses. Requests are built from them, or replayed with the state-store value of this page.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.components = {}
+        self.timings = []
+        self.errors = 0
+
+    def load(self):
+        start = time.perf_counter()
+        status, layout, _ = self.transport.get('/_dash-layout')
+        self.timings.append(('layout', time.perf_counter() - start))
+        if status != 200:
+            self.errors += 1
+            return False
+        self.components = walk(layout, {})
+        return True
+
+    def value(self, dependency):
+        return self.components.get(dependency['id'], {}).get(dependency['property'])
+
+    def apply(self, response):
+        for component_id, props in response.items():
+            for prop, value in props.items():
+                # patches only change cells of rows the page has, no request sends them back
+                if isinstance(value, dict) and '__dash_patch_update' in value: continue
+                self.components.setdefault(component_id, {})[prop] = value
+                self.components.update(walk(value, {}))
+
+    def post(self, name, body):
+        start = time.perf_counter()
+        status, response, _ = self.transport.post('/_dash-update-component', json.dumps(body))
+        self.timings.append((name, time.perf_counter() - start))
+        if status == 200:
+            self.apply(response['response'])
+        elif status != 204:
+            self.errors += 1
+        return status
+
+    def replay(self, name, body):
+        state = self.components.get('state-store', {}).get('data')
+        for dependency in body['inputs'] + body['state']:
+            if f"{dependency['id']}.{dependency['property']}" == STATE:
+                dependency['value'] = state
+        return self.post(name, body)
+
+
+class Recorder(Page):
+
+    """ A page driven in process by a session script, keeping the requests it posts """
+
+    def __init__(self, app):
+        super().__init__(TestClientTransport(app))
+        self.callbacks = {}
+        for key, spec in app.callback_map.items():
+            if 'callback' in spec:
+                function = getattr(spec['callback'], '__wrapped__', spec['callback'])
+                self.callbacks[function.__name__] = (key, spec)
+        self.requests = []
+
+    def call(self, name, changed, **props):
+
+        """ Post the callback after the browser set props ({'id.prop': value}), changed triggered it """
+
+        for prop_id, value in props.items():
+            component_id, prop = prop_id.split('.', 1)
+            self.components.setdefault(component_id, {})[prop] = value
+        key, spec = self.callbacks[name]
+        outputs = parse_outputs(key)
+        body = {'output': key, 'outputs': outputs if len(outputs) > 1 else outputs[0],
+                'inputs': [dict(dep, value=self.value(dep)) for dep in spec['inputs']],
+                'state': [dict(dep, value=self.value(dep)) for dep in spec['state']],
+                'changedPropIds': [changed]}
+        self.requests.append((name, json.loads(json.dumps(body))))
+        status = self.post(name, body)
+        if status not in (200, 204):
+            raise RuntimeError(f"{name} failed while recording the session")
+        return status
+
+    def main_rows(self):
+        return self.components['datatable-main']['data']
+
+
+def click_wells(page, column):
+    for i, row in enumerate(page.main_rows()[:CLICKS]):
+        page.call('render_sub_table', 'datatable-main.active_cell',
+                  **{'datatable-main.active_cell': {'row': i, 'column': 1, 'row_id': row[ID_HEADER],
+                                                    'column_id': column}})
+
+
+def edit_first_row(page, field, extra=None):
+    rows = page.components['datatable-subset']['data']
+    edited = [dict(rows[0], **{field: float(rows[0][field]) + 1})] + rows[1:]
+    page.call('table_editing', 'datatable-subset.data_timestamp',
+              **{'datatable-subset.data': edited, 'datatable-subset.data_previous': rows,
+                 'datatable-subset.data_timestamp': int(time.time() * 1000)}, **(extra or {}))
+
+
+def update_all(page, scope, n_clicks, extra=None):
+    page.call('table_editing', 'confirm-update-all.n_clicks',
+              **{'confirm-update-all.n_clicks': n_clicks, 'control-input.value': 1, 'bulk-operation.value': 'offset',
+                 'bulk-scope.value': scope}, **(extra or {}))
+
+
+def forecast_sessions():
+
+    """ Session scripts of main.py, each starts with the page load """
+
+    def main_ids(page):
+        return {'datatable-main.derived_viewport_row_ids': [row[ID_HEADER] for row in page.main_rows()]}
+
+    def click(page):
+        click_wells(page, DEFAULT_SCENARIO_COL)
+        page.call('render_sub_page', 'datatable-subset.page_current', **{'datatable-subset.page_current': 1})
+        page.call('render_main_table', 'datatable-main.page_current', **{'datatable-main.page_current': 1})
+
+    def edit(page):
+        click_wells(page, DEFAULT_SCENARIO_COL)
+        edit_first_row(page, VALUE_HEADER, main_ids(page))
+
+    def update(page):
+        click_wells(page, DEFAULT_SCENARIO_COL)
+        update_all(page, SCOPE_WELL, 1, main_ids(page))
+        update_all(page, SCOPE_ALL, 2, main_ids(page))
+
+    def add_scenario(page):
+        page.call('trigger_main_table_update', 'confirm-add-scenario.n_clicks',
+                  **{'confirm-add-scenario.n_clicks': 1, 'add-scenario-name.value': LOAD_TEST_SCENARIO})
+        page.call('render_main_table', 'trigger-table-update.children')
+        click_wells(page, LOAD_TEST_SCENARIO)
+        # deleted in the main table, see removedScenarios in assets/tables.js
+        page.call('synch_state', 'removed-scenarios.data',
+                  **{'removed-scenarios.data': {'scenarios': [LOAD_TEST_SCENARIO], 'timestamp': 1}})
+
+    return {'click': click, 'edit': edit, 'update_all': update, 'add_scenario': add_scenario}
+
+
+def optimization_sessions():
+
+    """ Session scripts of app.py, each starts with the page load """
+
+    def click(page):
+        click_wells(page, ID_HEADER)
+        page.call('render_sub_page', 'datatable-subset.page_current', **{'datatable-subset.page_current': 1})
+        page.call('render_main_table', 'datatable-main.page_current', **{'datatable-main.page_current': 1})
+
+    def edit(page):
+        click_wells(page, ID_HEADER)
+        edit_first_row(page, INIT_VALUE_HEADER)
+
+    def update(page):
+        click_wells(page, ID_HEADER)
+        extra = {'param-select.value': INIT_VALUE_HEADER}
+        update_all(page, SCOPE_WELL, 1, extra)
+        update_all(page, SCOPE_ALL, 2, extra)
+
+    return {'click': click, 'edit': edit, 'update_all': update}
+
+
+SESSIONS = {'main': forecast_sessions, 'app': optimization_sessions}
+
+
+def record(app, app_name, names):
+
+    """ Requests of each session script, recorded on a page of its own """
+
+    scripts = SESSIONS[app_name]()
+    sessions = {}
+    for name in names or scripts:
+        if name not in scripts:
+            raise SystemExit(f"No {name} session for {app_name}, choose from {', '.join(scripts)}")
+        page = Recorder(app)
+        page.load()
+        page.call('start_page', 'url.pathname', **{'url.pathname': '/'})
+        scripts[name](page)
+        sessions[name] = page.requests
+    return sessions
+
+
+def user(transport, sessions, iterations, seed, barrier, pages):
+    rng = random.Random(seed)
+    names = sorted(sessions)
+    barrier.wait()
+    for _ in range(iterations):
+        page = Page(transport)
+        pages.append(page)
+        if not page.load(): continue
+        for name, body in sessions[rng.choice(names)]:
+            page.replay(name, json.loads(json.dumps(body)))
+
+
+def replay(make_transport, sessions, users, iterations, cpu_time):
+
+    """ Users replaying random sessions at once, returns the timings and CPU seconds """
+
+    pages = []
+    barrier = threading.Barrier(users + 1)
+    threads = [threading.Thread(target=user, args=(make_transport(), sessions, iterations, i, barrier, pages))
+               for i in range(users)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start, cpu_start = time.perf_counter(), cpu_time()
+    for thread in threads:
+        thread.join()
+    return pages, time.perf_counter() - start, cpu_time() - cpu_start
+
+
+def summarize(pages, elapsed, cpu):
+    timings = [(name, t) for page in pages for name, t in page.timings]
+    times = 1e3 * np.array([t for _, t in timings])
+    result = {'requests': len(timings), 'errors': sum(page.errors for page in pages),
+              'throughput_rps': len(timings) / elapsed,
+              'cpu_ms_per_request': 1e3 * cpu / len(timings)}
+    result.update({f'p{q}_ms': float(np.percentile(times, q)) for q in PERCENTILES})
+    result['max_ms'] = float(times.max())
+    result['callbacks'] = {}
+    for name in sorted({name for name, _ in timings}):
+        times = 1e3 * np.array([t for other, t in timings if other == name])
+        result['callbacks'][name] = {'requests': len(times), 'p50_ms': float(np.percentile(times, 50)),
+                                     'p99_ms': float(np.percentile(times, 99))}
+    return result
+
+
+def process_cpu(process):
+
+    """ CPU seconds of a process, with its children once they exit """
+
+    def cpu_time():
+        times = process.cpu_times()
+        return times.user + times.system + times.children_user + times.children_system
+    return cpu_time
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, mode, port, store_path):
+    env = dict(os.environ)
+    if mode == 'processes' and 'TABLE_STORE_BACKEND' not in env:
+        # each request runs in a forked process, sessions have to outlive it
+        env['TABLE_STORE_BACKEND'] = 'disk'
+        env.setdefault('TABLE_STORE_PATH', store_path)
+    command = [sys.executable, '-m', 'benchmarks.load_test', '--app', args.app, '--serve', mode,
+               '--port', str(port), '--processes', str(args.processes), '--steps', str(args.steps),
+               '--scenarios', str(args.scenarios)]
+    if args.wells: command += ['--wells', str(args.wells)]
+    server = subprocess.Popen(command, env=env)
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_S
+    while time.monotonic() < deadline:
+        try:
+            # the first request sets the server up
+            requests.get(f'http://127.0.0.1:{port}/', timeout=5)
+            return server
+        except requests.ConnectionError:
+            if server.poll() is not None: break
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"The {mode} server did not start")
+
+
+def serve(args, module):
+    from werkzeug.serving import run_simple
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    if args.serve == 'threads':
+        run_simple('127.0.0.1', args.port, module.app.server, threaded=True)
+    else:
+        run_simple('127.0.0.1', args.port, module.app.server, processes=args.processes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', default='main', choices=sorted(SESSIONS), help="module of the Dash app")
+    parser.add_argument('--server', nargs='+', default=['client'], choices=['client', 'threads', 'processes'])
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--iterations', type=int, default=3, help="sessions per user, each on a new page")
+    parser.add_argument('--sessions', nargs='*', help="session scripts to replay (default: all of the app)")
+    parser.add_argument('--wells', type=int, help="synthetic table of that many wells instead of the dataset")
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--scenarios', type=int, default=3, help="scenarios of the forecast table")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help="concurrent request processes of the processes server")
+    parser.add_argument('--out', help="JSON file of the results")
+    parser.add_argument('--serve', choices=['threads', 'processes'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ.setdefault('TABLE_JOURNAL', 'off')
+    module = importlib.import_module(args.app)
+    configure(module, args.app, args.wells, args.steps, args.scenarios)
+    if args.serve:
+        return serve(args, module)
+
+    # the first request sets the server up
+    module.app.server.test_client().get('/')
+    sessions = record(module.app, args.app, args.sessions)
+    print(f"{args.app}: recorded {', '.join(f'{name} ({len(body)} requests)' for name, body in sessions.items())}")
+
+    results = {'meta': {'app': args.app, 'wells': args.wells, 'steps': args.steps, 'scenarios': args.scenarios,
+                        'iterations': args.iterations, 'sessions': {name: len(body) for name, body in sessions.items()},
+                        'cpu_count': os.cpu_count(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S')},
+               'runs': []}
+    for mode in args.server:
+        server, store = None, tempfile.TemporaryDirectory(prefix='load-test-store-')
+        if mode == 'client':
+            make_transport = lambda: TestClientTransport(module.app)
+            cpu_time = process_cpu(psutil.Process())
+        else:
+            port = free_port()
+            server = start_server(args, mode, port, store.name)
+            make_transport = lambda: HTTPTransport(f'http://127.0.0.1:{port}')
+            cpu_time = process_cpu(psutil.Process(server.pid))
+        try:
+            for users in args.users:
+                pages, elapsed, cpu = replay(make_transport, sessions, users, args.iterations, cpu_time)
+                result = dict(summarize(pages, elapsed, cpu), server=mode, users=users)
+                results['runs'].append(result)
+                print(f"  {mode:<9} {users:>3} users  {result['requests']:>5} requests  "
+                      f"{result['throughput_rps']:7.1f} req/s  p50 {result['p50_ms']:7.1f} ms  "
+                      f"p90 {result['p90_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  "
+                      f"CPU {result['cpu_ms_per_request']:6.2f} ms/req  {result['errors']} errors")
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+            store.cleanup()
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Bytes per row of the controls table as parsed by pandas and in the compact schema.
+
+    python -m benchmarks.memory_report --wells 5000 --steps 20 --scenarios 10
+"""
+import argparse, os
+
+import numpy as np, pandas as pd
+
+from ui.schema import compact_frame, memory_report
+from benchmarks.synthetic import make_forecast_table
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+
+
+def print_report(title, df):
+    reports = {'parsed': memory_report(df),
+               'compact float64': memory_report(compact_frame(df, np.float64)),
+               'compact float32': memory_report(compact_frame(df, np.float32))}
+    print(f"\n{title} ({len(df)} rows), bytes per row")
+    print(f"{'column':40s}" + ''.join(f"{name:>18s}" for name in reports))
+    for col in reports['parsed']:
+        print(f"{col:40s}" + ''.join(f"{report[col]:18.1f}" for report in reports.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wells', type=int, default=5000)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--scenarios', type=int, default=10)
+    args = parser.parse_args()
+
+    print_report('ForecastControlsTable.csv', pd.read_csv(os.path.join(DATA_PATH, 'ForecastControlsTable.csv')))
+    print_report('OptimizationVariablesTable.csv', pd.read_csv(os.path.join(DATA_PATH, 'OptimizationVariablesTable.csv')))
+
+    # through a csv, so strings are not shared between columns like a parsed file
+    df = make_forecast_table(args.wells, args.steps, args.scenarios).drop(columns='id')
+    df = pd.read_csv(pd.io.common.StringIO(df.to_csv(index=False)))
+    print_report(f"Synthetic {args.wells} wells x {args.steps} steps x {args.scenarios} scenarios", df)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import numpy as np, pandas as pd
+
+from ui.utils import (ID_HEADER, WELL_NAME_HEADER, WELL_TYPE_HEADER, WELL_CONTROL_HEADER,
+                      LOWER_BOUND_HEADER, UPPER_BOUND_HEADER, TIME_HEADER, VARIABLE_NAME_HEADER,
+                      VARIABLE_NAME_ORIGINAL, DEFAULT_SCENARIO_COL)
+from ui.utils_opt import INIT_VALUE_HEADER, STANDARD_DEV, CORR_LENGTH
+
+TIME_STEP = 60
+
+
+def make_forecast_table(n_wells, n_steps=20, n_scenarios=3, seed=0):
+
+    """
+    Synthetic table with the ForecastControlsTable.csv schema, as returned by get_dataset.
+    Half of the wells have a constant control per scenario, the others vary over time.
+    """
+
+    rng = np.random.default_rng(seed)
+    n_rows = n_wells * n_steps
+
+    well_no = np.repeat(np.arange(n_wells), n_steps)
+    step_no = np.tile(np.arange(1, n_steps + 1), n_wells)
+    is_injector = well_no % 3 == 0
+
+    well_names = np.where(is_injector, 'I', 'P').astype(object) + (well_no + 1).astype(str).astype(object)
+    controls = np.where(is_injector, 'RATE', 'BHP').astype(object)
+    var_names = ('$' + well_names + '_' + controls + '_'
+                 + pd.Series(step_no).map('{:04d}'.format).to_numpy(dtype=object) + '_1')
+
+    lower = np.where(is_injector, 0.0, 500.0)
+    upper = np.where(is_injector, 20000.0, 2000.0)
+
+    df = pd.DataFrame({
+        ID_HEADER: np.arange(n_rows),
+        VARIABLE_NAME_ORIGINAL: var_names,
+        WELL_NAME_HEADER: well_names,
+        WELL_TYPE_HEADER: np.where(is_injector, 'Injector', 'Producer').astype(object),
+        WELL_CONTROL_HEADER: controls,
+        LOWER_BOUND_HEADER: lower,
+        UPPER_BOUND_HEADER: upper,
+        TIME_HEADER: step_no * TIME_STEP,
+    })
+
+    scenario_names = [DEFAULT_SCENARIO_COL] + [f"Scenario {i}" for i in range(1, n_scenarios)]
+    varying = (well_no % 2 == 1)
+    for scenario in scenario_names:
+        per_well = rng.uniform(lower[::n_steps], upper[::n_steps])
+        values = np.round(per_well[well_no], 0)
+        noise = np.round(rng.uniform(0.9, 1.1, n_rows) * values, 0)
+        df[scenario] = np.where(varying, noise, values)
+        df[f"{VARIABLE_NAME_HEADER} - {scenario}"] = var_names
+
+    return df
+
+
+def make_optimization_table(n_wells, n_steps=20, seed=0):
+
+    """
+    Synthetic table with the OptimizationVariablesTable.csv schema, as returned by get_dataset.
+    Initial values are constant per well, the uncertainty parameters per well type.
+    """
+
+    rng = np.random.default_rng(seed)
+    forecast = make_forecast_table(n_wells, n_steps, n_scenarios=1, seed=seed)
+    well_no = np.repeat(np.arange(n_wells), n_steps)
+    is_injector = forecast[WELL_TYPE_HEADER].to_numpy() == 'Injector'
+
+    lower = forecast[LOWER_BOUND_HEADER].to_numpy()
+    upper = forecast[UPPER_BOUND_HEADER].to_numpy()
+    initial = np.round(rng.uniform(lower[::n_steps], upper[::n_steps]), 0)[well_no]
+
+    return pd.DataFrame({
+        ID_HEADER: forecast[ID_HEADER],
+        VARIABLE_NAME_ORIGINAL: forecast[VARIABLE_NAME_ORIGINAL],
+        VARIABLE_NAME_HEADER: forecast[VARIABLE_NAME_ORIGINAL],
+        WELL_NAME_HEADER: forecast[WELL_NAME_HEADER],
+        WELL_TYPE_HEADER: forecast[WELL_TYPE_HEADER],
+        WELL_CONTROL_HEADER: forecast[WELL_CONTROL_HEADER],
+        LOWER_BOUND_HEADER: lower,
+        UPPER_BOUND_HEADER: upper,
+        TIME_HEADER: forecast[TIME_HEADER],
+        INIT_VALUE_HEADER: initial,
+        STANDARD_DEV: np.where(is_injector, 0.05, 0.02),
+        CORR_LENGTH: np.where(is_injector, 4, 6),
+    })
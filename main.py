@@ -3,17 +3,30 @@ import os, sys
 import pandas as pd, numpy as np
 
 import dash
-from dash import Dash, dcc, html
-from dash import Input, Output, State, callback, ctx
+from dash import Dash, dcc, html, Patch
+from dash import Input, Output, State, callback, clientside_callback, ClientsideFunction, ctx
 from dash.exceptions import PreventUpdate
 
 import dash_bootstrap_components as dbc
 
-from ui.utils import (ID_HEADER, FIXED_HEADERS, WELL_NAME_HEADER, VALUE_HEADER,
+from ui.utils import (ID_HEADER, FIXED_HEADERS, VALUE_HEADER,
                       LOWER_BOUND_HEADER, UPPER_BOUND_HEADER, DEFAULT_SCENARIO_COL,
-                      VARIABLE_NAME_HEADER, VARIABLE_NAME_ORIGINAL, get_scenario_cols)
-from ui.ui_components import (make_left_panel, make_right_panel,
-                              make_main_datatable, make_bound_frame)
+                      VARIABLE_NAME_HEADER, violation_field)
+from ui.ui_components import (make_left_panel, make_right_panel, make_main_datatable,
+                              make_subset_page, make_subset_title, make_ui_metadata,
+                              violation_tooltip)
+from ui.session_store import SessionStore, make_backend
+from ui.journal import make_journal
+from ui.table_model import ScenarioTableModel, variable_name_col
+from ui.table_edits import changed_cells
+from ui.bulk import SCOPE_SELECTION, has_parameters
+from ui.selection import select
+from ui.dataset import DatasetLoader
+from ui.schema import SCHEMA, compact_frame
+from ui.persistence import make_writer
+from ui.metrics import instrument, timed
+from ui.profiling import install_profiler, session_table
+from ui.encoding import install_encoder
 
 DATA_PATH = os.path.join(os.path.dirname(__file__), 'data')
 UI_PATH = os.path.join(os.path.dirname(__file__), 'ui')
@@ -46,13 +59,69 @@ for asset in os.listdir(lib_path):
 MODIFIED_DATASET = 'ForecastControlsTable.csv'
 ORIGINAL_DATASET = 'ForecastControlsTable_Original.csv'
 
+# datasets are parsed once, resets get copy-on-write copies of the cached table
+pd.set_option('mode.copy_on_write', True)
+LOADER = DatasetLoader(DATA_PATH, prepare=compact_frame, schema=SCHEMA)
+
 def get_dataset(dataset_name):
-    df = pd.read_csv(os.path.join(DATA_PATH, dataset_name))
+    df = LOADER.load(dataset_name)
     df.reset_index(drop=True, inplace=True)
     if ID_HEADER in df.columns: df.drop(labels=ID_HEADER, axis=1, inplace=True)
     df.insert(0, ID_HEADER, df.index)
     return df
 
+def get_selection(model, query, state):
+
+    """ Selection of the query on the session table, None without a valid query """
+
+    if not query or not query.strip(): return None
+    try:
+        return select(model, query, state['session'], STORE.version(state['session']))
+    except ValueError:
+        return None
+
+def subset_outputs():
+
+    """ What selecting a well and scenario changes in the right panel, which is built once """
+
+    return [Output('datatable-subset', "data", allow_duplicate=True),
+            Output('datatable-subset', 'page_count', allow_duplicate=True),
+            Output("subset-title", "children", allow_duplicate=True),
+            Output("subset-header", "style", allow_duplicate=True),
+            Output("update-all", "disabled", allow_duplicate=True),
+            Output('datatable-subset', 'page_current', allow_duplicate=True),
+            Output('datatable-subset', 'sort_by', allow_duplicate=True),
+            Output('datatable-subset', 'filter_query', allow_duplicate=True),
+            Output('datatable-subset', 'active_cell', allow_duplicate=True),
+            Output('datatable-subset', 'selected_cells', allow_duplicate=True)]
+
+N_SUBSET_OUTPUTS = len(subset_outputs())
+
+def subset_states():
+    return [State('datatable-subset', 'page_current'),
+            State('datatable-subset', 'page_size'),
+            State('datatable-subset', 'sort_by'),
+            State('datatable-subset', 'filter_query')]
+
+def subset_update(model, state, page_current, page_size, sort_by, filter_query):
+
+    """
+    Values of subset_outputs for the active well and scenario of the state: the first page,
+    unsorted and unfiltered. When the table is paged, sorted or filtered, only these are reset
+    and render_sub_page sends the page.
+    """
+
+    well, scenario = state['active_well'], state['active_scenario']
+    selected = None not in [well, scenario]
+    header = [make_subset_title(well, scenario), {} if selected else {'display': 'none'}, not selected]
+
+    if page_current or sort_by or filter_query:
+        return [dash.no_update, dash.no_update] + header + [0, [], '', None, []]
+
+    data, page_count = make_subset_page(model, well, scenario, 0, page_size,
+                                        session=state['session'], version=STORE.version(state['session']))
+    return [data, page_count] + header + [dash.no_update, dash.no_update, dash.no_update, None, []]
+
 app = Dash(
     __name__,
     external_stylesheets=[
@@ -61,112 +130,179 @@ app = Dash(
     suppress_callback_exceptions=True
 )
 
-df_init = get_dataset(MODIFIED_DATASET)
+# time and payload sizes of the callback requests, served on /metrics
+METRICS = instrument(app)
 
-state_dict = {'df': df_init.to_dict(),
-              'active_well': None,
-              'active_scenario': None
-              }
+# responses are encoded with orjson when it is installed, the large ones are gzipped
+ENCODER = install_encoder(app)
 
-layout = dbc.Container(
-    id='main-layout',
-    children=[
-        dcc.Location(id='url'),
-        dbc.Row(html.Br()),
-        dbc.Row(
-            id="load-panels"),
-        dcc.Store(id="state-store", data=state_dict)
-    ],
-    fluid=True,
-)
+# saves go to a table partitioned by well, new sessions start from the last one
+WRITER = make_writer(os.path.splitext(MODIFIED_DATASET)[0], prepare=compact_frame)
+
+def load_model():
+    saved = WRITER.load()
+    if saved is None:
+        return ScenarioTableModel(get_dataset(MODIFIED_DATASET))
+    df, generation = saved
+    model = ScenarioTableModel(df)
+    # the next save only writes what the session changes
+    model.dirty.clear(generation)
+    return model
 
-app.layout = layout
+# tables are kept on the server, the browser only holds the session token,
+# edits are journaled so a restart doesn't lose them
+STORE = SessionStore(loader=load_model, backend=make_backend('forecast'), journal=make_journal('forecast'))
 
+# profiles of single callback requests on demand, listed on /_profiles (TABLE_PROFILE=on)
+PROFILER = install_profiler(app, describe=session_table(STORE))
 
-## Load initial page
+# the version changes with every edit and triggers the callbacks following the table,
+# the server keys its caches on its own (see SessionStore.version), never on the one sent back
+state_dict = {'session': None,
+              'version': 0,
+              'active_well': None,
+              'active_scenario': None
+              }
+
+def serve_layout():
+
+    """
+    Layout of a page load, an empty shell: start_page resumes the session the tab kept in its
+    session storage, or starts a new one, and renders the panels in one round trip.
+    A reload or a restored tab gets its session back, its edits are recovered from the journal.
+    """
+
+    state = dict(state_dict)
+
+    return dbc.Container(
+        id='main-layout',
+        children=[
+            dcc.Location(id='url'),
+            dbc.Row(html.Br()),
+            dbc.Row(
+                id="load-panels"),
+            dcc.Store(id="state-store", data=state, storage_type='session'),
+            # scenario columns of the main table and the ones the user deleted (see assets/tables.js)
+            dcc.Store(id="scenario-columns"),
+            dcc.Store(id="removed-scenarios"),
+            # table metadata of the clientside callbacks (see make_ui_metadata)
+            dcc.Store(id="ui-metadata")
+        ],
+        fluid=True,
+    )
+
+app.layout = serve_layout
+
+
+## Load initial page: both panels, with the first page of the main table
 @callback(
     Output('load-panels', 'children'),
+    Output("ui-metadata", "data"),
+    Output("state-store", "data", allow_duplicate=True),
     Input('url', 'pathname'),
-    State("state-store", "data")
+    State("state-store", "data"),
+    prevent_initial_call='initial_duplicate'
 )
+@timed
 def start_page(_, state):
 
-    df = pd.DataFrame(state['df'])
+    # the state the tab kept, or the one of the layout for a new tab
+    session = STORE.resume(state['session'])
+    model = STORE.get(session)
+    state = dict(state, session=session, version=STORE.version(session))
 
+    if state['active_well'] not in model.wells or state['active_scenario'] not in model.scenarios:
+        # the session was started again from the dataset, without the scenario shown
+        state['active_well'] = None
+        state['active_scenario'] = None
     well = state['active_well']
     scenario = state['active_scenario']
 
     children = [
-        dbc.Col(id="left-panel", children=make_left_panel(), width=8),
-        dbc.Col(id="right-panel", children=[make_right_panel(df, well, scenario)]),
+        dbc.Col(id="left-panel", children=make_left_panel(model), width=8),
+        dbc.Col(id="right-panel", children=[make_right_panel(model, well, scenario)]),
     ]
 
-    return children
+    return children, make_ui_metadata(model), state
 
 
-## Render main datatable
+## Render main datatable, its first page comes with the panels
 @callback(
     Output('datatable-main', 'data'),
     Output('datatable-main', 'columns'),
     Output('datatable-main', 'style_data_conditional'),
-    Input('load-panels', 'children'),
+    Output('datatable-main', 'tooltip_data'),
+    Output('datatable-main', 'page_count'),
     Input('trigger-table-update', 'children'),
-    State("state-store", "data")
+    Input('datatable-main', 'page_current'),
+    Input('datatable-main', 'page_size'),
+    Input('datatable-main', 'sort_by'),
+    Input('datatable-main', 'filter_query'),
+    Input("selection-query", "value"),
+    State("state-store", "data"),
+    prevent_initial_call=True
 )
-def render_main_table(_, trigger, state):
+@timed
+def render_main_table(trigger, page_current, page_size, sort_by, filter_query, query, state):
 
-    # get dataframe
-    df = pd.DataFrame(state['df'])
+    # get table
+    model = STORE.get(state['session'])
 
-    # update the table
-    data_df, columns, style = make_main_datatable(df)
+    # update the table, only the visible page is sent
+    data_df, columns, style, tooltip_data, page_count = make_main_datatable(
+        model, page_current, page_size, sort_by, filter_query, get_selection(model, query, state))
 
-    return data_df, columns, style
+    return data_df, columns, style, tooltip_data, page_count
 
 
+## Detect deleted scenario columns in the browser
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='removedScenarios'),
+    Output("scenario-columns", "data"),
+    Output("removed-scenarios", "data"),
+    Input('datatable-main', 'columns'),
+    State("scenario-columns", "data"),
+)
+
 ## Synch state and datatable when removing columns
 @callback(
     Output("state-store", "data", allow_duplicate=True),
-    Output("right-panel", "children", allow_duplicate=True),
-    Input('datatable-main', 'columns'),
+    *subset_outputs(),
+    Input("removed-scenarios", "data"),
     State("state-store", "data"),
+    *subset_states(),
     prevent_initial_call=True
 )
-def synch_state(columns, state):
-    if not columns: raise PreventUpdate
-
-    df = pd.DataFrame(state['df'])
-    table_col_names = [d['name'] for d in columns]
-    state_col_names = get_scenario_cols(df.head(0))
+@timed
+def synch_state(removed, state, *subset_page):
+    if not removed: raise PreventUpdate
 
-    cols_to_delete = []
-    for s_name in state_col_names:
-        if s_name not in table_col_names:
-            cols_to_delete.append(s_name)
-            cols_to_delete.append(f"{VARIABLE_NAME_HEADER} - {s_name}")
+    with STORE.edit(state['session']) as model:
+        # columns of a table replaced by a reset are not in the model anymore
+        cols_to_delete = [s_name for s_name in removed['scenarios'] if s_name in model.scenarios]
 
-    if not cols_to_delete: raise PreventUpdate
+        if not cols_to_delete: raise PreventUpdate
 
-    # scenario was deleted, synch state and reset subset table
-    df.drop(labels=cols_to_delete, inplace=True, axis=1)
-    state['df'] = df.to_dict()
+        # scenario was deleted, synch state and reset subset table
+        model.drop_scenarios(cols_to_delete)
+        state['version'] = STORE.put(state['session'], model)
 
-    right_panel_children = make_right_panel(df, None, None)
     state['active_well'] = None
     state['active_scenario'] = None
 
-    return state, right_panel_children
+    return state, *subset_update(model, state, *subset_page)
 
-## Load panel with time step table (the right panel)
+## Show the time steps of the selected well and scenario (the right panel)
 @callback(
-    Output("right-panel", 'children', allow_duplicate=True),
     Output("state-store", "data", allow_duplicate=True),
-    Output("update-all", "disabled"),
+    *subset_outputs(),
     Input('datatable-main',  'active_cell'),
     State("state-store", "data"),
+    *subset_states(),
     prevent_initial_call=True
 )
-def render_sub_table(active_cell,state):
+@timed
+def render_sub_table(active_cell, state, *subset_page):
 
     if not active_cell:
         raise PreventUpdate
@@ -175,217 +311,394 @@ def render_sub_table(active_cell,state):
         # only update if the user clicks on scenario column
         raise PreventUpdate
 
-    df = pd.DataFrame(state['df'])
-    well = state['active_well'] = active_cell['row_id']
-    scenario = state['active_scenario'] = active_cell['column_id']
+    if (active_cell['row_id'], active_cell['column_id']) == (state['active_well'], state['active_scenario']):
+        # same time steps already shown
+        raise PreventUpdate
 
-    child = make_right_panel(df, well, scenario)
-    disable_button = False
+    model = STORE.get(state['session'])
+    state['active_well'] = active_cell['row_id']
+    state['active_scenario'] = active_cell['column_id']
 
-    return child, state, disable_button
+    return state, *subset_update(model, state, *subset_page)
 
-## Update lower / upper bound frame
+## Page, sort and filter the time step table
 @callback(
-    Output('bound-frame', 'children'),
-    Input('datatable-subset', 'active_cell'),
-    State("state-store", "data")
+    Output('datatable-subset', "data", allow_duplicate=True),
+    Output('datatable-subset', 'page_count'),
+    Input('datatable-subset', 'page_current'),
+    Input('datatable-subset', 'page_size'),
+    Input('datatable-subset', 'sort_by'),
+    Input('datatable-subset', 'filter_query'),
+    State("state-store", "data"),
+    prevent_initial_call=True
 )
-def show_bounds(active_cell, state):
-    if not active_cell:
-        # no action needed if there is no active cell
-        raise PreventUpdate
-    
-    df = pd.DataFrame(state['df'])
-    bounds = df[df[ID_HEADER] == active_cell['row_id']][[LOWER_BOUND_HEADER, UPPER_BOUND_HEADER]]
-    
-    lower = bounds[LOWER_BOUND_HEADER].values[0]
-    upper = bounds[UPPER_BOUND_HEADER].values[0]
+@timed
+def render_sub_page(page_current, page_size, sort_by, filter_query, state):
 
-    children = make_bound_frame(lower, upper)
+    model = STORE.get(state['session'])
+    well = state['active_well']
+    scenario = state['active_scenario']
 
-    return children
+    return make_subset_page(model, well, scenario, page_current, page_size, sort_by, filter_query,
+                            session=state['session'], version=STORE.version(state['session']))
+
+## Update lower / upper bound frame
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='showBounds'),
+    Output('bound-frame', 'children'),
+    Input('datatable-subset', 'active_cell'),
+    State('datatable-subset', 'data'),
+    State("ui-metadata", "data"),
+)
 
 ## Change time step table input
 @callback(
     Output("state-store", "data", allow_duplicate=True),
     Output('datatable-subset', "data", allow_duplicate=True),
-    Output('trigger-table-update', 'children', allow_duplicate=True),
+    Output('datatable-main', 'data', allow_duplicate=True),
+    Output('datatable-main', 'tooltip_data', allow_duplicate=True),
 
-    Input('datatable-subset', 'active_cell'),
+    Input('datatable-subset', 'data_timestamp'),
     Input("confirm-update-all", "n_clicks"),
 
     State("state-store", "data"),
     State('datatable-subset', "data"),
+    State('datatable-subset', "data_previous"),
     State("control-input", "value"),
+    State("control-input-end", "value"),
+    State("bulk-operation", "value"),
+    State("bulk-scope", "value"),
+    State("bulk-source", "value"),
+    State("selection-query", "value"),
+    State("selection-scenarios", "value"),
+    State('datatable-main', 'derived_viewport_row_ids'),
     prevent_initial_call=True
 )
-def table_editing(active_cell, confirm_n,
-                  state, rows, control_input):
+@timed
+def table_editing(data_timestamp, confirm_n, state, rows, previous_rows,
+                  control_input, control_input_end, operation, scope, source,
+                  query, selection_scenarios, main_row_ids):
 
     # get stored state
     well = state['active_well']
     scenario = state['active_scenario']
-    df = pd.DataFrame(state['df'])
-
-    # get app values
-    new_rows = pd.DataFrame(rows)
-
-    # initialize variables
-    new_values = None
-    col = None
-    
-    if "confirm-update-all" == ctx.triggered_id and control_input:
-        # update with constant values (confirm button in update-all modal)
-        new_values = [np.float64(control_input)] * len(df.loc[df[WELL_NAME_HEADER] == well, scenario])
-        col = VALUE_HEADER
-        
-    elif not active_cell:
-        # no action needed if there is no active cell
-        raise PreventUpdate
 
-    elif None in [well, scenario]:
-        # no action needed if there is no well or scenario selected
-        raise PreventUpdate
-
-    elif active_cell['column_id'] in [VALUE_HEADER, VARIABLE_NAME_HEADER]:
-        # update from table input (user changes values manually)
-        new_values = pd.DataFrame(rows)[active_cell['column_id']].values
-        col = active_cell['column_id']
-    
-    else:
-        raise PreventUpdate
-
-    # place new values in the app table cache
-    new_rows[col] = new_values
-    
-    # update values in the state
-    if col == VALUE_HEADER:
-        df.loc[df[WELL_NAME_HEADER] == well, scenario] = np.float64(new_values)
-    elif col == VARIABLE_NAME_HEADER:
-        col_name = f"{VARIABLE_NAME_HEADER} - {scenario}"
-        df.loc[df[WELL_NAME_HEADER] == well, col_name] = new_values
+    subset_table_update = dash.no_update
+    changed_wells = []
+    changed_scenarios = [scenario]
+
+    with STORE.edit(state['session']) as model:
+        if "confirm-update-all" == ctx.triggered_id and scope == SCOPE_SELECTION:
+            if not selection_scenarios or not has_parameters(operation, value=control_input,
+                                                             end=control_input_end, source=source):
+                raise PreventUpdate
+            # bulk operation on the selected time steps of the selected scenarios
+            selection = get_selection(model, query, state)
+            if not selection: raise PreventUpdate
+            changed_scenarios = [s_name for s_name in selection_scenarios if s_name in model.scenarios]
+            # undone as one action
+            with model.history.action():
+                for s_name in changed_scenarios:
+                    model.apply_bulk(s_name, selection.positions, operation,
+                                     value=control_input, end=control_input_end, source=source)
+            changed_wells = selection.wells
+
+            # place new values in the app table cache
+            if rows and well in changed_wells and scenario in changed_scenarios:
+                values = model.column_values(scenario)[model.index.positions([row[ID_HEADER] for row in rows])]
+                subset_table_update = [dict(row, **{VALUE_HEADER: float(value)}) for row, value in zip(rows, values)]
+
+        elif None in [well, scenario]:
+            # no action needed if there is no well or scenario selected
+            raise PreventUpdate
+
+        elif "confirm-update-all" == ctx.triggered_id:
+            if not has_parameters(operation, value=control_input, end=control_input_end, source=source):
+                raise PreventUpdate
+            # bulk operation of the update-all modal, one array operation over the rows of the scope
+            positions = model.apply_bulk(scenario, model.row_set(scope, well), operation,
+                                         value=control_input, end=control_input_end, source=source)
+            changed_wells = model.index.wells_at(positions)
+
+            # place new values in the app table cache
+            if rows:
+                values = model.column_values(scenario)[model.index.positions([row[ID_HEADER] for row in rows])]
+                subset_table_update = [dict(row, **{VALUE_HEADER: float(value)}) for row, value in zip(rows, values)]
 
-    new_rows = new_rows.to_dict('records') 
-    state['df'] = df.to_dict()
-
-    return state, new_rows, None
+        else:
+            # update from table input (user changes values manually)
+            # only the edited cells are applied, the table already shows them
+            changes = changed_cells(rows, previous_rows, [VALUE_HEADER, VARIABLE_NAME_HEADER])
+            if not changes: raise PreventUpdate
+
+            with model.history.action():
+                if VALUE_HEADER in changes:
+                    row_ids, new_values = changes[VALUE_HEADER]
+                    model.set_row_values(row_ids, scenario, np.float64(new_values))
+                    changed_wells = [well]
+                if VARIABLE_NAME_HEADER in changes:
+                    row_ids, new_values = changes[VARIABLE_NAME_HEADER]
+                    model.set_variable_names(scenario, row_ids, new_values)
+
+        # only the summary cells of the changed wells and scenarios change in the main table page
+        main_table_update = dash.no_update
+        main_tooltip_update = dash.no_update
+        visible_wells = set(changed_wells).intersection(main_row_ids or [])
+        if visible_wells:
+            summary = model.summary()
+            violations = model.violations()
+            main_table_update = Patch()
+            main_tooltip_update = Patch()
+            for i, row_id in enumerate(main_row_ids):
+                if row_id in visible_wells:
+                    for s_name in changed_scenarios:
+                        count = int(violations.at[row_id, s_name])
+                        main_table_update[i][s_name] = summary.at[row_id, s_name]
+                        main_table_update[i][violation_field(s_name)] = count
+                        if count:
+                            main_tooltip_update[i][s_name] = violation_tooltip(count)
+                        else:
+                            del main_tooltip_update[i][s_name]
+
+        state['version'] = STORE.put(state['session'], model)
+
+    return state, subset_table_update, main_table_update, main_tooltip_update
 
 
 ## Open or close popup to change time step table input
-@app.callback(
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='toggleModalUpdateAll'),
     Output("modal-update-all", "is_open"),
     Output("control-input", "value"),
+    Output("bulk-scope", "value"),
     Input("update-all", "n_clicks"),
+    Input("update-selection", "n_clicks"),
     Input("confirm-update-all", "n_clicks"),
     Input('cancel-update-all', 'n_clicks'),
     State("modal-update-all", "is_open"),
-    State("control-input", "value")
+    State("ui-metadata", "data"),
 )
-def toggle_modal_update_all(update_all_n, confirm_n, cancel_n, is_open, control_input):
-    if update_all_n or cancel_n or confirm_n:
-        return not is_open, None
-    return is_open, None
 
 
 ## Enable / disable button to confirm change in time step table input
-@app.callback(
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='confirmUpdateAllDisabled'),
     Output("confirm-update-all", "disabled"),
     Input("control-input", "value"),
+    Input("control-input-end", "value"),
+    Input("bulk-operation", "value"),
+    Input("bulk-source", "value"),
+    State("ui-metadata", "data"),
+)
+
+## Fill the scenarios to copy from in the update-all popup
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='scenarioOptions'),
+    Output("bulk-source", "options"),
+    Input("scenario-columns", "data"),
+)
+
+## Fill the scenarios of the selection
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='scenarioOptions'),
+    Output("selection-scenarios", "options"),
+    Input("scenario-columns", "data"),
+)
+
+## Show the size of the selection
+@callback(
+    Output("selection-info", "children"),
+    Output("update-selection", "disabled"),
+    Output("export-selection", "disabled"),
+    Input("selection-query", "value"),
+    Input("selection-scenarios", "value"),
+    State("state-store", "data"),
+    prevent_initial_call=True
 )
-def enable_confirm_button_update_all(control_input):
-    if control_input:
-        return False
-    return True
+@timed
+def show_selection(query, scenarios, state):
+    if not query or not query.strip():
+        return "", True, True
+
+    model = STORE.get(state['session'])
+    try:
+        selection = select(model, query, state['session'], STORE.version(state['session']))
+    except ValueError as error:
+        return f"Invalid selection: {error}", True, True
+
+    info = f"{len(selection)} time steps in {len(selection.wells)} wells"
+    return info, not (len(selection) and scenarios), not len(selection)
+
+## Download the selected time steps
+@callback(
+    Output("download-selection", "data"),
+    Input("export-selection", "n_clicks"),
+    State("selection-query", "value"),
+    State("selection-scenarios", "value"),
+    State("state-store", "data"),
+    prevent_initial_call=True
+)
+@timed
+def export_selection(_, query, scenarios, state):
+    model = STORE.get(state['session'])
+    selection = get_selection(model, query, state)
+    if not selection: raise PreventUpdate
+
+    # scenarios not chosen are left out with their variable names
+    df = model.to_frame().iloc[selection.positions]
+    dropped = [s_name for s_name in model.scenarios if scenarios and s_name not in scenarios]
+    df = df.drop(columns=dropped + [variable_name_col(s_name) for s_name in dropped])
+    return dcc.send_data_frame(df.to_csv, "selection.csv", index=False)
 
 ## Open or close popup to confirm reset table
-@app.callback(
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='toggleModal'),
     Output("modal-reset-table", "is_open"),
     Input("reset-table", "n_clicks"),
     Input("confirm-reset-table", "n_clicks"),
     Input('cancel-reset-table', 'n_clicks'),
-    State("modal-reset-table", "is_open")
+    State("modal-reset-table", "is_open"),
 )
-def toggle_modal_reset_table(reset_n, confirm_n, cancel_n, is_open):
-    if reset_n or cancel_n or confirm_n:
-        return not is_open
-    return is_open
 
 ## Open or close popup to add scenario
-@app.callback(
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='toggleModalClearInput'),
     Output("modal-add-scenario", "is_open"),
     Output("add-scenario-name", "value"),
     Input("add-scenario", "n_clicks"),
     Input("confirm-add-scenario", "n_clicks"),
     Input('cancel-add-scenario', 'n_clicks'),
-    State("modal-add-scenario", "is_open")
+    State("modal-add-scenario", "is_open"),
 )
-def toggle_modal_add_scenario(add_scenario_n, confirm_n, cancel_n, is_open):
-    if add_scenario_n or cancel_n or confirm_n:
-        return not is_open, None
-    return is_open, None
 
 
 ## Enable / disable button to confirm add scenario
-@app.callback(
+clientside_callback(
+    ClientsideFunction(namespace='tables', function_name='confirmAddScenarioDisabled'),
     Output("confirm-add-scenario", "disabled"),
     Input("add-scenario-name", "value"),
-    State("state-store", "data"),
+    State("scenario-columns", "data"),
+    State("ui-metadata", "data"),
 )
-def enable_confirm_button_add_scenario(name_input, state):
-    df = pd.DataFrame(state['df'])
-    col_names = [col.lower() for col in df.columns]
-    if name_input and name_input.lower() not in col_names:
-        return False
-    return True
 
 ## Update add scenario and trigger reloading of tables
 @app.callback(
     Output('trigger-table-update', 'children', allow_duplicate=True),
     Output("state-store", "data"),
-    Output("right-panel", "children", allow_duplicate=True),
+    *subset_outputs(),
     Input("confirm-add-scenario", "n_clicks"),
     Input("confirm-reset-table", "n_clicks"),
     State("state-store", "data"),
     State("add-scenario-name", "value"),
+    *subset_states(),
     prevent_initial_call=True
 )
-def trigger_main_table_update(confirm_add, confirm_reset, state, scenario):
+@timed
+def trigger_main_table_update(confirm_add, confirm_reset, state, scenario, *subset_page):
 
     if ("confirm-add-scenario" == ctx.triggered_id and scenario):
-        df = pd.DataFrame(state['df'])
-        # enter the control value for the new scenario
-        if DEFAULT_SCENARIO_COL in df.columns:
-            new_values = df[DEFAULT_SCENARIO_COL].values
-        else:
-            new_values = df[[LOWER_BOUND_HEADER, UPPER_BOUND_HEADER]].mean(axis=1).values
-
-        df[scenario] = new_values
-        df[f"{VARIABLE_NAME_HEADER} - {scenario}"] = df[VARIABLE_NAME_ORIGINAL]
-        right_panel_update = dash.no_update
+        with STORE.edit(state['session']) as model:
+            # also checked in the browser (see confirmAddScenarioDisabled), a double click or another tab still gets here
+            if model.name_taken(scenario): raise PreventUpdate
+            # enter the control value for the new scenario, a copy of the default shares its values until edited
+            if DEFAULT_SCENARIO_COL in model.scenarios:
+                model.add_scenario(scenario, parent=DEFAULT_SCENARIO_COL)
+            else:
+                df = model.df
+                model.add_scenario(scenario, df[[LOWER_BOUND_HEADER, UPPER_BOUND_HEADER]].mean(axis=1).values)
+            state['version'] = STORE.put(state['session'], model)
+        return None, state, *[dash.no_update] * N_SUBSET_OUTPUTS
 
     elif ("confirm-reset-table" == ctx.triggered_id):
-        df = get_dataset(ORIGINAL_DATASET)
-        right_panel_update = make_right_panel(df, None, None)
+        model = ScenarioTableModel(get_dataset(ORIGINAL_DATASET))
+        state['version'] = STORE.replace(state['session'], model)
+        state['active_well'] = None
+        state['active_scenario'] = None
+        return None, state, *subset_update(model, state, *subset_page)
 
-    else:
-        raise PreventUpdate
+    raise PreventUpdate
+
+## Undo or redo the last edit of the session, the tables are reloaded
+@app.callback(
+    Output('trigger-table-update', 'children', allow_duplicate=True),
+    Output("state-store", "data", allow_duplicate=True),
+    *subset_outputs(),
+    Input("undo", "n_clicks"),
+    Input("redo", "n_clicks"),
+    State("state-store", "data"),
+    *subset_states(),
+    prevent_initial_call=True
+)
+@timed
+def undo_redo(undo_n, redo_n, state, page_current, page_size, sort_by, filter_query):
+
+    with STORE.edit(state['session']) as model:
+        history = model.history
+        if not (history.undo(model) if "undo" == ctx.triggered_id else history.redo(model)):
+            raise PreventUpdate
 
-    state['df'] = df.to_dict('records')
+        state['version'] = STORE.put(state['session'], model)
 
-    return None, state, right_panel_update
+    if state['active_scenario'] in model.scenarios:
+        # same time step table, with the restored values
+        data, page_count = make_subset_page(model, state['active_well'], state['active_scenario'],
+                                            page_current, page_size, sort_by, filter_query,
+                                            session=state['session'], version=STORE.version(state['session']))
+        return None, state, data, page_count, *[dash.no_update] * (N_SUBSET_OUTPUTS - 2)
 
-## Save all scenarios
+    # the scenario shown on the right was added by the undone edit, or dropped again
+    state['active_well'] = None
+    state['active_scenario'] = None
+    return None, state, *subset_update(model, state, page_current, page_size, sort_by, filter_query)
+
+## Enable / disable undo and redo, both start disabled
+@app.callback(
+    Output("undo", "disabled"),
+    Output("redo", "disabled"),
+    Input("state-store", "data"),
+    prevent_initial_call=True
+)
+@timed
+def enable_undo_redo(state):
+    history = STORE.get(state['session']).history
+    return not history.can_undo, not history.can_redo
+
+## Save all scenarios: the wells changed since the last save are written in the background
 @app.callback(
-    Output("save-table-toast", "is_open"),
+    Output("save-job", "data"),
+    Output("save-poll", "disabled"),
+    Output("state-store", "data", allow_duplicate=True),
     Input("save-scenarios", "n_clicks"),
     State("state-store", "data"),
     prevent_initial_call=True
 )
+@timed
 def save_table_to_file(_, state):
-    #df = pd.DataFrame(state['df'])
-    #table_handle = dataiku.Dataset(MODIFIED_DATASET)
-    #table_handle.write_with_schema(df) 
-    return True
+    with STORE.edit(state['session']) as model:
+        job = WRITER.save(model)
+        # the model is stored with its cleared dirty set
+        state['version'] = STORE.put(state['session'], model)
+    return job, False, state
+
+## Report the save once it is on disk
+@app.callback(
+    Output("save-scenario-toast", "is_open"),
+    Output("save-scenario-toast", "header"),
+    Output("save-scenario-toast", "children"),
+    Output("save-poll", "disabled", allow_duplicate=True),
+    Input("save-poll", "n_intervals"),
+    State("save-job", "data"),
+    prevent_initial_call=True
+)
+@timed
+def report_save(_, job):
+    result = WRITER.poll(job)
+    if result is None:
+        raise PreventUpdate
+    saved, message = result
+    if saved:
+        return True, "Success", [html.P("Senarios have been saved!", className="mb-0"), html.Small(message)], True
+    return True, "Error", html.P(message, className="mb-0"), True
 
 
 if __name__ == '__main__':
@@ -0,0 +1,29 @@
+import os
+
+import pandas as pd
+import pytest
+
+from ui.schema import compact_frame
+from ui.table_model import ScenarioTableModel
+from ui.utils import ID_HEADER
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+
+
+def load_forecast():
+    df = compact_frame(pd.read_csv(os.path.join(DATA_PATH, 'ForecastControlsTable.csv')))
+    df.insert(0, ID_HEADER, df.index)
+    return df
+
+
+@pytest.fixture(scope='session')
+def forecast():
+    return load_forecast()
+
+
+@pytest.fixture
+def make_model(forecast):
+
+    """ New scenario table model of the forecast dataset per call """
+
+    return lambda: ScenarioTableModel(forecast.copy())
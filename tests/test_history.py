@@ -0,0 +1,177 @@
+import pickle
+
+import numpy as np, pandas as pd
+import pytest
+
+from ui.history import History
+from ui.table_model import ScenarioTableModel, MATERIALIZE_FRACTION
+from ui.utils import DEFAULT_SCENARIO_COL
+
+
+@pytest.fixture
+def model(make_model):
+    model = make_model()
+    # summary and violations are kept up to date by the edits from now on
+    model.summary()
+    model.violations()
+    return model
+
+
+def assert_table(model, expected):
+    frame, scenarios = expected
+    pd.testing.assert_frame_equal(model.to_frame(), frame)
+    assert model.scenarios == scenarios
+    # the summary and violations updated by the deltas are the ones of the table
+    rebuilt = ScenarioTableModel(model.to_frame())
+    pd.testing.assert_frame_equal(model.summary(), rebuilt.summary())
+    pd.testing.assert_frame_equal(model.violations(), rebuilt.violations())
+
+
+def table(model):
+    return model.to_frame(), model.scenarios
+
+
+def check_undo_redo(model, edit):
+    before = table(model)
+    edit(model)
+    after = table(model)
+    assert model.history.can_undo
+
+    assert model.history.undo(model)
+    assert_table(model, before)
+    assert model.history.can_redo
+    assert model.history.redo(model)
+    assert_table(model, after)
+
+
+def rename_first_row(scenario, well, name):
+    return lambda model: model.set_variable_names(
+        scenario, [model.index.ids[model.index.well_slice(well).start]], [name])
+
+
+@pytest.mark.parametrize('edit', [
+    lambda model: model.set_row_values([0, 1, 2], 'Scenario 1', np.float64([1, 2, 3])),
+    lambda model: model.set_well_values('P2', DEFAULT_SCENARIO_COL, 1e9),
+    lambda model: model.apply_bulk('Scenario 2', model.row_set('all'), 'scale', value=2),
+    rename_first_row('Scenario 1', 'I3', 'renamed'),
+    lambda model: model.add_scenario('New', np.arange(180.0)),
+    lambda model: model.add_scenario('New', np.arange(180.0), index=0),
+    lambda model: model.add_scenario('Copy', parent='Scenario 1'),
+    lambda model: model.drop_scenarios(['Scenario 2']),
+    lambda model: model.drop_scenarios([DEFAULT_SCENARIO_COL, 'Scenario 1']),
+], ids=['values', 'well', 'bulk', 'rename', 'add', 'add first', 'add virtual', 'drop', 'drop two'])
+def test_undo_redo(model, edit):
+    check_undo_redo(model, edit)
+
+
+def test_undo_redo_virtual_scenario(model):
+    model.add_scenario('Copy', parent=DEFAULT_SCENARIO_COL)
+    # the parent changes: the child keeps the values it shared
+    check_undo_redo(model, lambda model: model.set_well_values('I1', DEFAULT_SCENARIO_COL, 5.0))
+    check_undo_redo(model, lambda model: model.set_well_values('I2', 'Copy', 6.0))
+    check_undo_redo(model, rename_first_row('Copy', 'I2', 'renamed'))
+
+
+def test_undo_redo_materialized_scenario(model):
+    model.add_scenario('Copy', parent=DEFAULT_SCENARIO_COL)
+    start = table(model)
+    wells = model.wells[:int(MATERIALIZE_FRACTION * len(model.wells)) + 1]
+    for value, well in enumerate(wells):
+        model.set_well_values(well, 'Copy', float(value))
+    assert not model.is_virtual('Copy')
+    edited = table(model)
+
+    for _ in wells:
+        model.history.undo(model)
+    assert_table(model, start)
+    for _ in wells:
+        model.history.redo(model)
+    assert_table(model, edited)
+
+
+def test_undo_redo_drop_of_a_parent(model):
+    model.add_scenario('Copy', parent='Scenario 1')
+    model.add_scenario('Copy of copy', parent='Copy')
+    model.set_well_values('P1', 'Copy', 3.0)
+    # the children keep their values, the virtual one now shares the wells of its grandparent
+    check_undo_redo(model, lambda model: model.drop_scenarios(['Copy']))
+    check_undo_redo(model, lambda model: model.drop_scenarios(['Scenario 1']))
+
+
+def test_undo_all_then_redo_all(model):
+    edits = [
+        lambda model: model.add_scenario('Copy', parent=DEFAULT_SCENARIO_COL),
+        lambda model: model.set_well_values('I4', 'Copy', 1.0),
+        rename_first_row('Copy', 'I4', 'renamed'),
+        lambda model: model.drop_scenarios(['Scenario 2']),
+        lambda model: model.add_scenario('New', np.zeros(180)),
+        lambda model: model.set_row_values([7], 'New', np.float64([4])),
+    ]
+    tables = [table(model)]
+    for edit in edits:
+        edit(model)
+        tables.append(table(model))
+
+    for expected in reversed(tables[:-1]):
+        assert model.history.undo(model)
+        assert_table(model, expected)
+    assert not model.history.undo(model)
+    for expected in tables[1:]:
+        assert model.history.redo(model)
+        assert_table(model, expected)
+    assert not model.history.redo(model)
+
+
+def test_action_is_one_entry(model):
+    before = table(model)
+    with model.history.action():
+        model.set_well_values('I1', 'Scenario 1', 1.0)
+        model.add_scenario('New', np.zeros(180))
+        model.set_well_values('I1', 'New', 2.0)
+    assert len(model.history.undo_entries) == 1
+    model.history.undo(model)
+    assert_table(model, before)
+
+
+def test_new_edit_drops_redo(model):
+    model.set_well_values('I1', 'Scenario 1', 1.0)
+    model.history.undo(model)
+    model.set_well_values('I2', 'Scenario 1', 2.0)
+    assert not model.history.can_redo
+    assert not model.history.redo(model)
+
+
+def test_history_budget():
+    history = History(max_bytes=10_000, max_entries=3)
+    for _ in range(5):
+        history.record(_Delta(1000))
+    # the oldest entries go first
+    assert len(history.undo_entries) == 3
+    assert history.nbytes == 3 * 1000
+
+    history.record(_Delta(20_000))
+    # an edit above the budget can't be undone, nor the ones before it
+    assert not history.can_undo and history.nbytes == 0
+
+
+def test_history_pickles_with_the_model(model):
+    model.set_well_values('I1', 'Scenario 1', 1.0)
+    model.add_scenario('Copy', parent='Scenario 1')
+    before = table(model)
+    copy = pickle.loads(pickle.dumps(model))
+    assert copy.history.nbytes == model.history.nbytes
+
+    copy.history.undo(copy)
+    copy.history.undo(copy)
+    model.history.undo(model)
+    model.history.undo(model)
+    assert_table(copy, table(model))
+    copy.history.redo(copy)
+    copy.history.redo(copy)
+    assert_table(copy, before)
+
+
+class _Delta:
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
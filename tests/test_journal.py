@@ -0,0 +1,130 @@
+import os
+
+import numpy as np, pandas as pd
+import pytest
+
+from ui.history import ValueDelta
+from ui.journal import ENTRY, Journal
+from ui.session_store import MemoryBackend, SessionStore
+from ui.utils import DEFAULT_SCENARIO_COL
+
+
+@pytest.fixture
+def store(tmp_path, make_model):
+    return SessionStore(make_model, MemoryBackend(), Journal(str(tmp_path)))
+
+
+def edit(store, token, change):
+    with store.edit(token) as model:
+        change(model)
+        store.put(token, model)
+
+
+def edits(store, token):
+    # values, a rename, a virtual scenario edited until it is a column, an undo and a redo
+    edit(store, token, lambda model: model.set_row_values([0, 1, 2], 'Scenario 1', np.float64([1, 2, 3])))
+    edit(store, token, lambda model: model.set_variable_names('Scenario 2', [5], ['renamed']))
+    edit(store, token, lambda model: model.add_scenario('Copy', parent=DEFAULT_SCENARIO_COL))
+    for well in ['I1', 'I2', 'I3']:
+        edit(store, token, lambda model: model.set_well_values(well, 'Copy', 9.0))
+    edit(store, token, lambda model: model.drop_scenarios(['Scenario 2']))
+    edit(store, token, lambda model: model.history.undo(model))
+    edit(store, token, lambda model: model.history.undo(model))
+    edit(store, token, lambda model: model.history.redo(model))
+
+
+def evict(store, token):
+    expected = store.get(token)
+    store.backend.delete(token)
+    return expected
+
+
+def assert_same(model, expected):
+    pd.testing.assert_frame_equal(model.to_frame(), expected.to_frame())
+    assert model.scenarios == expected.scenarios
+    assert model.history.can_undo == expected.history.can_undo
+    assert model.history.can_redo == expected.history.can_redo
+
+
+def test_unedited_session_has_no_journal(store):
+    token = store.new_token()
+    store.get(token)
+    assert not os.listdir(store.journal.path)
+
+
+def test_recover_after_eviction(store):
+    token = store.new_token()
+    edits(store, token)
+    expected = evict(store, token)
+
+    model = store.get(token)
+    assert model is not expected
+    assert_same(model, expected)
+    assert not model.is_virtual('Copy')
+
+    # the history is replayed too
+    model.history.undo(model)
+    expected.history.undo(expected)
+    assert_same(model, expected)
+
+
+def test_recover_after_compaction(store):
+    token = store.new_token()
+    edits(store, token)
+    log_path = store.journal._files(token)[0]
+    size = os.path.getsize(log_path)
+
+    assert store.journal.compact(token)
+    assert os.path.getsize(log_path) < size
+    edit(store, token, lambda model: model.set_row_values([3], DEFAULT_SCENARIO_COL, np.float64([7])))
+    expected = evict(store, token)
+
+    assert_same(store.get(token), expected)
+
+
+def test_compaction_aborts_after_rebase(store, make_model):
+    token = store.new_token()
+    edits(store, token)
+    journal = store.journal
+    dump_snapshot = journal._dump_snapshot
+
+    def reset_meanwhile(*args):
+        # a reset between the replay and the swap of the files
+        journal._dump_snapshot = dump_snapshot
+        store.replace(token, make_model())
+        return dump_snapshot(*args)
+
+    journal._dump_snapshot = reset_meanwhile
+    assert not journal.compact(token)
+    assert not [name for name in os.listdir(journal.path) if name.endswith('.tmp')]
+
+    expected = evict(store, token)
+    assert not expected.history.can_undo
+    assert_same(store.get(token), expected)
+
+
+def test_torn_tail_is_dropped(store):
+    token = store.new_token()
+    edits(store, token)
+    expected = evict(store, token)
+    log_path = store.journal._files(token)[0]
+    with open(log_path, 'ab') as f:
+        f.write(b'\x01\x02\x03')
+
+    assert_same(store.get(token), expected)
+    edit(store, token, lambda model: model.set_row_values([4], DEFAULT_SCENARIO_COL, np.float64([8])))
+    expected = evict(store, token)
+    assert_same(store.get(token), expected)
+
+
+def test_failed_replay_falls_back_to_the_loader(store, make_model):
+    token = store.new_token()
+    edits(store, token)
+    journal = store.journal
+    log = journal._get_log(token)
+    journal._append(token, log, [(ENTRY, [ValueDelta('Missing', [0], [1.0], [2.0])])])
+    evict(store, token)
+
+    assert journal.recover(token) is None
+    assert not os.path.exists(journal._files(token)[0])
+    assert_same(store.get(token), make_model())
@@ -0,0 +1,123 @@
+import os, threading
+
+import numpy as np, pandas as pd
+import pytest
+
+import ui.persistence
+from ui.persistence import PARTITIONS_DIR, TableWriter
+from ui.schema import compact_frame
+from ui.utils import DEFAULT_SCENARIO_COL
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    # 9 wells of 20 rows: 5 partitions of 2 wells, the last one of 1
+    monkeypatch.setattr(ui.persistence, 'PARTITION_ROWS', 40)
+    return TableWriter(str(tmp_path), prepare=compact_frame)
+
+
+def save(writer, model):
+    return writer.wait(writer.save(model), timeout=10)
+
+
+def assert_saved(writer, model):
+    df, generation = writer.load()
+    pd.testing.assert_frame_equal(df, compact_frame(model.to_frame()))
+    assert generation == model.dirty.base
+
+
+def partition_files(writer):
+    return set(os.listdir(os.path.join(writer.path, PARTITIONS_DIR)))
+
+
+def test_full_then_partial_save(writer, make_model):
+    model = make_model()
+    assert writer.load() is None
+    assert save(writer, model) == (True, "9 of 9 wells written (5 partitions).")
+    assert_saved(writer, model)
+
+    model.set_well_values('I2', 'Scenario 1', 5.0)
+    model.set_variable_names('Scenario 2', [model.index.ids[model.index.well_slice('P2').start]], ['renamed'])
+    assert save(writer, model) == (True, "2 of 9 wells written (2 partitions).")
+    assert_saved(writer, model)
+
+    # nothing changed
+    assert save(writer, model) == (True, "0 of 9 wells written (0 partitions).")
+    assert_saved(writer, model)
+
+
+def test_new_scenario_rewrites_every_partition(writer, make_model):
+    model = make_model()
+    save(writer, model)
+    model.add_scenario('Copy', parent=DEFAULT_SCENARIO_COL)
+    model.drop_scenarios(['Scenario 2'])
+    assert save(writer, model) == (True, "9 of 9 wells written (5 partitions).")
+    assert_saved(writer, model)
+
+
+def test_previous_save_files_are_kept(writer, make_model):
+    model = make_model()
+    save(writer, model)
+    first = partition_files(writer)
+    model.set_well_values('I1', 'Scenario 1', 5.0)
+    save(writer, model)
+    second = partition_files(writer)
+    assert first < second
+
+    model.set_well_values('I1', 'Scenario 1', 6.0)
+    save(writer, model)
+    # the file of I1 in the first save is gone, the one of the second save is kept
+    assert len(partition_files(writer)) == len(second)
+    assert_saved(writer, model)
+
+
+def test_save_after_failed_save(writer, make_model, monkeypatch):
+    model = make_model()
+    save(writer, model)
+
+    started, release = threading.Event(), threading.Event()
+    write_columns = ui.persistence.write_columns
+
+    def failing_write(*args, **kwargs):
+        started.set()
+        release.wait(10)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(ui.persistence, 'write_columns', failing_write)
+    model.set_well_values('I1', 'Scenario 1', 5.0)
+    failed = writer.save(model)
+    started.wait(10)
+
+    # queued while the first one is written, only I4 is dirty since
+    model.set_well_values('I4', 'Scenario 1', 7.0)
+    queued = writer.save(model)
+    monkeypatch.setattr(ui.persistence, 'write_columns', write_columns)
+    release.set()
+
+    assert writer.wait(failed, timeout=10) == (False, "Save failed: disk full")
+    assert writer.wait(queued, timeout=10) == (True, "9 of 9 wells written (5 partitions).")
+    assert_saved(writer, model)
+
+    # the next save builds on it again
+    model.set_well_values('P5', 'Scenario 1', 8.0)
+    assert save(writer, model) == (True, "1 of 9 wells written (1 partitions).")
+    assert_saved(writer, model)
+
+
+def test_save_after_failed_save_is_full(writer, make_model, monkeypatch):
+    model = make_model()
+    save(writer, model)
+
+    def failing_write(*args, **kwargs):
+        raise OSError("disk full")
+
+    write_columns = ui.persistence.write_columns
+    monkeypatch.setattr(ui.persistence, 'write_columns', failing_write)
+    model.set_well_values('I1', 'Scenario 1', 5.0)
+    assert save(writer, model) == (False, "Save failed: disk full")
+
+    monkeypatch.setattr(ui.persistence, 'write_columns', write_columns)
+    model.set_well_values('I4', 'Scenario 1', 7.0)
+    assert save(writer, model) == (True, "9 of 9 wells written (5 partitions).")
+    assert_saved(writer, model)
+    assert np.all(model.column_values('Scenario 1')[model.index.well_slice('I1')] == 5.0)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from ui.selection import compile_selection, select
+from ui.utils import DEFAULT_SCENARIO_COL
+
+
+@pytest.fixture
+def model(make_model):
+    return make_model()
+
+
+@pytest.mark.parametrize('query, n_rows, wells', [
+    ('Well Type == "Injector"', 80, ['I1', 'I2', 'I3', 'I4']),
+    ("Well Type != 'Injector'", 100, ['P1', 'P2', 'P3', 'P4', 'P5']),
+    ('Time >= 365 and Well Name in ["I1", "P1"]', 28, ['I1', 'P1']),
+    ('not Well Control == "BHP" and Well Type == "Producer"', 40, ['P2', 'P4']),
+    ('Well Name contains "P" and (Time < 120 or Time > 1140)', 10, ['P1', 'P2', 'P3', 'P4', 'P5']),
+    ('`Well Name` == "I2" AND Time <= 60.0', 1, ['I2']),
+    ('Default Scenario >= Lower Bound and Default Scenario <= Upper Bound', 180, None),
+    ('Default Scenario > Upper Bound', 0, []),
+])
+def test_select(model, query, n_rows, wells):
+    selection = select(model, query)
+    assert len(selection) == n_rows
+    if wells is not None:
+        assert selection.wells == wells
+    assert selection.well_counts.sum() == n_rows
+
+
+def test_select_virtual_scenario(model):
+    model.add_scenario('Copy', parent=DEFAULT_SCENARIO_COL)
+    assert len(select(model, f'Copy == {DEFAULT_SCENARIO_COL}')) == len(model.df)
+
+    model.set_well_values('P3', 'Copy', -1.0)
+    selection = select(model, 'Copy < 0')
+    assert selection.wells == ['P3']
+    assert np.array_equal(selection.positions, np.arange(len(model.df))[model.index.well_slice('P3')])
+
+
+def test_select_is_cached_per_version(model):
+    selection = select(model, 'Time > 600', 'session', 'v1')
+    assert select(model, ' Time > 600 ', 'session', 'v1') is selection
+    assert select(model, 'Time > 600', 'session', 'v2') is not selection
+    # nothing is cached without a version
+    assert select(model, 'Time > 600', 'session') is not select(model, 'Time > 600', 'session')
+
+
+@pytest.mark.parametrize('query, error', [
+    ('', "Empty selection"),
+    ('Time >=', "Expected a value"),
+    ('Time 3', "Unknown operator"),
+    ('Foo == 1', "Unknown column or keyword: Foo"),
+    ('`Foo` == 1', "Unknown column: Foo"),
+    ('Time == Well', "Unknown column or keyword: Well"),
+    ('Time >= 1 )', "Unexpected token"),
+    ('(Time >= 1', "Missing closing parenthesis"),
+    ('Time in 1', "Expected \\[ after in"),
+    ('Time in [1, 2', "Missing closing bracket"),
+    ('Time ~ 1', "Invalid selection at"),
+    ('Well Name < 3', "Can't compare"),
+    ('1 == Time', "Expected a column"),
+])
+def test_malformed_selection(model, query, error):
+    with pytest.raises(ValueError, match=error):
+        select(model, query)
+
+
+def test_compile_selection_knows_only_its_columns():
+    with pytest.raises(ValueError, match="Unknown column or keyword: Time"):
+        compile_selection('Time > 1', ('Well Name',))
@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+
+from ui.table_query import compile_filter, filter_frame, page_frame
+
+
+@pytest.fixture
+def df():
+    # a summary column mixes numbers, missing values and text
+    return pd.DataFrame({'Well Name': ['I1', 'I2', 'P1', 'P2', 'P10'], 'Time': [30, 60, 90, 120, 150],
+                         'Value': [1.5, None, 3.0, 'varying', ' ']})
+
+
+@pytest.mark.parametrize('query, wells', [
+    ('{Time} >= 60', ['I2', 'P1', 'P2', 'P10']),
+    ('{Time} ge 60 && {Well Name} contains P', ['P1', 'P2', 'P10']),
+    ('{Well Name} = I1 || {Well Name} = "P2"', ['I1', 'P2']),
+    ('!({Time} < 90)', ['P1', 'P2', 'P10']),
+    ('not {Time} = 30 and {Time} lt 100', ['I2', 'P1']),
+    ('{Well Name} icontains "p"', ['P1', 'P2', 'P10']),
+    ('{Well Name} contains "p"', []),
+    ('{Well Name} i= "p1"', ['P1']),
+    ("{Well Name} s= 'p1'", []),
+    ('{Well Name} datestartswith P1', ['P1', 'P10']),
+    ('{Value} > 1', ['I1', 'P1']),
+    ('{Value} != 1.5', ['I2', 'P1', 'P2', 'P10']),
+    ('{Time} > {Value}', ['I1', 'P1']),
+    ('{Value} is nil', ['I2']),
+    ('{Value} is blank', ['I2', 'P10']),
+    ('{Value} is num', ['I1', 'P1']),
+    ('{Value} is str', ['P2', 'P10']),
+])
+def test_filter(df, query, wells):
+    assert filter_frame(df, query)['Well Name'].tolist() == wells
+
+
+@pytest.mark.parametrize('query', [
+    '', '   ', '{Time} >=', '{Time} foo 3', '({Time} > 3', '{Time} > 3 )', 'Time > 3',
+    '{Time} is odd', '"open', '{Time} > 3 &&',
+])
+def test_malformed_filter_is_ignored(df, query):
+    # as the DataTable does, the table is shown unfiltered
+    assert compile_filter(query) is None
+    assert filter_frame(df, query) is df
+
+
+def test_unknown_column_is_ignored(df):
+    assert filter_frame(df, '{Missing} > 3') is df
+
+
+def test_page_frame(df):
+    page, page_count = page_frame(df, 1, 2)
+    assert page['Well Name'].tolist() == ['P1', 'P2']
+    assert page_count == 3
+
+    # numbers first, then the missing values and the text in table order
+    page, _ = page_frame(df, 1, 2, [{'column_id': 'Value', 'direction': 'desc'}])
+    assert page['Well Name'].tolist() == ['I2', 'P2']
+
+    page, page_count = page_frame(df, 0, 2, [{'column_id': 'Value', 'direction': 'asc'}], '{Time} > 30')
+    assert page['Well Name'].tolist() == ['P1', 'I2']
+    assert page_count == 2
+
+
+def test_page_frame_of_empty_filter(df):
+    page, page_count = page_frame(df, 0, 10, filter_query='{Time} > 1000')
+    assert page.empty and page_count == 1
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np, pandas as pd
+import pytest
+
+from ui.schema import compact_frame, is_name_column
+from ui.wire import encode_frame, decode_frame, dumps_frame, loads_frame
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+DATASETS = ['ForecastControlsTable.csv', 'OptimizationVariablesTable.csv']
+
+
+def load(name, control_dtype=None):
+    df = compact_frame(pd.read_csv(os.path.join(DATA_PATH, name)), control_dtype)
+    # missing names, as a scenario without a name override has
+    for col in [col for col in df.columns if is_name_column(col)]:
+        df.loc[::7, col] = np.nan
+    return df
+
+
+@pytest.mark.parametrize('name', DATASETS)
+@pytest.mark.parametrize('control_dtype', ['float64', 'float32'])
+def test_round_trip(name, control_dtype):
+    df = load(name, control_dtype)
+    assert (df.dtypes == control_dtype).any()
+
+    decoded = decode_frame(encode_frame(df))
+    pd.testing.assert_frame_equal(decoded, df)
+
+
+@pytest.mark.parametrize('name', DATASETS)
+def test_round_trip_json(name):
+    df = load(name)
+    pd.testing.assert_frame_equal(loads_frame(dumps_frame(df)), df)
+
+
+@pytest.mark.parametrize('name', DATASETS)
+def test_dtypes(name):
+    decoded = decode_frame(encode_frame(load(name)))
+    assert isinstance(decoded['Well Name'].dtype, pd.CategoricalDtype)
+    assert decoded['Time'].dtype == np.int32
+    names = decoded['Variable Name - Original']
+    assert names.dtype == object and names.isna().sum() == len(names[::7])
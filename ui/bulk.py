@@ -0,0 +1,114 @@
+import numpy as np
+
+from ui.utils import LOWER_BOUND_HEADER, UPPER_BOUND_HEADER, TIME_HEADER
+
+# operation: label in the update-all modal
+BULK_OPERATIONS = {
+    'set': 'Set to value',
+    'scale': 'Multiply by value',
+    'offset': 'Add value',
+    'clip': 'Clip to bounds',
+    'ramp': 'Ramp from value to end value',
+    'copy': 'Copy from',
+}
+
+# parameters each operation needs
+BULK_PARAMETERS = {
+    'set': ['value'],
+    'scale': ['value'],
+    'offset': ['value'],
+    'clip': [],
+    'ramp': ['value', 'end'],
+    'copy': ['source'],
+}
+
+SCOPE_WELL = 'well'
+SCOPE_TYPE = 'type'
+SCOPE_ALL = 'all'
+# rows of a selection query (see ui.selection), resolved by the app
+SCOPE_SELECTION = 'selection'
+BULK_SCOPES = {
+    SCOPE_WELL: 'Selected well',
+    SCOPE_TYPE: 'Wells of the same type',
+    SCOPE_ALL: 'All wells',
+}
+
+
+def bulk_options(labels):
+    return [{'label': label, 'value': key} for key, label in labels.items()]
+
+
+def has_parameters(operation, **params):
+
+    """ Whether the parameters the operation needs are filled in """
+
+    return operation in BULK_PARAMETERS and all(params.get(name) not in (None, '')
+                                                 for name in BULK_PARAMETERS[operation])
+
+
+def ramp_fraction(positions, time, starts):
+
+    """
+    Where each row sits between the first (0) and the last (1) time step of its well, among the given rows.
+    positions must be sorted, starts are the first rows of the wells (see TableIndex).
+    """
+
+    groups = np.searchsorted(starts, positions, side='right') - 1
+    segments = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    sizes = np.diff(np.r_[segments, len(positions)])
+
+    time = time[positions].astype(np.float64)
+    t_min = np.repeat(np.minimum.reduceat(time, segments), sizes)
+    span = np.repeat(np.maximum.reduceat(time, segments), sizes) - t_min
+    return np.divide(time - t_min, span, out=np.zeros_like(time), where=span > 0)
+
+
+def _required(value, name):
+    if value is None:
+        raise ValueError(f"Missing {name}")
+    return float(value)
+
+
+def bulk_values(model, col, positions, operation, value=None, end=None, source=None):
+
+    """ New values of a column at the row positions (sorted) after a bulk operation """
+
+    if operation not in BULK_OPERATIONS:
+        raise ValueError(f"Unknown bulk operation: {operation}")
+
+    if operation == 'set':
+        return np.full(len(positions), _required(value, 'value'))
+    if operation == 'copy':
+        if source is None: raise ValueError("Missing source column")
+        return np.asarray(model.column_values(source)[positions], dtype=np.float64)
+
+    current = np.asarray(model.column_values(col)[positions], dtype=np.float64)
+    if operation == 'scale':
+        return current * _required(value, 'value')
+    if operation == 'offset':
+        return current + _required(value, 'value')
+    if operation == 'clip':
+        # fmin / fmax ignore a missing bound
+        lower = model.df[LOWER_BOUND_HEADER].to_numpy(dtype=np.float64)[positions]
+        upper = model.df[UPPER_BOUND_HEADER].to_numpy(dtype=np.float64)[positions]
+        return np.fmax(np.fmin(current, upper), lower)
+
+    start, end = _required(value, 'value'), _required(end, 'end value')
+    # without a time column the time steps are evenly spaced
+    time = (model.df[TIME_HEADER].to_numpy() if TIME_HEADER in model.df.columns
+            else np.arange(len(model.df)))
+    return start + ramp_fraction(positions, time, model.index.starts) * (end - start)
+
+
+def apply_bulk(model, col, positions, operation, value=None, end=None, source=None):
+
+    """
+    Apply a bulk operation to a column of the table model at the row positions,
+    as one array operation over all the rows. Returns the sorted positions.
+    """
+
+    positions = np.unique(np.asarray(positions, dtype=np.int64))
+    if len(positions):
+        model.set_position_values(positions, col, bulk_values(model, col, positions, operation,
+                                                              value, end, source))
+    return positions
@@ -0,0 +1,173 @@
+import json, os, sys, threading
+
+import pandas as pd, numpy as np
+
+CACHE_DIR_NAME = '.cache'
+SIDECAR_VERSION = 1
+META_KEY = '__meta__'
+
+READERS = {
+    '.csv': pd.read_csv,
+    '.txt': lambda path: pd.read_csv(path, sep=None, engine='python'),
+    '.parquet': pd.read_parquet,
+    '.feather': pd.read_feather,
+}
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_source(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in READERS:
+        raise ValueError(f"Unsupported dataset format: {ext}")
+    return READERS[ext](path)
+
+
+def write_columns(df, path, meta=None, durable=False):
+
+    """
+    Binary columnar copy of a table: one .npy array per column in an uncompressed .npz.
+    Text columns are stored as int32 codes plus an array of their distinct values.
+    meta is kept with the columns. Written to a temporary file renamed over path,
+    durable also flushes the file to disk before the rename.
+    """
+
+    arrays, columns = {}, []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        key = f"c{i}"
+        if pd.api.types.is_numeric_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+            arrays[key] = series.to_numpy()
+            columns.append({'name': col, 'dtype': str(series.dtype)})
+        else:
+            codes, categories = pd.factorize(series, use_na_sentinel=True)
+            arrays[key] = codes.astype(np.int32)
+            categories = pd.Index(categories).astype(object)
+            if all(isinstance(c, str) for c in categories):
+                arrays[f"{key}_categories"] = np.asarray(categories, dtype=str)
+                columns.append({'name': col, 'dtype': str(series.dtype), 'categories': None})
+            else:
+                columns.append({'name': col, 'dtype': str(series.dtype), 'categories': categories.tolist()})
+
+    meta = dict(meta or {}, length=len(df), columns=columns)
+    arrays[META_KEY] = np.array(json.dumps(meta))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_meta(arrays):
+    return json.loads(str(arrays[META_KEY]))
+
+
+def decode_columns(arrays, meta):
+
+    """ Table of the arrays of a file written by write_columns, text values are interned """
+
+    data = {}
+    for i, column in enumerate(meta['columns']):
+        values = arrays[f"c{i}"]
+        if 'categories' in column:
+            distinct = column['categories']
+            if distinct is None: distinct = arrays[f"c{i}_categories"].tolist()
+            categories = np.empty(len(distinct) + 1, dtype=object)
+            categories[:-1] = [sys.intern(c) if isinstance(c, str) else c for c in distinct]
+            categories[-1] = np.nan
+            if column['dtype'] == 'category':
+                values = pd.Categorical.from_codes(values, categories=categories[:-1])
+            else:
+                # code -1 picks the trailing missing value
+                values = categories[values]
+        data[column['name']] = values
+    return pd.DataFrame(data, columns=[c['name'] for c in meta['columns']])
+
+
+def read_columns(path):
+
+    """ Table and meta of a file written by write_columns """
+
+    with np.load(path, allow_pickle=False) as arrays:
+        meta = read_meta(arrays)
+        return decode_columns(arrays, meta), meta
+
+
+def write_sidecar(df, sidecar_path, signature, schema=None):
+
+    """ Binary columnar copy of a dataset (see write_columns), tagged with its source and schema """
+
+    write_columns(df, sidecar_path, {'version': SIDECAR_VERSION, 'source': signature, 'schema': schema})
+
+
+def read_sidecar(sidecar_path, signature, schema=None):
+
+    """
+    Dataset from its sidecar, None if there is no sidecar or if the source or
+    the schema changed since it was written. Text values are interned.
+    """
+
+    try:
+        with np.load(sidecar_path, allow_pickle=False) as arrays:
+            meta = read_meta(arrays)
+            if (meta.get('version') != SIDECAR_VERSION or meta.get('source') != signature
+                    or meta.get('schema') != schema):
+                return None
+            return decode_columns(arrays, meta)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class DatasetLoader:
+
+    """
+    Loads datasets once and keeps an immutable copy per file, invalidated by the file mtime / size.
+    Callers get cheap copies: copy-on-write copies when pandas copy_on_write is on, deep copies otherwise.
+    Parsed tables are also written to a binary sidecar, so a cold start skips the text parsing.
+    prepare is applied to parsed tables before caching, schema tags its output in the sidecar.
+    """
+
+    def __init__(self, data_path, cache_path=None, prepare=None, schema=None):
+        self.data_path = data_path
+        self.cache_path = cache_path or os.path.join(data_path, CACHE_DIR_NAME)
+        self.prepare = prepare
+        self.schema = schema
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def _sidecar_path(self, dataset_name):
+        return os.path.join(self.cache_path, f"{dataset_name}.npz")
+
+    def _read(self, dataset_name, signature):
+        source_path = os.path.join(self.data_path, dataset_name)
+        sidecar_path = self._sidecar_path(dataset_name)
+
+        df = read_sidecar(sidecar_path, signature, self.schema)
+        if df is None:
+            df = read_source(source_path)
+            if self.prepare is not None: df = self.prepare(df)
+            try:
+                write_sidecar(df, sidecar_path, signature, self.schema)
+            except OSError:
+                # read-only data folder, keep the in-memory cache only
+                pass
+        return df
+
+    def load(self, dataset_name):
+        signature = file_signature(os.path.join(self.data_path, dataset_name))
+        with self._lock:
+            cached = self._frames.get(dataset_name)
+            if cached is None or cached[0] != signature:
+                cached = self._frames[dataset_name] = (signature, self._read(dataset_name, signature))
+        return cached[1].copy(deep=not pd.options.mode.copy_on_write)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
@@ -0,0 +1,86 @@
+import gzip, os
+
+import flask
+import plotly.io as pio
+
+from ui.metrics import response_bytes, stage
+
+JSON_ENGINE_ENV = "TABLE_JSON_ENGINE"
+GZIP_MIN_KB_ENV = "TABLE_GZIP_MIN_KB"
+
+# responses below this size are sent as they are, a round trip costs more than the bytes saved
+DEFAULT_GZIP_MIN_KB = 16
+GZIP_LEVEL = 5
+GZIP_MIMETYPES = {'application/json', 'text/html'}
+
+
+def records(df):
+
+    """
+    Rows of a frame as dicts, as DataTable data takes them, built column by column with native
+    Python values and missing values as None. Unlike to_dict('records'), no value is boxed per row,
+    and the JSON encoders write them as they are: no fallback for NumPy scalars, no second pass for NaN.
+    """
+
+    columns = []
+    for col in df.columns:
+        values = df[col]
+        if values.hasnans:
+            values = values.astype(object).where(values.notna(), None)
+        columns.append(values.tolist())
+    names = list(df.columns)
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def json_engine(engine=None):
+
+    """
+    Engine of plotly's to_json_plotly, which Dash encodes its responses with: orjson when it is
+    installed, it writes NumPy arrays and scalars directly, the json module otherwise.
+    """
+
+    engine = (engine or os.environ.get(JSON_ENGINE_ENV, 'auto')).lower()
+    if engine == 'auto':
+        try:
+            import orjson
+        except ImportError:
+            return 'json'
+        return 'orjson'
+    if engine not in ('orjson', 'json'):
+        raise ValueError(f"Unknown JSON engine: {engine}")
+    return engine
+
+
+def gzip_response(response, min_bytes, level=GZIP_LEVEL):
+
+    """ Gzip a response in place if the client takes it and it is large enough """
+
+    if (response.direct_passthrough or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in GZIP_MIMETYPES
+            or 'gzip' not in flask.request.headers.get('Accept-Encoding', '')):
+        return response
+    data = response.get_data()
+    if len(data) < min_bytes: return response
+    response_bytes(len(data))
+    with stage('compress'):
+        response.set_data(gzip.compress(data, compresslevel=level))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def install_encoder(app, engine=None):
+
+    """
+    Encode the responses of a Dash app with the engine of TABLE_JSON_ENGINE ('auto', 'orjson'
+    or 'json', see json_engine) and gzip the ones above TABLE_GZIP_MIN_KB (0: never).
+    Returns the engine.
+    """
+
+    engine = pio.json.config.default_engine = json_engine(engine)
+    min_bytes = int(float(os.environ.get(GZIP_MIN_KB_ENV, DEFAULT_GZIP_MIN_KB)) * 1024)
+    if min_bytes > 0:
+        @app.server.after_request
+        def compress_response(response):
+            return gzip_response(response, min_bytes)
+    return engine
@@ -0,0 +1,248 @@
+import os
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# per session, the oldest edits are forgotten first
+HISTORY_BUDGET_BYTES = int(float(os.environ.get('TABLE_HISTORY_BUDGET_MB', 64)) * 2**20)
+HISTORY_MAX_ENTRIES = 200
+# rough size of a delta without its arrays
+DELTA_OVERHEAD = 200
+
+
+def _nbytes(values):
+    values = np.asarray(values)
+    if values.dtype == object:
+        # names are interned, count the references only
+        return values.size * 8
+    return values.nbytes
+
+
+class ValueDelta:
+
+    """ Values of a column at row positions, before and after an edit """
+
+    __slots__ = ('col', 'positions', 'old', 'new')
+
+    def __init__(self, col, positions, old, new):
+        self.col = col
+        self.positions = np.asarray(positions, dtype=np.int32)
+        self.old = old
+        self.new = new
+
+    @property
+    def nbytes(self):
+        return DELTA_OVERHEAD + self.positions.nbytes + _nbytes(self.old) + _nbytes(self.new)
+
+    def undo(self, model):
+        model.set_position_values(self.positions, self.col, self.old)
+
+    def redo(self, model):
+        model.set_position_values(self.positions, self.col, self.new)
+
+
+class NameDelta:
+
+    """ Variable names of a scenario at row ids, before and after an edit """
+
+    __slots__ = ('scenario', 'row_ids', 'old', 'new')
+
+    def __init__(self, scenario, row_ids, old, new):
+        self.scenario = scenario
+        self.row_ids = row_ids
+        self.old = old
+        self.new = new
+
+    @property
+    def nbytes(self):
+        return DELTA_OVERHEAD + 16 * len(self.row_ids)
+
+    def undo(self, model):
+        model.set_variable_names(self.scenario, self.row_ids, self.old)
+
+    def redo(self, model):
+        model.set_variable_names(self.scenario, self.row_ids, self.new)
+
+
+class AddScenarioDelta:
+
+    """ Added scenario, as a copy of its parent or with its own values """
+
+    __slots__ = ('scenario', 'index', 'parent', 'values')
+
+    def __init__(self, scenario, index, parent=None, values=None):
+        self.scenario = scenario
+        self.index = index
+        self.parent = parent
+        self.values = values
+
+    @property
+    def nbytes(self):
+        return DELTA_OVERHEAD + (0 if self.values is None else _nbytes(self.values))
+
+    def undo(self, model):
+        model.drop_scenarios([self.scenario])
+
+    def redo(self, model):
+        model.add_scenario(self.scenario, self.values, parent=self.parent, index=self.index)
+
+
+class DropScenarioDelta:
+
+    """ Dropped scenario with its values and renamed variables, to add it back at its place """
+
+    __slots__ = ('scenario', 'index', 'values', 'name_overrides')
+
+    def __init__(self, scenario, index, values, name_overrides):
+        self.scenario = scenario
+        self.index = index
+        self.values = values
+        self.name_overrides = name_overrides
+
+    @property
+    def nbytes(self):
+        return DELTA_OVERHEAD + _nbytes(self.values) + 150 * len(self.name_overrides)
+
+    def undo(self, model):
+        model.add_scenario(self.scenario, self.values, index=self.index)
+        model.name_overrides[self.scenario] = dict(self.name_overrides)
+
+    def redo(self, model):
+        model.drop_scenarios([self.scenario])
+
+
+class History:
+
+    """
+    Undo / redo journal of a table model. An entry is the list of deltas of one user action,
+    each delta only holds the rows it changed, so undo and redo cost the size of the edit.
+    The oldest entries are dropped past max_bytes, redo entries are dropped by a new edit.
+    Once journaled, new entries, undos and redos wait in unlogged until the session journal takes them
+    (see ui.journal).
+    """
+
+    def __init__(self, max_bytes=HISTORY_BUDGET_BYTES, max_entries=HISTORY_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.undo_entries = deque()
+        self.redo_entries = []
+        self.nbytes = 0
+        self._open = None
+        self._depth = 0
+        self._paused = False
+        self.journaled = False
+        self.unlogged = []
+
+    def __getstate__(self):
+        # an action is never left open between requests
+        return {'max_bytes': self.max_bytes, 'max_entries': self.max_entries,
+                'undo_entries': self.undo_entries, 'redo_entries': self.redo_entries, 'journaled': self.journaled}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'], state['max_entries'])
+        self.undo_entries = state['undo_entries']
+        self.redo_entries = state['redo_entries']
+        self.journaled = state.get('journaled', False)
+        self.nbytes = sum(self._entry_nbytes(entry) for entry in list(self.undo_entries) + self.redo_entries)
+
+    @property
+    def recording(self):
+        return not self._paused
+
+    @property
+    def can_undo(self):
+        return bool(self.undo_entries)
+
+    @property
+    def can_redo(self):
+        return bool(self.redo_entries)
+
+    @staticmethod
+    def _entry_nbytes(entry):
+        return sum(delta.nbytes for delta in entry)
+
+    @contextmanager
+    def action(self):
+
+        """ Group the deltas recorded inside the block into one undo entry """
+
+        if self._depth == 0:
+            self._open = []
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                entry, self._open = self._open, None
+                if entry: self._push(entry)
+
+    def record(self, delta):
+        if self._paused: return
+        if self._open is not None:
+            self._open.append(delta)
+        else:
+            self._push([delta])
+
+    def _log(self, kind, entry=None):
+        if self.journaled: self.unlogged.append((kind, entry))
+
+    def take_unlogged(self):
+        unlogged, self.unlogged = self.unlogged, []
+        return unlogged
+
+    def _push(self, entry):
+        self._log('entry', entry)
+        self.nbytes -= sum(self._entry_nbytes(redo) for redo in self.redo_entries)
+        self.redo_entries = []
+
+        entry_nbytes = self._entry_nbytes(entry)
+        if entry_nbytes > self.max_bytes:
+            # the edit can't be undone, nor the ones before it
+            self.clear()
+            return
+
+        self.undo_entries.append(entry)
+        self.nbytes += entry_nbytes
+        while self.undo_entries and (self.nbytes > self.max_bytes or len(self.undo_entries) > self.max_entries):
+            self.nbytes -= self._entry_nbytes(self.undo_entries.popleft())
+
+    def clear(self):
+        self.undo_entries.clear()
+        self.redo_entries = []
+        self.nbytes = 0
+
+    @contextmanager
+    def _replaying(self):
+        self._paused = True
+        try:
+            yield
+        finally:
+            self._paused = False
+
+    def undo(self, model):
+
+        """ Revert the last entry on the model, returns False when there is nothing to undo """
+
+        if not self.undo_entries: return False
+        entry = self.undo_entries.pop()
+        with self._replaying():
+            for delta in reversed(entry):
+                delta.undo(model)
+        self.redo_entries.append(entry)
+        self._log('undo')
+        return True
+
+    def redo(self, model):
+
+        """ Apply again the last undone entry, returns False when there is nothing to redo """
+
+        if not self.redo_entries: return False
+        entry = self.redo_entries.pop()
+        with self._replaying():
+            for delta in entry:
+                delta.redo(model)
+        self.undo_entries.append(entry)
+        self._log('redo')
+        return True
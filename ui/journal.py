@@ -0,0 +1,458 @@
+import logging, os, pickle, re, struct, tempfile, threading, time, zlib
+from collections import OrderedDict
+
+JOURNAL_ENV = "TABLE_JOURNAL"
+JOURNAL_PATH_ENV = "TABLE_JOURNAL_PATH"
+COMPACT_BYTES_ENV = "TABLE_JOURNAL_COMPACT_KB"
+RETENTION_ENV = "TABLE_JOURNAL_RETENTION_H"
+
+DEFAULT_JOURNAL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.journal')
+# appends reach the OS at once, the disk within this delay: one fsync per batch of edits
+SYNC_INTERVAL_S = 0.05
+COMPACT_INTERVAL_S = 30
+# logs above this size are folded into the snapshot of their session
+DEFAULT_COMPACT_KB = 256
+# journals of sessions idle for longer are removed
+DEFAULT_RETENTION_H = 72
+# open append handles, the least recently used are closed first
+MAX_OPEN_LOGS = 64
+
+# payload length, crc32 of the payload, sequence number, kind
+RECORD = struct.Struct('<IIQB')
+ENTRY, UNDO, REDO, SAVE = range(4)
+KINDS = {'entry': ENTRY, 'undo': UNDO, 'redo': REDO}
+TOKEN_RE = re.compile(r'[\w-]+')
+
+logger = logging.getLogger(__name__)
+
+
+def encode_record(seq, kind, payload):
+    data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    return RECORD.pack(len(data), zlib.crc32(data), seq, kind) + data
+
+
+def read_records(path, end=None):
+
+    """
+    Records of a log as (seq, kind, payload, end offset), up to end. Stops at
+    the first torn or corrupt record: the tail a crash left half written.
+    """
+
+    with open(path, 'rb') as f:
+        data = f.read() if end is None else f.read(end)
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        length, crc, seq, kind = RECORD.unpack_from(data, offset)
+        start, stop = offset + RECORD.size, offset + RECORD.size + length
+        if stop > len(data) or zlib.crc32(data[start:stop]) != crc: return
+        yield seq, kind, pickle.loads(data[start:stop]), stop
+        offset = stop
+
+
+def replay(model, kind, payload):
+
+    """ Apply a journal record to a table model, as the edit it was logged from """
+
+    if kind == ENTRY:
+        with model.history.action():
+            for delta in payload:
+                delta.redo(model)
+    elif kind == UNDO:
+        model.history.undo(model)
+    elif kind == REDO:
+        model.history.redo(model)
+    elif kind == SAVE:
+        model.dirty.clear(payload)
+
+
+def _fsync_dir(path):
+    if not hasattr(os, 'O_DIRECTORY'): return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _Log:
+
+    """
+    Last sequence number and save generation of a session log, with its append handle while open
+    and the number of times it started again from a snapshot (see Journal.compact)
+    """
+
+    __slots__ = ('file', 'seq', 'base', 'synced', 'rebases')
+
+    def __init__(self, seq, base):
+        self.file = None
+        self.seq = seq
+        self.base = base
+        self.synced = True
+        self.rebases = 0
+
+
+class Journal:
+
+    """
+    Append-only journal of the edits of each session, to recover them after a restart
+    or an eviction from the session store without saving the whole table per edit.
+
+    A session has a snapshot of its table, taken at its first edit, and a log of binary
+    records (see encode_record): every history entry (see ui.history), undo, redo and save
+    since. Appends are written at once and fsync'ed in batches every SYNC_INTERVAL_S.
+    A session is recovered by replaying its log on its snapshot: the deltas are by row
+    position, they never land on a table saved by another session meanwhile. A background
+    compactor folds logs past the compact size into a new snapshot and removes the journals
+    of sessions idle for too long. Records carry a sequence number: the snapshot knows the
+    last one it holds.
+    """
+
+    def __init__(self, path, compact_bytes=DEFAULT_COMPACT_KB * 1024, retention_s=DEFAULT_RETENTION_H * 3600):
+        self.path = path
+        self.compact_bytes = compact_bytes
+        self.retention_s = retention_s
+        self.loader = None
+        os.makedirs(path, exist_ok=True)
+        # logs and locks of the sessions with a log file, see _prune
+        self._logs = {}
+        self._locks = {}
+        # logs with an open append handle, the most recently appended last
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def attach(self, loader):
+
+        """ Loader of the base tables (see SessionStore), starts the background threads """
+
+        self.loader = loader
+        if self._threads: return
+        for target in (self._sync_loop, self._compact_loop):
+            thread = threading.Thread(target=target, name=f"journal-{target.__name__.strip('_')}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _files(self, token):
+        if not TOKEN_RE.fullmatch(token or ''):
+            raise ValueError("Invalid session token")
+        return os.path.join(self.path, f"{token}.log"), os.path.join(self.path, f"{token}.snap")
+
+    def _session_lock(self, token):
+        with self._lock:
+            return self._locks.setdefault(token, threading.RLock())
+
+    def _close(self, token, log):
+        with self._lock:
+            if self._open.get(token) is log: del self._open[token]
+        file, log.file = log.file, None
+        if file is None: return
+        try:
+            file.flush()
+            os.fsync(file.fileno())
+            log.synced = True
+        finally:
+            file.close()
+
+    def _append(self, token, log, records):
+        data = b''
+        for kind, payload in records:
+            log.seq += 1
+            data += encode_record(log.seq, kind, payload)
+
+        if log.file is None:
+            log.file = open(self._files(token)[0], 'ab')
+        log.file.write(data)
+        log.file.flush()
+        log.synced = False
+
+        with self._lock:
+            self._logs[token] = log
+            self._open[token] = log
+            self._open.move_to_end(token)
+            excess = list(self._open.items())[:-MAX_OPEN_LOGS]
+        for other_token, other in excess:
+            # skipped while in use, the next append closes it
+            other_lock = self._session_lock(other_token)
+            if other_lock.acquire(blocking=False):
+                try:
+                    self._close(other_token, other)
+                finally:
+                    other_lock.release()
+
+    def _read_snapshot(self, token, model=True):
+        # the sequence number is pickled first, it is read without the table
+        with open(self._files(token)[1], 'rb') as f:
+            seq = pickle.load(f)
+            return seq, pickle.load(f) if model else None
+
+    def _temp_file(self, token, write):
+        # a file of its own per writer, a rebase and a compaction never write to the same one
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{token}.", suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def _dump_snapshot(self, token, model, seq):
+        def write(f):
+            pickle.dump(seq, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return self._temp_file(token, write)
+
+    def _write_snapshot(self, token, model, seq):
+        os.replace(self._dump_snapshot(token, model, seq), self._files(token)[1])
+        _fsync_dir(self.path)
+
+    def _scan(self, token):
+
+        """ Log of a session known on disk only, from the sequence numbers and saves in its files """
+
+        log_path, snap_path = self._files(token)
+        if not os.path.exists(log_path): return None
+        seq, base = (self._read_snapshot(token, model=False)[0] if os.path.exists(snap_path) else 0), None
+        for record_seq, kind, payload, _ in read_records(log_path):
+            seq = record_seq
+            if kind == SAVE: base = payload
+        return _Log(seq, base)
+
+    def _get_log(self, token):
+        with self._lock:
+            log = self._logs.get(token)
+        if log is None:
+            log = self._scan(token)
+            if log is not None:
+                with self._lock: self._logs[token] = log
+        return log
+
+    def start(self, token, model):
+
+        """ New session, its table comes from the loader. Nothing is written until its first edit """
+
+        model.history.journaled = True
+        model.history.take_unlogged()
+
+    def log(self, token, model):
+
+        """ Append what changed in the session table since the last call """
+
+        if model.history.journaled and not model.history.unlogged and self._get_log(token) is None:
+            # nothing to log, most sessions are never edited: no lock for them
+            return
+        with self._session_lock(token):
+            if not model.history.journaled:
+                # a table the journal has not seen: start its log from it
+                return self.rebase(token, model)
+            records = [(KINDS[kind], entry) for kind, entry in model.history.take_unlogged()]
+            log = self._get_log(token)
+            if log is None:
+                # first edit of a session: its log starts from a snapshot of the table, edit included
+                if records: self.rebase(token, model)
+                return
+            if model.dirty.base != log.base:
+                log.base = model.dirty.base
+                records.append((SAVE, log.base))
+            if records: self._append(token, log, records)
+
+    def rebase(self, token, model):
+
+        """ Start the log of a session again from a snapshot of its table (e.g. after a reset) """
+
+        with self._session_lock(token):
+            model.history.journaled = True
+            model.history.take_unlogged()
+            log = self._get_log(token) or _Log(0, None)
+            self._close(token, log)
+            self._write_snapshot(token, model, log.seq)
+            open(self._files(token)[0], 'wb').close()
+            log.base = model.dirty.base
+            log.rebases += 1
+            with self._lock: self._logs[token] = log
+
+    def _replay(self, token, end=None):
+
+        """
+        Table of a session from its snapshot and log, with the last sequence number and the log offset it read to.
+        The table is None when the journal can't be replayed: without a snapshot, or a record that fails
+        """
+
+        log_path, snap_path = self._files(token)
+        model, seq, offset = None, 0, 0
+        if not os.path.exists(snap_path):
+            logger.error("Journal of session %s has no snapshot", token)
+            return None, seq, offset
+        seq, model = self._read_snapshot(token)
+
+        for record_seq, kind, payload, record_end in read_records(log_path, end):
+            if record_seq > seq:
+                try:
+                    replay(model, kind, payload)
+                except Exception:
+                    # never a partial table: the session would lose edits without knowing it
+                    logger.exception("Journal of session %s fails at record %d", token, record_seq)
+                    return None, seq, offset
+                seq = record_seq
+            offset = record_end
+
+        if model is not None:
+            model.history.journaled = True
+            model.history.take_unlogged()
+        return model, seq, offset
+
+    def recover(self, token):
+
+        """ Table of a session replayed from its journal, None without a journal """
+
+        log_path, _ = self._files(token)
+        # most sessions never had an edit, they don't get a lock
+        if not os.path.exists(log_path): return None
+        with self._session_lock(token):
+            if not os.path.exists(log_path): return None
+            model, seq, offset = self._replay(token)
+            if model is None:
+                # the session starts again from the loader, with a new log
+                self.drop(token)
+                return None
+
+            with self._lock:
+                log = self._logs.pop(token, None)
+            if log is not None: self._close(token, log)
+            # drop a torn tail, the next records go right after the last good one
+            with open(log_path, 'ab') as f:
+                f.truncate(offset)
+            with self._lock:
+                self._logs[token] = _Log(seq, model.dirty.base)
+            return model
+
+    def compact(self, token):
+
+        """
+        Fold the log of a session into its snapshot. The log is replayed and the snapshot written without the lock,
+        appends only wait for the swap of the files. Returns False when the log was rebased, recovered or dropped
+        meanwhile: the new snapshot is of a log that is gone, it is discarded.
+        """
+
+        log_path, snap_path = self._files(token)
+        lock = self._session_lock(token)
+        with lock:
+            log = self._get_log(token)
+            if log is None: return False
+            if log.file is not None: log.file.flush()
+            end, rebases = os.path.getsize(log_path), log.rebases
+
+        model, seq, offset = self._replay(token, end)
+        if model is None: return False
+        snap_tmp = self._dump_snapshot(token, model, seq)
+
+        try:
+            with lock:
+                if (self._get_log(token) is not log or log.rebases != rebases
+                        or os.path.getsize(log_path) < end):
+                    return False
+                self._close(token, log)
+                # records appended meanwhile move to the new log
+                with open(log_path, 'rb') as src:
+                    src.seek(offset)
+                    log_tmp = self._temp_file(token, lambda dst: dst.write(src.read()))
+                # a crash between the two leaves the new snapshot with the old log: its records up to seq are skipped
+                os.replace(snap_tmp, snap_path)
+                snap_tmp = None
+                os.replace(log_tmp, log_path)
+                _fsync_dir(self.path)
+                return True
+        finally:
+            if snap_tmp is not None: os.remove(snap_tmp)
+
+    def drop(self, token):
+        with self._session_lock(token):
+            with self._lock:
+                log = self._logs.pop(token, None)
+                self._locks.pop(token, None)
+            if log is not None: self._close(token, log)
+            for path in self._files(token):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def sync(self):
+
+        """ fsync the logs appended since the last sync """
+
+        with self._lock:
+            logs = [log for log in self._open.values() if not log.synced]
+        for log in logs:
+            try:
+                log.synced = True
+                os.fsync(log.file.fileno())
+            except (AttributeError, OSError, ValueError):
+                # closed meanwhile, which synced it
+                pass
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(SYNC_INTERVAL_S)
+            self.sync()
+
+    def _prune(self, tokens):
+
+        """ Forget the locks and logs of sessions without a log file, e.g. a session only loaded """
+
+        with self._lock:
+            unused = [token for token in set(self._locks) | set(self._logs) if token not in tokens]
+        for token in unused:
+            with self._lock:
+                lock = self._locks.get(token)
+            # in use: the next round prunes it
+            if lock is not None and not lock.acquire(blocking=False): continue
+            try:
+                if TOKEN_RE.fullmatch(token) and os.path.exists(self._files(token)[0]): continue
+                with self._lock:
+                    self._locks.pop(token, None)
+                    log = self._logs.pop(token, None)
+                if log is not None: self._close(token, log)
+            finally:
+                if lock is not None: lock.release()
+
+    def _compact_loop(self):
+        while True:
+            time.sleep(COMPACT_INTERVAL_S)
+            now = time.time()
+            tokens = set()
+            for name in os.listdir(self.path):
+                token, ext = os.path.splitext(name)
+                if ext not in ('.log', '.tmp'): continue
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                    if ext == '.tmp':
+                        # left by a crash in the middle of a write
+                        if now - stat.st_mtime > self.retention_s: os.remove(os.path.join(self.path, name))
+                        continue
+                    if now - stat.st_mtime > self.retention_s:
+                        self.drop(token)
+                        continue
+                    if stat.st_size > self.compact_bytes:
+                        self.compact(token)
+                    tokens.add(token)
+                except (OSError, ValueError):
+                    # dropped meanwhile, or not a session log
+                    continue
+            self._prune(tokens)
+
+
+def make_journal(namespace):
+
+    """
+    Journal selected by environment variables: TABLE_JOURNAL ('on' or 'off'),
+    TABLE_JOURNAL_PATH, TABLE_JOURNAL_COMPACT_KB and TABLE_JOURNAL_RETENTION_H.
+    """
+
+    if os.environ.get(JOURNAL_ENV, 'on').lower() == 'off': return None
+    path = os.environ.get(JOURNAL_PATH_ENV, DEFAULT_JOURNAL_PATH)
+    return Journal(os.path.join(path, namespace),
+                   compact_bytes=int(float(os.environ.get(COMPACT_BYTES_ENV, DEFAULT_COMPACT_KB)) * 1024),
+                   retention_s=float(os.environ.get(RETENTION_ENV, DEFAULT_RETENTION_H)) * 3600)
@@ -0,0 +1,29 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+
+    """
+    Thread-safe LRU of values derived from a session table, keyed by (session, table version, ...).
+    A new version of the table makes the older entries unreachable, they are evicted as the LRU fills up.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
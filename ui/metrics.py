@@ -0,0 +1,292 @@
+import bisect, ipaddress, os, threading, time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+import flask
+from dash.exceptions import PreventUpdate
+
+METRICS_ENV = "TABLE_METRICS"
+WINDOW_ENV = "TABLE_METRICS_WINDOW_S"
+
+DEFAULT_WINDOW_S = 300
+# the window rolls by one slice at a time
+WINDOW_SLICES = 10
+QUANTILES = [0.5, 0.9, 0.99]
+SECONDS_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+BYTES_BUCKETS = [256 * 4**k for k in range(11)]
+
+DISPATCH_PATH = '/_dash-update-component'
+METRICS_PATH = '/metrics'
+# time of a callback request: parsing its JSON, getting the session table (see SessionStore.get),
+# the callback itself, Dash validating and encoding the outputs, and gzip (see ui.encoding)
+STAGES = ['total', 'decode', 'store', 'compute', 'encode', 'compress']
+OUTCOMES = ['update', 'prevented', 'error']
+
+
+class Histogram:
+
+    """
+    Observations in buckets, counted since the start as Prometheus histograms are, and over
+    a rolling window of the last window_s seconds for the quantiles of the recent requests.
+    """
+
+    def __init__(self, buckets, window_s=DEFAULT_WINDOW_S):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.slice_s = window_s / WINDOW_SLICES
+        # (slice number, bucket counts) of the window
+        self._window = deque()
+
+    def observe(self, value, now=None):
+        k = bisect.bisect_left(self.buckets, value)
+        self.counts[k] += 1
+        self.sum += value
+        current = int((time.monotonic() if now is None else now) // self.slice_s)
+        if not self._window or self._window[-1][0] != current:
+            self._window.append((current, [0] * len(self.counts)))
+        self._window[-1][1][k] += 1
+
+    def window_counts(self, now=None):
+        current = int((time.monotonic() if now is None else now) // self.slice_s)
+        while self._window and self._window[0][0] <= current - WINDOW_SLICES:
+            self._window.popleft()
+        return [sum(counts[k] for _, counts in self._window) for k in range(len(self.counts))]
+
+    def quantile(self, q, counts):
+
+        """ Quantile of window counts, interpolated in its bucket as histogram_quantile does """
+
+        total = sum(counts)
+        if not total: return None
+        rank, seen = q * total, 0
+        for k, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if k == len(self.buckets): return self.buckets[-1]
+                lower = self.buckets[k - 1] if k else 0
+                return lower + (self.buckets[k] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class CallbackMetrics:
+
+    """
+    Time, payload sizes and outcome of the callback requests of an app, by callback.
+    A request is recorded by the hooks installed by instrument, with the stages timed by
+    the callback (see timed) and in it (see stage).
+    """
+
+    def __init__(self, window_s=DEFAULT_WINDOW_S):
+        self.window_s = window_s
+        self.seconds = defaultdict(lambda: Histogram(SECONDS_BUCKETS, window_s))
+        self.request_bytes = defaultdict(lambda: Histogram(BYTES_BUCKETS, window_s))
+        self.response_bytes = defaultdict(lambda: Histogram(BYTES_BUCKETS, window_s))
+        self.sent_bytes = defaultdict(lambda: Histogram(BYTES_BUCKETS, window_s))
+        self.outcomes = defaultdict(int)
+        # the index of the outcome is observed, one bucket per outcome
+        self._window_outcomes = defaultdict(lambda: Histogram(list(range(len(OUTCOMES) - 1)), window_s))
+        self._lock = threading.Lock()
+
+    def record(self, callback, stages, request_bytes, response_bytes, outcome, sent_bytes=None):
+        now = time.monotonic()
+        with self._lock:
+            for name, seconds in stages.items():
+                self.seconds[callback, name].observe(seconds, now)
+            self.request_bytes[callback].observe(request_bytes, now)
+            self.response_bytes[callback].observe(response_bytes, now)
+            self.sent_bytes[callback].observe(response_bytes if sent_bytes is None else sent_bytes, now)
+            self.outcomes[callback, outcome] += 1
+            self._window_outcomes[callback].observe(OUTCOMES.index(outcome), now)
+
+    def render(self):
+
+        """ The metrics in the Prometheus text format """
+
+        lines = []
+        with self._lock:
+            lines += ["# HELP dash_callback_requests_total Callback requests by outcome: update, prevented "
+                      "(PreventUpdate, no output changed) or error",
+                      "# TYPE dash_callback_requests_total counter"]
+            lines += [f"dash_callback_requests_total{{{_labels(callback=callback, outcome=outcome)}}} {count}"
+                      for (callback, outcome), count in sorted(self.outcomes.items())]
+
+            lines += [f"# HELP dash_callback_prevented_ratio Share of the callback requests of the last "
+                      f"{self.window_s:g} s that changed nothing",
+                      "# TYPE dash_callback_prevented_ratio gauge"]
+            for callback, histogram in sorted(self._window_outcomes.items()):
+                counts = histogram.window_counts()
+                if sum(counts):
+                    lines.append(f"dash_callback_prevented_ratio{{{_labels(callback=callback)}}} "
+                                 f"{counts[OUTCOMES.index('prevented')] / sum(counts):.6g}")
+
+            lines += self._histograms('dash_callback_seconds', "Server time of the callback requests by stage: "
+                                      + ', '.join(STAGES), self.seconds, lambda key: dict(callback=key[0], stage=key[1]))
+            lines += self._histograms('dash_callback_request_bytes', "Size of the callback request bodies",
+                                      self.request_bytes, lambda key: dict(callback=key))
+            lines += self._histograms('dash_callback_response_bytes', "Size of the callback responses, before gzip",
+                                      self.response_bytes, lambda key: dict(callback=key))
+            lines += self._histograms('dash_callback_sent_bytes', "Size of the callback responses as sent",
+                                      self.sent_bytes, lambda key: dict(callback=key))
+        return '\n'.join(lines) + '\n'
+
+    def _histograms(self, name, help, histograms, labels):
+        lines = [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+        window = [f"# HELP {name}_window Quantiles over the last {self.window_s:g} s",
+                  f"# TYPE {name}_window gauge"]
+        for key, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for le, count in zip(histogram.buckets + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{{{_labels(**labels(key), le=le)}}} {cumulative}")
+            lines.append(f"{name}_sum{{{_labels(**labels(key))}}} {histogram.sum:.6g}")
+            lines.append(f"{name}_count{{{_labels(**labels(key))}}} {cumulative}")
+            counts = histogram.window_counts()
+            for q in QUANTILES:
+                value = histogram.quantile(q, counts)
+                if value is not None:
+                    window.append(f"{name}_window{{{_labels(**labels(key), quantile=q)}}} {value:.6g}")
+        return lines + window
+
+
+class _Request:
+
+    """ Stages of the callback request being served, with the size of its response before gzip """
+
+    __slots__ = ('callback', 'start', 'stages', 'request_bytes', 'response_bytes', 'outcome')
+
+    def __init__(self, request_bytes):
+        self.callback = None
+        self.start = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.request_bytes = request_bytes
+        self.response_bytes = None
+        self.outcome = 'update'
+
+
+def _current():
+    return flask.g.get('callback_metrics') if flask.has_request_context() else None
+
+
+@contextmanager
+def stage(name):
+
+    """ Time the block as a stage of the callback request being served, if it is measured """
+
+    request = _current()
+    if request is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request.stages[name] += time.perf_counter() - start
+
+
+def response_bytes(nbytes):
+
+    """ Size of the response of the callback request being served before its content encoding """
+
+    request = _current()
+    if request is not None: request.response_bytes = nbytes
+
+
+def local_request():
+
+    """ Whether the request being served comes from this machine """
+
+    try:
+        return ipaddress.ip_address(flask.request.remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+
+def timed(func):
+
+    """ Callback decorator, under @callback: its time and outcome go to the request's metrics """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        request = _current()
+        if request is None:
+            return func(*args, **kwargs)
+        request.callback = func.__name__
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except PreventUpdate:
+            request.outcome = 'prevented'
+            raise
+        except Exception:
+            request.outcome = 'error'
+            raise
+        finally:
+            request.stages['function'] += time.perf_counter() - start
+
+    return wrapper
+
+
+def instrument(app, window_s=None):
+
+    """
+    Measure the callback requests of a Dash app and serve the metrics on /metrics, to local requests only.
+    A request is recorded once its response is final, after every after_request hook (e.g. gzip).
+    Off with TABLE_METRICS=off, the window of the quantiles is TABLE_METRICS_WINDOW_S.
+    Returns the metrics, None when off.
+    """
+
+    if os.environ.get(METRICS_ENV, 'on').lower() == 'off': return None
+    metrics = CallbackMetrics(window_s or float(os.environ.get(WINDOW_ENV, DEFAULT_WINDOW_S)))
+    server = app.server
+
+    @server.before_request
+    def start_callback_metrics():
+        if flask.request.path != DISPATCH_PATH: return
+        request = flask.g.callback_metrics = _Request(flask.request.content_length or 0)
+        with stage('decode'):
+            # Dash gets the parsed body from Flask's cache
+            body = flask.request.get_json(silent=True) or {}
+        # named by its function once it runs (see timed)
+        request.callback = body.get('output')
+
+    def finish(sent_bytes, outcome=None):
+        request = flask.g.pop('callback_metrics', None)
+        if request is None: return
+        stages = request.stages
+        function = stages.pop('function', 0.0)
+        stages['total'] = time.perf_counter() - request.start
+        stages['compute'] = max(function - stages['store'], 0.0)
+        stages['encode'] = max(stages['total'] - stages['decode'] - function - stages['compress'], 0.0)
+        body_bytes = sent_bytes if request.response_bytes is None else request.response_bytes
+        metrics.record(request.callback, stages, request.request_bytes, body_bytes, outcome or request.outcome,
+                       sent_bytes)
+
+    def record_callback_metrics(sender, response, **extra):
+        if flask.request.path == DISPATCH_PATH:
+            finish(response.calculate_content_length() or 0,
+                   'error' if response.status_code >= 500 else 'prevented' if response.status_code == 204 else None)
+
+    # sent once the after_request hooks are done, whatever order they were registered in
+    flask.request_finished.connect(record_callback_metrics, server, weak=False)
+
+    @server.teardown_request
+    def record_callback_error(error):
+        # unhandled errors skip after_request
+        if error is not None: finish(0, 'error')
+
+    @server.route(METRICS_PATH)
+    def callback_metrics():
+        if not local_request(): flask.abort(403)
+        return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return metrics
@@ -0,0 +1,262 @@
+import json, os, secrets, threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pandas as pd, numpy as np
+
+from ui.dataset import write_columns, read_columns
+
+SAVE_PATH_ENV = "TABLE_SAVE_PATH"
+DEFAULT_SAVE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'saved')
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+PARTITIONS_DIR = 'partitions'
+# a partition holds the whole wells starting in a block of this many rows
+PARTITION_ROWS = 4096
+
+
+class DirtySet:
+
+    """
+    What changed in a table model since its last save: the wells with edited values
+    or names, and the columns (scenarios) added since, which every well partition has to hold.
+    base is the save generation these changes are relative to, None until the first save.
+    """
+
+    def __init__(self):
+        self.wells = set()
+        self.columns = set()
+        self.base = None
+
+    def __getstate__(self):
+        return {'wells': self.wells, 'columns': self.columns, 'base': self.base}
+
+    def __setstate__(self, state):
+        self.wells, self.columns, self.base = state['wells'], state['columns'], state['base']
+
+    def mark_wells(self, wells):
+        self.wells.update(wells)
+
+    def mark_column(self, col):
+        self.columns.add(col)
+
+    def pending(self, wells, generation):
+
+        """ Wells to write, in table order, on top of the save generation on disk """
+
+        if self.base is None or self.base != generation or self.columns:
+            return list(wells)
+        return [well for well in wells if well in self.wells]
+
+    def clear(self, generation):
+        self.wells = set()
+        self.columns = set()
+        self.base = generation
+
+
+def partition_rows(model):
+
+    """
+    Row slices of the partitions of a table model: runs of whole wells, a well belongs
+    to the block of PARTITION_ROWS its first row is in. Rows never move, nor do partitions.
+    """
+
+    starts = model.index.starts
+    if not len(starts): return []
+    blocks = starts // PARTITION_ROWS
+    firsts = np.flatnonzero(np.r_[True, blocks[1:] != blocks[:-1]])
+    bounds = np.r_[starts[firsts], len(model.df)]
+    return [slice(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def snapshot(model, partitions):
+
+    """ Rows of the partitions as saved (see to_frame), copied so later edits don't reach them """
+
+    rows = partition_rows(model)
+    return {k: model.to_frame(rows[k]).copy() for k in partitions}
+
+
+def _fsync_dir(path):
+    # the renames are durable once the directory entry is
+    if not hasattr(os, 'O_DIRECTORY'): return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class TableWriter:
+
+    """
+    Saved table, partitioned by well: one columnar file per run of wells (see partition_rows
+    and ui.dataset.write_columns) and a manifest listing the columns and the partition files in order.
+
+    A save only writes the partitions of the wells in the model's dirty set, as new files,
+    then replaces the manifest: readers see the previous save or the new one, never a mix.
+    The files of the previous save are kept until the next one, for readers of its manifest.
+    Each file is flushed to disk before its rename, so a save is durable once its job is done.
+    Saves run one after the other in a background thread, save returns a job id to poll.
+    A save queued behind another one snapshots every partition: it writes them all if that one fails.
+    Partitions keep the columns of dropped scenarios until rewritten, the manifest lists the live ones.
+    """
+
+    def __init__(self, path, prepare=None):
+        self.path = path
+        self.prepare = prepare
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='table-writer')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._manifest = self._read_manifest()
+        self._queued = 0
+        # generation and number of partitions on disk once the queued saves are written, None after a failed save
+        self._generation = self._manifest['generation'] if self._manifest else None
+        self._n_partitions = len(self._manifest['partitions']) if self._manifest else None
+        self._loaded = None
+
+    def _manifest_path(self):
+        return os.path.join(self.path, MANIFEST_NAME)
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path()) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+    def save(self, model):
+
+        """
+        Snapshot the dirty wells of the model and write them in the background.
+        The dirty set is cleared: the caller puts the model back in its store.
+        Returns the job id to poll.
+        """
+
+        with self._lock:
+            wells = model.wells
+            rows = partition_rows(model)
+            if len(rows) == self._n_partitions:
+                dirty = set(model.dirty.pending(wells, self._generation))
+            else:
+                dirty = set(wells)
+            # partition of each well, in table order
+            owners = np.searchsorted([r.start for r in rows], model.index.starts, side='right') - 1
+            pending = sorted({int(k) for k, well in zip(owners, wells) if well in dirty})
+            # the save before may still fail, the whole table is at hand to write it all then
+            partitions = snapshot(model, range(len(rows)) if self._queued else pending)
+            columns = list(model.to_frame(slice(0, 0)).columns)
+            base, generation = self._generation, secrets.token_hex(8)
+            model.dirty.clear(generation)
+            self._generation, self._n_partitions = generation, len(rows)
+
+            job = secrets.token_urlsafe(8)
+            self._queued += 1
+            self._jobs[job] = self._executor.submit(self._write, generation, base, columns, len(rows),
+                                                    partitions, pending, len(dirty), len(wells))
+        return job
+
+    def _write(self, generation, base, columns, n_partitions, partitions, pending, n_dirty, n_wells):
+        try:
+            with self._lock:
+                previous = self._manifest
+            if previous is not None and previous['generation'] == base and len(pending) < n_partitions:
+                files = list(previous['partitions'])
+            else:
+                # first save, new partitions, or the save this one builds on failed
+                files = [None] * n_partitions
+                pending, n_dirty = range(n_partitions), n_wells
+            partitions_path = os.path.join(self.path, PARTITIONS_DIR)
+            for k in pending:
+                frame = partitions[k]
+                files[k] = f"{k:05d}-{generation}.npz"
+                write_columns(frame, os.path.join(partitions_path, files[k]), {'generation': generation},
+                              durable=True)
+            if partitions: _fsync_dir(partitions_path)
+
+            manifest = {'version': MANIFEST_VERSION, 'generation': generation, 'columns': columns,
+                        'partitions': files}
+            tmp_path = self._manifest_path() + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._manifest_path())
+            _fsync_dir(self.path)
+            with self._lock:
+                self._manifest = manifest
+        except Exception:
+            with self._lock:
+                # the next save can't build on this one
+                if self._generation == generation: self._generation, self._n_partitions = None, None
+            raise
+        finally:
+            with self._lock:
+                self._queued -= 1
+
+        # loads of the previous manifest may still be reading its files
+        self._remove_unused(set(files) | set(previous['partitions'] if previous else []))
+        return n_dirty, n_wells, len(pending)
+
+    def _remove_unused(self, used):
+        partitions_path = os.path.join(self.path, PARTITIONS_DIR)
+        if not os.path.isdir(partitions_path): return
+        for name in os.listdir(partitions_path):
+            if name not in used:
+                try:
+                    os.remove(os.path.join(partitions_path, name))
+                except OSError:
+                    pass
+
+    def poll(self, job):
+
+        """
+        None while the save is written, then (True, message) once it is on disk
+        or (False, error). A job is reported once.
+        """
+
+        future = self._jobs.get(job)
+        if future is None:
+            return False, "Unknown save"
+        if not future.done():
+            return None
+        del self._jobs[job]
+        error = future.exception()
+        if error is not None:
+            return False, f"Save failed: {error}"
+        wells, total, partitions = future.result()
+        return True, f"{wells} of {total} wells written ({partitions} partitions)."
+
+    def wait(self, job, timeout=None):
+
+        """ Block until the save is written, then poll it """
+
+        if job in self._jobs: wait([self._jobs[job]], timeout)
+        return self.poll(job)
+
+    def load(self):
+
+        """
+        Saved table and its generation, None without a save. The table is read
+        once per generation, callers get copy-on-write copies as from DatasetLoader.
+        """
+
+        with self._lock:
+            manifest = self._manifest
+            if manifest is None: return None
+            if self._loaded is None or self._loaded[0] != manifest['generation']:
+                partitions_path = os.path.join(self.path, PARTITIONS_DIR)
+                frames = [read_columns(os.path.join(partitions_path, name))[0] for name in manifest['partitions']]
+                df = pd.concat(frames, ignore_index=True)[manifest['columns']]
+                if self.prepare is not None: df = self.prepare(df)
+                self._loaded = (manifest['generation'], df)
+            generation, df = self._loaded
+        return df.copy(deep=not pd.options.mode.copy_on_write), generation
+
+
+def make_writer(name, prepare=None):
+
+    """ Writer of a saved table under TABLE_SAVE_PATH (default: saved/ in the repo) """
+
+    return TableWriter(os.path.join(os.environ.get(SAVE_PATH_ENV, DEFAULT_SAVE_PATH), name), prepare)
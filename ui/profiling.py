@@ -0,0 +1,221 @@
+import cProfile, html, io, json, os, pstats, re, threading, time
+from datetime import datetime
+
+import flask
+from dash.exceptions import PreventUpdate
+
+from ui.metrics import local_request
+
+PROFILE_ENV = "TABLE_PROFILE"
+PROFILE_PATH_ENV = "TABLE_PROFILE_PATH"
+PROFILE_KEEP_ENV = "TABLE_PROFILE_KEEP"
+
+DEFAULT_PROFILE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.profiles')
+# captures kept, the oldest are removed first
+DEFAULT_PROFILE_KEEP = 50
+# callbacks to profile: comma separated names, or * for all
+PROFILE_HEADER = 'X-Profile-Callback'
+PROFILE_ARG = 'profile'
+# a page loaded with ?profile=... asks for the profiles of its callback requests with this cookie
+PROFILE_COOKIE = 'dash_profile'
+PROFILES_PATH = '/_profiles'
+# functions listed in a profile's page
+PROFILE_STATS_LINES = 40
+CAPTURE_RE = re.compile(r'[\w.-]+')
+UNSAFE_RE = re.compile(r'[^\w.-]')
+
+
+def _wanted(name, value):
+    names = {part.strip() for part in (value or '').split(',')}
+    return '*' in names or name in names
+
+
+def _value_bytes(value):
+    return len(json.dumps(value, default=str))
+
+
+class Profiler:
+
+    """
+    Profiles of single callback requests, taken with cProfile when the request asks for its callback
+    (PROFILE_HEADER, the PROFILE_ARG query parameter, or the cookie of a page loaded with it).
+    A capture is the pstats dump of the whole request, JSON decoding and encoding included, and its
+    metadata: callback, time, sizes of the inputs and, from describe(body), of the session table.
+    Only the last keep captures are kept.
+    """
+
+    def __init__(self, path, keep=DEFAULT_PROFILE_KEEP, describe=None):
+        self.path = path
+        self.keep = keep
+        self.describe = describe
+        # profiles don't nest, one request is profiled at a time
+        self._lock = threading.Lock()
+
+    def requested(self):
+        request = flask.request
+        return (request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_ARG)
+                or request.cookies.get(PROFILE_COOKIE))
+
+    def capture(self, name, view, *args, **kwargs):
+        body = flask.request.get_json(silent=True) or {}
+        with self._lock:
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            response, status = None, 200
+            try:
+                response = profile.runcall(view, *args, **kwargs)
+                status = response.status_code
+                return response
+            except PreventUpdate:
+                status = 204
+                raise
+            except Exception:
+                status = 500
+                raise
+            finally:
+                meta = {'callback': name, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'wall_ms': 1e3 * (time.perf_counter() - start), 'status': status,
+                        'request_bytes': flask.request.content_length or 0,
+                        'response_bytes': response.calculate_content_length() if response is not None else 0,
+                        'inputs': {f"{dep['id']}.{dep['property']}": _value_bytes(dep.get('value'))
+                                   for dep in body.get('inputs', []) + body.get('state', []) if isinstance(dep, dict)}}
+                if self.describe is not None:
+                    try:
+                        meta['table'] = self.describe(body)
+                    except Exception as error:
+                        meta['table'] = {'error': str(error)}
+                self._write(profile, meta)
+
+    def _write(self, profile, meta):
+        os.makedirs(self.path, exist_ok=True)
+        callback = UNSAFE_RE.sub('_', meta['callback'])
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{callback}"
+        profile.dump_stats(os.path.join(self.path, name + '.prof'))
+        with open(os.path.join(self.path, name + '.json'), 'w') as f:
+            json.dump(meta, f)
+        for old in self.captures()[self.keep:]:
+            for ext in ('.prof', '.json'):
+                try:
+                    os.remove(os.path.join(self.path, old + ext))
+                except OSError:
+                    pass
+
+    def captures(self):
+
+        """ Names of the captures, the most recent first """
+
+        if not os.path.isdir(self.path): return []
+        return sorted((name[:-5] for name in os.listdir(self.path) if name.endswith('.json')), reverse=True)
+
+    def meta(self, name):
+        with open(os.path.join(self.path, name + '.json')) as f:
+            return json.load(f)
+
+    def stats(self, name, sort='cumulative', lines=PROFILE_STATS_LINES):
+        out = io.StringIO()
+        pstats.Stats(os.path.join(self.path, name + '.prof'), stream=out).sort_stats(sort).print_stats(lines)
+        return out.getvalue()
+
+
+def _page(title, body):
+    return (f"<!doctype html><html><head><title>{html.escape(title)}</title></head>"
+            f"<body style='font-family: sans-serif'><h3>{html.escape(title)}</h3>{body}</body></html>")
+
+
+def install_profiler(app, describe=None):
+
+    """
+    Profile the callback requests of a Dash app on demand, listed on /_profiles (from localhost only).
+    On with TABLE_PROFILE=on, captures go to TABLE_PROFILE_PATH, the last TABLE_PROFILE_KEEP are kept.
+    Off, nothing is installed. Returns the profiler, None when off.
+    """
+
+    if os.environ.get(PROFILE_ENV, 'off').lower() != 'on': return None
+    profiler = Profiler(os.environ.get(PROFILE_PATH_ENV, DEFAULT_PROFILE_PATH),
+                        int(os.environ.get(PROFILE_KEEP_ENV, DEFAULT_PROFILE_KEEP)), describe)
+    server = app.server
+    endpoint = app.config.routes_pathname_prefix + '_dash-update-component'
+    dispatch = server.view_functions[endpoint]
+
+    def callback_name(output):
+        spec = app.callback_map.get(output, {})
+        function = spec.get('callback')
+        return getattr(function, '__wrapped__', function).__name__ if function else output
+
+    def profiled_dispatch(*args, **kwargs):
+        wanted = profiler.requested()
+        if wanted:
+            name = callback_name((flask.request.get_json(silent=True) or {}).get('output'))
+            if _wanted(name, wanted):
+                return profiler.capture(name, dispatch, *args, **kwargs)
+        return dispatch(*args, **kwargs)
+
+    server.view_functions[endpoint] = profiled_dispatch
+
+    @server.after_request
+    def remember_profile_request(response):
+        # the page's callback requests carry the cookie, ?profile= alone stops profiling
+        request = flask.request
+        if request.method == 'GET' and PROFILE_ARG in request.args and request.path != PROFILES_PATH:
+            if request.args[PROFILE_ARG]:
+                response.set_cookie(PROFILE_COOKIE, request.args[PROFILE_ARG], samesite='Strict')
+            else:
+                response.delete_cookie(PROFILE_COOKIE)
+        return response
+
+    @server.route(PROFILES_PATH)
+    def list_profiles():
+        if not local_request(): flask.abort(403)
+        rows = []
+        for name in profiler.captures():
+            meta = profiler.meta(name)
+            table = meta.get('table') or {}
+            rows.append(f"<tr><td><a href='{PROFILES_PATH}/{name}'>{html.escape(meta['time'])}</a></td>"
+                        f"<td>{html.escape(meta['callback'])}</td><td>{meta['wall_ms']:.1f}</td>"
+                        f"<td>{meta['status']}</td><td>{meta['request_bytes']}</td><td>{meta['response_bytes']}</td>"
+                        f"<td>{html.escape(', '.join(f'{k} {v}' for k, v in table.items()))}</td>"
+                        f"<td><a href='{PROFILES_PATH}/{name}.prof'>.prof</a></td></tr>")
+        header = ''.join(f"<th align='left'>{col}</th>" for col in
+                         ['Time', 'Callback', 'ms', 'Status', 'Request bytes', 'Response bytes', 'Table', ''])
+        body = (f"<p>Profile a callback with the {PROFILE_HEADER} header, or load the page with "
+                f"?{PROFILE_ARG}=name (comma separated, * for all, empty to stop).</p>"
+                f"<table cellpadding='4'><tr>{header}</tr>{''.join(rows) or '<tr><td>No captures</td></tr>'}</table>")
+        return _page("Callback profiles", body)
+
+    @server.route(f'{PROFILES_PATH}/<name>')
+    def show_profile(name):
+        if not local_request(): flask.abort(403)
+        download = name.endswith('.prof')
+        name = name[:-5] if download else name
+        if not CAPTURE_RE.fullmatch(name) or name not in profiler.captures(): flask.abort(404)
+        if download:
+            return flask.send_from_directory(os.path.abspath(profiler.path), name + '.prof', as_attachment=True)
+        meta = profiler.meta(name)
+        inputs = ''.join(f"<tr><td>{html.escape(prop)}</td><td>{nbytes}</td></tr>"
+                         for prop, nbytes in sorted(meta['inputs'].items(), key=lambda item: -item[1]))
+        sort = flask.request.args.get('sort', 'cumulative')
+        if sort not in ('cumulative', 'tottime', 'ncalls'): sort = 'cumulative'
+        body = (f"<pre>{html.escape(json.dumps({k: v for k, v in meta.items() if k != 'inputs'}, indent=1))}</pre>"
+                f"<table cellpadding='2'><tr><th align='left'>Input</th><th align='left'>Bytes</th></tr>{inputs}</table>"
+                f"<p>Sort by <a href='?sort=cumulative'>cumulative</a> | <a href='?sort=tottime'>tottime</a> | "
+                f"<a href='?sort=ncalls'>ncalls</a></p><pre>{html.escape(profiler.stats(name, sort))}</pre>")
+        return _page(f"{meta['callback']} at {meta['time']}", body)
+
+    return profiler
+
+
+def session_table(store, state_id='state-store'):
+
+    """ describe of a Profiler: dimensions of the session table of the request, if it is loaded """
+
+    def describe(body):
+        for dep in body.get('inputs', []) + body.get('state', []):
+            value = dep.get('value') if isinstance(dep, dict) else None
+            if isinstance(value, dict) and dep.get('id') == state_id and value.get('session'):
+                model = store.backend.get(value['session'])
+                if model is None: return None
+                return {'rows': len(model.df), 'columns': len(model.df.columns), 'wells': len(model.wells),
+                        'scenarios': len(getattr(model, 'scenarios', []))}
+        return None
+
+    return describe
@@ -0,0 +1,93 @@
+import os, sys
+
+import pandas as pd, numpy as np
+
+from ui.utils import (ID_HEADER, WELL_NAME_HEADER, WELL_TYPE_HEADER, WELL_CONTROL_HEADER,
+                      TIME_HEADER, VARIABLE_NAME_HEADER)
+
+# float32 halves the size of the control values, at the cost of ~7 significant digits
+CONTROL_DTYPE = np.dtype(os.environ.get('CONTROL_VALUE_DTYPE', 'float64'))
+TIME_DTYPE = np.dtype('int32')
+CATEGORY_HEADERS = [WELL_NAME_HEADER, WELL_TYPE_HEADER, WELL_CONTROL_HEADER]
+# tags the loader sidecars, bump when compact_frame changes
+SCHEMA = {'version': 1, 'control_dtype': CONTROL_DTYPE.name}
+
+
+def is_name_column(col):
+    return col.startswith(VARIABLE_NAME_HEADER)
+
+
+def intern_strings(values):
+
+    """ Object array where equal strings are the same object, also across columns """
+
+    codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=True)
+    interned = np.empty(len(uniques) + 1, dtype=object)
+    interned[:-1] = [sys.intern(u) if isinstance(u, str) else u for u in uniques]
+    interned[-1] = np.nan
+    return interned[codes]
+
+
+def control_values(values, dtype=None):
+    dtype = np.dtype(dtype or CONTROL_DTYPE)
+    if np.ndim(values) == 0:
+        return dtype.type(values)
+    return np.asarray(values, dtype=np.float64).astype(dtype, copy=False)
+
+
+def compact_frame(df, control_dtype=None):
+
+    """
+    Compact schema of the controls / optimization tables: categorical well descriptors,
+    int32 time steps, interned variable names and CONTROL_DTYPE for the other numeric columns.
+    """
+
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if col in CATEGORY_HEADERS:
+            df[col] = df[col].astype('category')
+        elif col == TIME_HEADER:
+            df[col] = df[col].astype(TIME_DTYPE)
+        elif is_name_column(col):
+            df[col] = intern_strings(df[col].to_numpy())
+        elif col != ID_HEADER and pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = control_values(df[col], control_dtype)
+    return df
+
+
+def column_nbytes(series, seen=None):
+
+    """ Memory held by a column, strings already in seen (object ids) are not counted again """
+
+    if series.dtype != object:
+        return int(series.memory_usage(index=False, deep=True))
+
+    seen = set() if seen is None else seen
+    values = series.to_numpy()
+    nbytes = values.nbytes
+    for value in values:
+        if id(value) not in seen:
+            seen.add(id(value))
+            nbytes += sys.getsizeof(value)
+    return nbytes
+
+
+def frame_nbytes(df):
+
+    """
+    Memory held by a table. Unlike memory_usage(deep=True) a string shared
+    by several cells (interned names) is only counted once.
+    """
+
+    seen = set()
+    return int(df.index.memory_usage()) + sum(column_nbytes(df[col], seen) for col in df.columns)
+
+
+def memory_report(df):
+
+    """ Bytes per row of each column and of the whole table """
+
+    n_rows = max(len(df), 1)
+    report = {col: column_nbytes(df[col]) / n_rows for col in df.columns}
+    report['total'] = frame_nbytes(df) / n_rows
+    return report
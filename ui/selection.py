@@ -0,0 +1,243 @@
+import operator, re
+from functools import lru_cache
+
+import pandas as pd, numpy as np
+
+from ui.utils import ID_HEADER, FIXED_HEADERS, LOWER_BOUND_HEADER, UPPER_BOUND_HEADER
+from ui.lru import LRUCache
+
+SELECTION_CACHE_SIZE = 64
+
+COMPARISONS = {
+    '==': operator.eq, '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge,
+}
+KEYWORDS = ['and', 'or', 'not', 'in', 'contains']
+
+
+@lru_cache(maxsize=64)
+def _token_re(columns):
+    # known column names first (longest first), so names with spaces or digits are one token
+    names = ''.join('|' + re.escape(col) for col in sorted(columns, key=len, reverse=True))
+    return re.compile(rf'''\s*(?:
+        (?P<column>(?:`[^`]*`{names})(?![\w]))
+       |(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+       |(?P<number>-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)
+       |(?P<symbol>==|!=|<=|>=|=|<|>|\(|\)|\[|\]|,)
+       |(?P<word>\w+)
+    )''', re.X)
+
+
+def tokenize(query, columns):
+    token_re = _token_re(tuple(columns))
+    tokens, pos = [], 0
+    query = query.rstrip()
+    while pos < len(query):
+        match = token_re.match(query, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"Invalid selection at: {query[pos:]}")
+        kind, value = match.lastgroup, match.group(match.lastgroup)
+        if kind == 'column' and value.startswith('`'):
+            value = value[1:-1]
+            if value not in columns:
+                raise ValueError(f"Unknown column: {value}")
+        elif kind == 'word':
+            if value.lower() not in KEYWORDS:
+                raise ValueError(f"Unknown column or keyword: {value}")
+            value = value.lower()
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+def _compare(series, op, value):
+
+    """ Boolean mask of 'column op value', value is a constant or a column. Missing values never match """
+
+    if isinstance(series.dtype, pd.CategoricalDtype) and not isinstance(value, pd.Series):
+        # evaluated once per distinct value, code -1 (missing) picks the trailing False
+        categories = pd.Series(series.cat.categories, name=series.name)
+        return np.r_[_compare(categories, op, value), False][series.cat.codes.to_numpy()]
+
+    try:
+        if op == 'in':
+            mask = series.isin(value)
+        elif op == 'contains':
+            mask = series.astype(str).str.contains(str(value), regex=False)
+        else:
+            mask = COMPARISONS[op](series, value)
+    except TypeError:
+        raise ValueError(f"Can't compare {series.name} {op} {value!r}")
+    return np.asarray(mask, dtype=bool)
+
+
+class _Parser:
+
+    """ Recursive descent parser of a selection query into a mask function of a column getter """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty selection")
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Unexpected token: {self.peek()[1]}")
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.peek() == ('word', 'or'):
+            self.take()
+            left, right = node, self.parse_and()
+            node = lambda get, left=left, right=right: left(get) | right(get)
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.peek() == ('word', 'and'):
+            self.take()
+            left, right = node, self.parse_not()
+            node = lambda get, left=left, right=right: left(get) & right(get)
+        return node
+
+    def parse_not(self):
+        token = self.peek()
+        if token == ('word', 'not'):
+            self.take()
+            inner = self.parse_not()
+            return lambda get: ~inner(get)
+        if token == ('symbol', '('):
+            self.take()
+            node = self.parse_or()
+            if self.take() != ('symbol', ')'):
+                raise ValueError("Missing closing parenthesis")
+            return node
+        return self.parse_comparison()
+
+    def parse_value(self):
+        kind, value = self.take()
+        if kind == 'string':
+            return re.sub(r'\\(.)', r'\1', value[1:-1])
+        if kind == 'number':
+            value = float(value)
+            return int(value) if value.is_integer() else value
+        raise ValueError(f"Expected a value, got: {value}")
+
+    def parse_comparison(self):
+        kind, column = self.take()
+        if kind != 'column':
+            raise ValueError(f"Expected a column, got: {column}")
+
+        kind, op = self.take()
+        if (kind, op) == ('word', 'in'):
+            if self.take() != ('symbol', '['):
+                raise ValueError("Expected [ after in")
+            values = [self.parse_value()]
+            while self.peek() == ('symbol', ','):
+                self.take()
+                values.append(self.parse_value())
+            if self.take() != ('symbol', ']'):
+                raise ValueError("Missing closing bracket")
+            return lambda get: _compare(get(column), 'in', values)
+
+        if op not in COMPARISONS and (kind, op) != ('word', 'contains'):
+            raise ValueError(f"Unknown operator: {op}")
+        if self.peek()[0] == 'column':
+            other = self.take()[1]
+            return lambda get: _compare(get(column), op, get(other))
+        value = self.parse_value()
+        return lambda get: _compare(get(column), op, value)
+
+
+@lru_cache(maxsize=256)
+def compile_selection(query, columns):
+
+    """
+    Compile a selection query, e.g. 'Well Type == "Injector" and Time >= 365', over the given columns
+    (a tuple) into a function of a column getter returning a boolean mask of the rows.
+    Comparisons are ==, !=, <, <=, >, >=, contains and in [...] with a value or another column,
+    combined with and / or / not and parentheses. Raises ValueError for an invalid query.
+    """
+
+    return _Parser(tokenize(query, columns)).parse()
+
+
+def selection_columns(model):
+
+    """ Columns a selection can use: the fixed headers, the bounds and the scenarios """
+
+    columns = [col for col in FIXED_HEADERS + [LOWER_BOUND_HEADER, UPPER_BOUND_HEADER]
+               if col != ID_HEADER and col in model.df.columns]
+    return columns + list(getattr(model, 'scenarios', []))
+
+
+class Selection:
+
+    """ Rows of the table matching a selection query """
+
+    def __init__(self, query, mask, index):
+        self.query = query
+        self.mask = mask
+        self.positions = np.flatnonzero(mask)
+        self._index = index
+        self._well_counts = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def well_counts(self):
+
+        """ Number of selected rows of each well, in the order of TableIndex.wells """
+
+        if self._well_counts is None:
+            groups = np.searchsorted(self._index.starts, self.positions, side='right') - 1
+            self._well_counts = np.bincount(groups, minlength=len(self._index.starts))
+        return self._well_counts
+
+    @property
+    def wells(self):
+        return [well for well, count in zip(self._index.wells, self.well_counts) if count]
+
+
+# selections keyed by (session, server table version, query), see SessionStore.version
+CACHE = LRUCache(SELECTION_CACHE_SIZE)
+
+
+def select(model, query, session=None, version=None):
+
+    """
+    Selection of a query on a table model. With a session and version the selection is
+    cached until the table version changes. Raises ValueError for an invalid query.
+    """
+
+    key = (session, version, query.strip())
+    if None not in (session, version):
+        selection = CACHE.get(key)
+        if selection is not None:
+            return selection
+
+    predicate = compile_selection(key[2], tuple(selection_columns(model)))
+
+    def get(col):
+        if col in model.df.columns:
+            return model.df[col]
+        return pd.Series(model.column_values(col), name=col)
+
+    selection = Selection(key[2], predicate(get), model.index)
+    if None not in (session, version):
+        CACHE.put(key, selection)
+    return selection
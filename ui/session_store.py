@@ -0,0 +1,253 @@
+import os, pickle, re, secrets, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pandas as pd
+
+from ui.metrics import stage
+
+STORE_BACKEND_ENV = "TABLE_STORE_BACKEND"
+STORE_PATH_ENV = "TABLE_STORE_PATH"
+STORE_BUDGET_ENV = "TABLE_STORE_BUDGET_MB"
+
+DEFAULT_BUDGET_MB = 1024
+DEFAULT_MAX_SESSIONS = 64
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.sessions')
+# tokens of new_token, anything else a page sends back gets a new session
+TOKEN_RE = re.compile(r'[\w-]{16,64}')
+
+
+def estimate_nbytes(value):
+
+    """ Approximate memory footprint of a stored value, used for the memory budget """
+
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    nbytes = getattr(value, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes() if callable(nbytes) else nbytes)
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class MemoryBackend:
+
+    """
+    In-process LRU cache of session values and their versions bounded by a memory budget.
+    The least recently used sessions are evicted first, the most recent one is always kept.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_BUDGET_MB * 1024**2, max_entries=DEFAULT_MAX_SESSIONS):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None: return None
+            self._entries.move_to_end(token)
+            return entry[0]
+
+    def version(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            return None if entry is None else entry[2]
+
+    def set(self, token, value, version=None):
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            self._pop(token)
+            self._entries[token] = (value, nbytes, version)
+            self._nbytes += nbytes
+            self._evict()
+
+    def delete(self, token):
+        with self._lock:
+            self._pop(token)
+
+    def _pop(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is not None: self._nbytes -= entry[1]
+
+    def _evict(self):
+        # the version goes with the value
+        while len(self._entries) > 1 and (self._nbytes > self.max_bytes
+                                          or len(self._entries) > self.max_entries):
+            _, (_, nbytes, _) = self._entries.popitem(last=False)
+            self._nbytes -= nbytes
+
+
+class DiskBackend:
+
+    """
+    Local disk store of session values, one pickle file per session with the version first.
+    Writes go to a temporary file first and are renamed in place.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, token):
+        return os.path.join(self.path, f"{token}.pkl")
+
+    def _read(self, token, value=True):
+        # the version is pickled first, it is read without the value
+        try:
+            with open(self._file(token), 'rb') as f:
+                version = pickle.load(f)
+                return version, pickle.load(f) if value else None
+        except FileNotFoundError:
+            return None, None
+
+    def get(self, token):
+        return self._read(token)[1]
+
+    def version(self, token):
+        return self._read(token, value=False)[0]
+
+    def set(self, token, value, version=None):
+        tmp_file = self._file(token) + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(version, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self._file(token))
+
+    def delete(self, token):
+        try:
+            os.remove(self._file(token))
+        except FileNotFoundError:
+            pass
+
+
+def make_backend(namespace):
+
+    """
+    Backend selected by environment variables:
+    TABLE_STORE_BACKEND ('memory' or 'disk'), TABLE_STORE_PATH and TABLE_STORE_BUDGET_MB.
+    """
+
+    kind = os.environ.get(STORE_BACKEND_ENV, 'memory').lower()
+    if kind == 'disk':
+        path = os.environ.get(STORE_PATH_ENV, DEFAULT_STORE_PATH)
+        return DiskBackend(os.path.join(path, namespace))
+    if kind == 'memory':
+        budget_mb = float(os.environ.get(STORE_BUDGET_ENV, DEFAULT_BUDGET_MB))
+        return MemoryBackend(max_bytes=int(budget_mb * 1024**2))
+    raise ValueError(f"Unknown table store backend: {kind}")
+
+
+class SessionStore:
+
+    """
+    Server-side table state keyed by a session token.
+
+    The browser only holds the token in 'state-store', kept by its tab. Every put gives the table a new version,
+    kept with it in the backend: server caches are keyed by it (see version).
+    With a journal (see ui.journal), every put appends the session's edits to it and
+    values evicted from the backend, or lost with a restart, are replayed from it.
+    Otherwise they are reloaded with the loader, so a session always gets a table back.
+    A session's loads, replays, puts and edits (see edit) are serialized by its own lock, other sessions don't wait.
+    """
+
+    def __init__(self, loader, backend=None, journal=None):
+        self.loader = loader
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.journal = journal
+        if journal is not None: journal.attach(loader)
+        # session locks with the number of requests using them, removed when unused
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _session(self, token):
+        with self._lock:
+            entry = self._sessions.setdefault(token, [threading.RLock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]: del self._sessions[token]
+
+    def create(self, value=None):
+        token = self.new_token()
+        self.put(token, self.loader() if value is None else value)
+        return token
+
+    def new_token(self):
+
+        """ Token of a new session, its table is only loaded on first use (see get) """
+
+        return secrets.token_urlsafe(16)
+
+    def resume(self, token):
+
+        """ Token of a page load: the one its browser tab kept, or a new one """
+
+        return token if isinstance(token, str) and TOKEN_RE.fullmatch(token) else self.new_token()
+
+    def get(self, token):
+        with stage('store'):
+            value = self.backend.get(token)
+            if value is not None: return value
+            with self._session(token):
+                # loaded by another request of the session meanwhile
+                value = self.backend.get(token)
+                if value is not None: return value
+                # session unknown or evicted: replay its journal, or start again from the dataset
+                value = self.journal.recover(token) if self.journal is not None else None
+                if value is None:
+                    value = self.loader()
+                    if self.journal is not None: self.journal.start(token, value)
+                self.put(token, value)
+                return value
+
+    def put(self, token, value):
+        with self._session(token):
+            if self.journal is not None: self.journal.log(token, value)
+            # never reused, a session replayed after an eviction doesn't hit the caches of its old versions
+            version = secrets.token_hex(8)
+            self.backend.set(token, value, version)
+            return version
+
+    @contextmanager
+    def edit(self, token):
+
+        """
+        Session table for a read-modify-write, put it back inside the block:
+        the session's other requests wait for it, so none of them sees or stores a half edit
+        """
+
+        with self._session(token):
+            yield self.get(token)
+
+    def replace(self, token, value):
+
+        """ New table of a session, e.g. a reset: its journal starts again from it """
+
+        with self._session(token):
+            if self.journal is not None: self.journal.rebase(token, value)
+            return self.put(token, value)
+
+    def version(self, token):
+
+        """ Version of the session table on the server, None when it is not loaded """
+
+        return self.backend.version(token)
+
+    def drop(self, token):
+        with self._session(token):
+            self.backend.delete(token)
+            if self.journal is not None: self.journal.drop(token)
@@ -0,0 +1,95 @@
+import pandas as pd, numpy as np
+
+VARYING = "varying"
+CONSTANT_TOLERANCE = 1e-10
+SUMMARY_STATS = ['min', 'max', 'mean', 'first', 'count', 'size']
+
+
+def group_starts(df, keys):
+
+    """
+    Row order that puts the groups next to each other (sorted by keys) and the position where each group starts.
+    When the rows are already grouped in key order (see table_model.group_by_well) the order is None.
+    """
+
+    codes = df.groupby(by=keys, sort=True, observed=True).ngroup().to_numpy()
+    order = None
+    if len(codes) and (np.diff(codes) < 0).any():
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.array([], dtype=int)
+    return order, starts
+
+
+def group_stats(df, keys, value_cols):
+
+    """
+    Min / max / mean / first of the value columns per group, computed with one reduceat per statistic
+    over the group-sorted rows. Columns are (value column, stat), count and size are used to detect
+    missing values, first keeps the dtype of the column.
+    """
+
+    order, starts = group_starts(df, keys)
+    first_rows = starts if order is None else order[starts]
+    index = pd.MultiIndex.from_frame(df[keys].iloc[first_rows]) if len(keys) > 1 \
+        else pd.Index(df[keys[0]].iloc[first_rows])
+
+    if not value_cols or not len(starts):
+        return pd.DataFrame(index=index, columns=pd.MultiIndex.from_product([value_cols, SUMMARY_STATS]))
+
+    # one row per value column, so each reduceat runs over contiguous memory
+    values = df[value_cols].to_numpy(dtype=np.float64)
+    if order is not None: values = values[order]
+    values = np.ascontiguousarray(values.T)
+
+    is_valid = ~np.isnan(values)
+    count = np.add.reduceat(is_valid, starts, axis=1)
+    size = np.diff(np.r_[starts, values.shape[1]])
+    stats = {
+        'min': np.fmin.reduceat(values, starts, axis=1),
+        'max': np.fmax.reduceat(values, starts, axis=1),
+        'mean': np.add.reduceat(np.where(is_valid, values, 0.0), starts, axis=1) / np.maximum(count, 1),
+        'count': count,
+    }
+
+    data = {}
+    for i, col in enumerate(value_cols):
+        for stat in SUMMARY_STATS:
+            if stat == 'first':
+                data[(col, stat)] = df[col].to_numpy()[first_rows]
+            elif stat == 'size':
+                data[(col, stat)] = size
+            else:
+                data[(col, stat)] = stats[stat][i]
+
+    return pd.DataFrame(data, index=index)
+
+
+def constant_or_varying(stats, value_cols):
+
+    """
+    Per group display value: the value of the group when all its values are equal
+    (within CONSTANT_TOLERANCE, no missing values), otherwise 'varying'.
+    """
+
+    display = {}
+    for col in value_cols:
+        first = stats[(col, 'first')].to_numpy()
+        is_constant = ((stats[(col, 'max')].to_numpy() - first < CONSTANT_TOLERANCE)
+                       & (first - stats[(col, 'min')].to_numpy() < CONSTANT_TOLERANCE)
+                       & (stats[(col, 'count')].to_numpy() == stats[(col, 'size')].to_numpy()))
+        display[col] = np.where(is_constant, first.astype(object), VARYING)
+    return pd.DataFrame(display, index=stats.index)
+
+
+def group_display_value(values):
+
+    """ Display value of a single group, same rule as constant_or_varying """
+
+    values = np.asarray(values)
+    if not len(values): return VARYING
+    as_float = values.astype(np.float64)
+    deviation = np.abs(as_float - as_float[0])
+    if np.isnan(deviation).any() or deviation.max() >= CONSTANT_TOLERANCE:
+        return VARYING
+    return values[0].item()
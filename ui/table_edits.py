@@ -0,0 +1,24 @@
+from ui.utils import ID_HEADER
+
+
+def changed_cells(rows, previous_rows, columns):
+
+    """
+    Cells edited in a DataTable, from its data and data_previous.
+    Returns {column: (row ids, new values)} holding only the columns with changes.
+    """
+
+    if not rows or not previous_rows:
+        return {}
+
+    previous = {row.get(ID_HEADER): row for row in previous_rows}
+    changes = {}
+    for row in rows:
+        before = previous.get(row.get(ID_HEADER))
+        if before is None: continue
+        for col in columns:
+            if col in row and row[col] != before.get(col):
+                row_ids, values = changes.setdefault(col, ([], []))
+                row_ids.append(row[ID_HEADER])
+                values.append(row[col])
+    return changes
@@ -0,0 +1,613 @@
+import pandas as pd, numpy as np
+
+from ui.utils import (ID_HEADER, WELL_NAME_HEADER, WELL_TYPE_HEADER, VARIABLE_NAME_HEADER,
+                      VARIABLE_NAME_ORIGINAL, LOWER_BOUND_HEADER, UPPER_BOUND_HEADER,
+                      get_avg_df, get_scenario_cols)
+from ui.summary import group_display_value, group_stats, constant_or_varying
+from ui.schema import CONTROL_DTYPE, is_name_column, intern_strings, control_values, frame_nbytes
+from ui.bulk import SCOPE_WELL, SCOPE_TYPE, SCOPE_ALL, apply_bulk
+from ui.violations import out_of_bounds, violation_counts, violation_frame
+from ui.history import History, ValueDelta, NameDelta, AddScenarioDelta, DropScenarioDelta
+from ui.persistence import DirtySet
+
+# a virtual scenario becomes a column once this share of its wells differ from the parent
+MATERIALIZE_FRACTION = 0.25
+# above this many changed wells the summary column is recomputed in one pass
+SUMMARY_REFRESH_WELLS = 32
+
+
+def group_by_well(df):
+
+    """ Return the table with the rows of each well next to each other, keeping the time step order """
+
+    df = df.sort_values(by=WELL_NAME_HEADER, kind='stable')
+    return df.reset_index(drop=True)
+
+
+class TableIndex:
+
+    """
+    Row positions of each well and of each row id.
+    Requires the rows of a well to be contiguous (see group_by_well), so a well is a slice.
+    """
+
+    def __init__(self, df):
+        names = df[WELL_NAME_HEADER].to_numpy()
+        n_rows = len(names)
+
+        starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]]) if n_rows else np.array([], dtype=int)
+        stops = np.r_[starts[1:], n_rows]
+
+        self.starts = starts
+        self.wells = {names[start]: slice(int(start), int(stop)) for start, stop in zip(starts, stops)}
+        if len(self.wells) != len(starts):
+            raise ValueError("Rows are not grouped by well")
+
+        self.ids = pd.Index(df[ID_HEADER].to_numpy())
+
+    def well_slice(self, well):
+        return self.wells[well]
+
+    def well_size(self, well):
+        rows = self.wells[well]
+        return rows.stop - rows.start
+
+    def position(self, row_id):
+        return self.ids.get_loc(row_id)
+
+    def positions(self, row_ids):
+        positions = self.ids.get_indexer(row_ids)
+        if (positions < 0).any():
+            raise KeyError("Unknown row ids")
+        return positions
+
+    def rows(self, wells):
+
+        """ Row positions of the wells, in table order """
+
+        slices = sorted((self.wells[well] for well in wells), key=lambda rows: rows.start)
+        starts = np.array([rows.start for rows in slices], dtype=np.int64)
+        sizes = np.array([rows.stop for rows in slices], dtype=np.int64) - starts
+        offsets = np.cumsum(sizes) - sizes
+        return np.arange(sizes.sum()) + np.repeat(starts - offsets, sizes)
+
+    def wells_at(self, positions):
+
+        """ Wells owning the given row positions """
+
+        well_names = list(self.wells)
+        groups = np.unique(np.searchsorted(self.starts, positions, side='right') - 1)
+        return [well_names[i] for i in groups]
+
+
+class TableModel:
+
+    """
+    Table kept in the session store: the DataFrame grouped by well plus its row index.
+    Structural changes go through this class so the index stays in synch.
+    Value edits are journaled in history (see ui.history) for undo / redo,
+    the wells and columns they change since the last save are in dirty (see ui.persistence).
+    """
+
+    def __init__(self, df):
+        self.df = group_by_well(df)
+        self.index = TableIndex(self.df)
+        self.history = History()
+        self.dirty = DirtySet()
+        self._summary = None
+        self._nbytes = None
+        self._row_sets = {}
+
+    def __getstate__(self):
+        # the columns pickle as their NumPy arrays, the index and the summary are rebuilt on load
+        return {'table': self.df, 'history': self.history, 'dirty': self.dirty}
+
+    def __setstate__(self, state):
+        self.__init__(state['table'])
+        self.history = state.get('history', self.history)
+        self.dirty = state.get('dirty', self.dirty)
+
+    @property
+    def nbytes(self):
+        # edits keep the schema, the size only changes with the columns
+        if self._nbytes is None:
+            self._nbytes = frame_nbytes(self.df)
+        return self._nbytes + self.history.nbytes
+
+    @property
+    def wells(self):
+        return list(self.index.wells)
+
+    def well_rows(self, well, columns=None):
+        rows = self.df.iloc[self.index.well_slice(well)]
+        return rows if columns is None else rows[columns]
+
+    def row(self, row_id):
+        return self.df.iloc[self.index.position(row_id)]
+
+    def to_frame(self, rows=slice(None)):
+
+        """ Table as in the dataset, or a slice of its rows """
+
+        return self.df.iloc[rows].copy(deep=False)
+
+    def column_values(self, col):
+        return self.df[col].to_numpy()
+
+    def position_values(self, col, positions):
+        return self.df[col].to_numpy()[positions]
+
+    def row_set(self, scope, well=None):
+
+        """
+        Row positions of a bulk edit scope (see ui.bulk): the well, the wells
+        with the same type as the well or all the wells. Cached, rows never move.
+        """
+
+        if scope == SCOPE_WELL:
+            rows = self.index.well_slice(well)
+            return np.arange(rows.start, rows.stop)
+
+        if scope == SCOPE_TYPE:
+            well_type = self.df[WELL_TYPE_HEADER].iloc[self.index.well_slice(well).start]
+            key = (SCOPE_TYPE, well_type)
+        elif scope == SCOPE_ALL:
+            key = (SCOPE_ALL,)
+        else:
+            raise ValueError(f"Unknown scope: {scope}")
+
+        if key not in self._row_sets:
+            if scope == SCOPE_ALL:
+                self._row_sets[key] = np.arange(len(self.df))
+            else:
+                self._row_sets[key] = np.flatnonzero(self.df[WELL_TYPE_HEADER].to_numpy() == well_type)
+        return self._row_sets[key]
+
+    def apply_bulk(self, col, positions, operation, **params):
+
+        """ Bulk operation on a column at the row positions (see ui.bulk.apply_bulk) """
+
+        return apply_bulk(self, col, positions, operation, **params)
+
+    def summary(self):
+
+        """ Main table data (see get_avg_df), cached and updated per well on edits """
+
+        if self._summary is None:
+            self._summary = get_avg_df(self.df)
+        return self._summary
+
+    def _update_summary(self, wells, col):
+        if self._summary is None or col not in self._summary.columns: return
+        if len(wells) > SUMMARY_REFRESH_WELLS:
+            self._summary[col] = self._column_summary(col).reindex(self._summary.index).to_numpy()
+            return
+        for well in wells:
+            self._summary.at[well, col] = self.well_summary(well, col)
+
+    def _column_summary(self, col):
+        frame = pd.DataFrame({WELL_NAME_HEADER: self.df[WELL_NAME_HEADER], col: self.column_values(col)})
+        return constant_or_varying(group_stats(frame, [WELL_NAME_HEADER], [col]), [col])[col]
+
+    def well_summary(self, well, col):
+
+        """ Main table value of one well and scenario """
+
+        rows = self.index.well_slice(well)
+        return group_display_value(self.df.iloc[rows, self.df.columns.get_loc(col)].to_numpy())
+
+    def _cast(self, col, values, dtype=None):
+
+        """ Values in the compact schema of the column (see schema.compact_frame) """
+
+        dtype = dtype if dtype is not None else self.df[col].dtype
+        if is_name_column(col):
+            return values if np.ndim(values) == 0 else intern_strings(np.asarray(values, dtype=object))
+        if pd.api.types.is_float_dtype(dtype):
+            return control_values(values, dtype)
+        return values
+
+    def set_well_values(self, well, col, values):
+        rows = self.index.well_slice(well)
+        self.set_position_values(np.arange(rows.start, rows.stop), col, values)
+
+    def set_row_values(self, row_ids, col, values):
+        self.set_position_values(self.index.positions(row_ids), col, values)
+
+    def set_position_values(self, positions, col, values):
+
+        """ Values of a column at row positions, all the value edits go through here """
+
+        positions = np.asarray(positions)
+        if self.history.recording:
+            new = np.array(np.broadcast_to(values, positions.shape))
+            self.history.record(ValueDelta(col, positions, self.position_values(col, positions), new))
+        self._write_values(positions, col, values)
+        self.dirty.mark_wells(self.index.wells_at(positions))
+
+    def _write_values(self, positions, col, values):
+        self.df.iloc[positions, self.df.columns.get_loc(col)] = self._cast(col, values)
+        self._update_summary(self.index.wells_at(positions), col)
+
+    def add_column(self, col, values):
+        # new columns don't change the row order, the index stays valid
+        values = np.asarray(values)
+        self.df[col] = self._cast(col, values, CONTROL_DTYPE if values.dtype.kind in 'iuf' else object)
+        self.dirty.mark_column(col)
+        self._summary = None
+        self._nbytes = None
+
+    def drop_columns(self, cols):
+        self.df.drop(labels=cols, axis=1, inplace=True)
+        self._summary = None
+        self._nbytes = None
+
+
+def variable_name_col(scenario):
+    return f"{VARIABLE_NAME_HEADER} - {scenario}"
+
+
+class VirtualScenario:
+
+    """
+    Scenario stored as a reference to its parent scenario plus the values of
+    the wells that differ from it, a mapping of well to the array of its time steps.
+    """
+
+    __slots__ = ('parent', 'wells')
+
+    def __init__(self, parent, wells=None):
+        self.parent = parent
+        self.wells = {} if wells is None else wells
+
+    def __getstate__(self):
+        return {'parent': self.parent, 'wells': self.wells}
+
+    def __setstate__(self, state):
+        self.parent, self.wells = state['parent'], state['wells']
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.wells.values())
+
+
+class ScenarioTableModel(TableModel):
+
+    """
+    Forecast controls table with scenario columns.
+
+    The variable names of a scenario are the original names plus sparse overrides:
+    a mapping of row id to name per scenario, holding only the rows the user renamed.
+    The 'Variable Name - <scenario>' columns of the dataset are folded into these
+    overrides on load and rebuilt by to_frame.
+
+    Scenarios added from a parent scenario are copy-on-write (see VirtualScenario):
+    they only hold the wells edited since, and become a column of df once more than
+    MATERIALIZE_FRACTION of the wells differ. Before a scenario changes, the wells
+    its virtual children still share are copied into them.
+
+    The violation index counts the time steps out of bounds per well and scenario,
+    it is built in one pass per scenario and updated per well with the summary.
+
+    Renames and scenarios added or dropped are journaled with the value edits.
+    """
+
+    def __init__(self, df):
+        name_overrides = {}
+        scenarios = get_scenario_cols(df.head(0))
+        original = df[VARIABLE_NAME_ORIGINAL].to_numpy()
+        name_cols = []
+        for scenario in scenarios:
+            col = variable_name_col(scenario)
+            if col not in df.columns: continue
+            names = df[col].to_numpy()
+            renamed = names != original
+            name_overrides[scenario] = dict(zip(df[ID_HEADER].to_numpy()[renamed].tolist(), names[renamed].tolist()))
+            name_cols.append(col)
+
+        super().__init__(df.drop(columns=name_cols))
+        self.name_overrides = name_overrides
+        for scenario in scenarios:
+            self.name_overrides.setdefault(scenario, {})
+        self.virtual = {}
+        self.scenario_order = scenarios
+        self._violations = None
+
+    def __getstate__(self):
+        # virtual scenarios are kept as is, the store doesn't pay for the shared wells
+        return {'table': self.df, 'name_overrides': self.name_overrides,
+                'virtual': self.virtual, 'scenario_order': self.scenario_order, 'history': self.history,
+                'dirty': self.dirty}
+
+    def __setstate__(self, state):
+        TableModel.__init__(self, state['table'])
+        self.history = state.get('history', self.history)
+        self.dirty = state.get('dirty', self.dirty)
+        self.name_overrides = state['name_overrides']
+        self.virtual = state['virtual']
+        self.scenario_order = state['scenario_order']
+        self._violations = None
+
+    @property
+    def nbytes(self):
+        # rough size of a dict entry holding a row id and a name
+        return (super().nbytes + 150 * sum(len(overrides) for overrides in self.name_overrides.values())
+                + sum(virtual.nbytes for virtual in self.virtual.values()))
+
+    @property
+    def scenarios(self):
+        return list(self.scenario_order)
+
+    def is_virtual(self, scenario):
+        return scenario in self.virtual
+
+    def name_taken(self, name):
+
+        """ Whether a scenario or another column has the name, ignoring case as the add scenario popup does """
+
+        name = name.lower()
+        return any(col.lower() == name for col in list(self.df.columns) + self.scenario_order)
+
+    def _children(self, scenario):
+        return [name for name, virtual in self.virtual.items() if virtual.parent == scenario]
+
+    def scenario_values(self, scenario, well):
+
+        """ Values of the time steps of a well in a scenario, read-only """
+
+        while scenario in self.virtual:
+            virtual = self.virtual[scenario]
+            if well in virtual.wells:
+                return virtual.wells[well]
+            scenario = virtual.parent
+        return self.df[scenario].to_numpy()[self.index.well_slice(well)]
+
+    def position_values(self, col, positions):
+        if col not in self.virtual:
+            return super().position_values(col, positions)
+        values = np.empty(len(positions), dtype=CONTROL_DTYPE)
+        for well in self.index.wells_at(positions):
+            rows = self.index.well_slice(well)
+            in_well = (positions >= rows.start) & (positions < rows.stop)
+            values[in_well] = self.scenario_values(col, well)[positions[in_well] - rows.start]
+        return values
+
+    def column_values(self, scenario):
+
+        """ Values of all the rows in a scenario """
+
+        if scenario not in self.virtual:
+            return self.df[scenario].to_numpy()
+        virtual = self.virtual[scenario]
+        values = np.array(self.column_values(virtual.parent), dtype=CONTROL_DTYPE)
+        for well, well_values in virtual.wells.items():
+            values[self.index.well_slice(well)] = well_values
+        return values
+
+    def materialize(self, scenario):
+
+        """ Turn a virtual scenario into a column of df, its values don't change """
+
+        if scenario not in self.virtual: return
+        values = self.column_values(scenario)
+        del self.virtual[scenario]
+        self.df[scenario] = values
+        self._nbytes = None
+
+    def _maybe_materialize(self, scenario, n_wells=0):
+        virtual = self.virtual.get(scenario)
+        if virtual is not None and len(virtual.wells) + n_wells > MATERIALIZE_FRACTION * len(self.index.wells):
+            self.materialize(scenario)
+
+    def _detach_children(self, scenario, wells):
+        # the children keep the current values of the wells about to change
+        for child in self._children(scenario):
+            deltas = self.virtual[child].wells
+            for well in wells:
+                if well not in deltas:
+                    deltas[well] = np.array(self.scenario_values(scenario, well), dtype=CONTROL_DTYPE)
+            self._maybe_materialize(child)
+
+    def _own_well(self, scenario, well):
+        deltas = self.virtual[scenario].wells
+        if well not in deltas:
+            deltas[well] = np.array(self.scenario_values(scenario, well), dtype=CONTROL_DTYPE)
+        return deltas[well]
+
+    def well_summary(self, well, col):
+        if col in self.virtual:
+            return group_display_value(self.scenario_values(col, well))
+        return super().well_summary(well, col)
+
+    def summary(self):
+
+        """ Main table data, the wells a virtual scenario shares come from its parent column """
+
+        if self._summary is None:
+            summary = get_avg_df(self.df)
+            for scenario in self.scenario_order:
+                if scenario not in self.virtual: continue
+                virtual = self.virtual[scenario]
+                summary[scenario] = summary[virtual.parent]
+                for well in virtual.wells:
+                    summary.at[well, scenario] = self.well_summary(well, scenario)
+            self._summary = summary[[WELL_NAME_HEADER, WELL_TYPE_HEADER] + self.scenario_order + [ID_HEADER]]
+        return self._summary
+
+    def _bounds(self, rows=slice(None)):
+        return (self.df[LOWER_BOUND_HEADER].to_numpy()[rows], self.df[UPPER_BOUND_HEADER].to_numpy()[rows])
+
+    def _violation_column(self, scenario):
+        lower, upper = self._bounds()
+        return violation_counts(self.column_values(scenario), lower, upper, self.index.starts)[0]
+
+    def violations(self):
+
+        """ Time steps out of bounds per well (rows, in table order) and scenario (columns) """
+
+        if self._violations is None:
+            lower, upper = self._bounds()
+            self._violations = violation_frame({scenario: self.column_values(scenario)
+                                                for scenario in self.scenario_order},
+                                               lower, upper, self.index.starts, self.wells)
+        return self._violations
+
+    def _update_violations(self, wells, col):
+        if self._violations is None: return
+        if col in (LOWER_BOUND_HEADER, UPPER_BOUND_HEADER):
+            scenarios = self.scenario_order
+        elif col in self.scenario_order:
+            scenarios = [col]
+        else:
+            return
+
+        for scenario in scenarios:
+            if len(wells) > SUMMARY_REFRESH_WELLS:
+                self._violations[scenario] = self._violation_column(scenario)
+                continue
+            for well in wells:
+                rows = self.index.well_slice(well)
+                self._violations.at[well, scenario] = int(out_of_bounds(self.scenario_values(scenario, well),
+                                                                        *self._bounds(rows)).sum())
+
+    def _update_summary(self, wells, col):
+        super()._update_summary(wells, col)
+        self._update_violations(wells, col)
+
+    def _write_values(self, positions, col, values):
+        if col not in self.scenario_order:
+            return super()._write_values(positions, col, values)
+
+        wells = self.index.wells_at(positions)
+        self._detach_children(col, wells)
+        self._maybe_materialize(col, n_wells=len(wells))
+        if col not in self.virtual:
+            return super()._write_values(positions, col, values)
+
+        values = np.broadcast_to(control_values(values, CONTROL_DTYPE), positions.shape)
+        for well in wells:
+            rows = self.index.well_slice(well)
+            in_well = (positions >= rows.start) & (positions < rows.stop)
+            self._own_well(col, well)[positions[in_well] - rows.start] = values[in_well]
+        self._update_summary(wells, col)
+
+    def variable_names(self, scenario, well):
+
+        """ Effective variable names of the time steps of a well in a scenario """
+
+        rows = self.index.well_slice(well)
+        names = self.df[VARIABLE_NAME_ORIGINAL].to_numpy()[rows].copy()
+        overrides = self.name_overrides.get(scenario)
+        if overrides:
+            positions = self.index.ids.get_indexer(list(overrides))
+            in_well = (positions >= rows.start) & (positions < rows.stop)
+            names[positions[in_well] - rows.start] = np.asarray(list(overrides.values()), dtype=object)[in_well]
+        return names
+
+    def set_variable_names(self, scenario, row_ids, names):
+        overrides = self.name_overrides[scenario]
+        original = self.df[VARIABLE_NAME_ORIGINAL].to_numpy()[self.index.positions(row_ids)]
+        if self.history.recording:
+            row_ids = np.asarray(row_ids).tolist()
+            self.history.record(NameDelta(scenario, row_ids,
+                                          [overrides.get(row_id, name) for row_id, name in zip(row_ids, original)],
+                                          list(names)))
+        for row_id, name, original_name in zip(np.asarray(row_ids).tolist(), intern_strings(names), original):
+            if name == original_name:
+                overrides.pop(row_id, None)
+            else:
+                overrides[row_id] = name
+        self.dirty.mark_wells(self.index.wells_at(self.index.positions(row_ids)))
+
+    def add_scenario(self, scenario, values=None, parent=None, index=None):
+
+        """
+        New scenario with the given values, or a copy-on-write copy of the parent scenario.
+        Added last, or at index in the scenario order. Raises ValueError for a name
+        already taken (see name_taken), before anything changes.
+        """
+
+        if self.name_taken(scenario):
+            raise ValueError(f"Name already taken: {scenario}")
+        if parent is not None and parent not in self.scenario_order:
+            raise KeyError(f"Unknown scenario: {parent}")
+        index = len(self.scenario_order) if index is None else index
+        if parent is not None:
+            self.virtual[scenario] = VirtualScenario(parent)
+        else:
+            # new columns don't change the row order, the index stays valid
+            values = control_values(values, CONTROL_DTYPE)
+            self.df[scenario] = values
+            self._nbytes = None
+        if self.history.recording:
+            self.history.record(AddScenarioDelta(scenario, index, parent,
+                                                 None if values is None else values.copy()))
+
+        self.scenario_order.insert(index, scenario)
+        # same names as the original until renamed
+        self.name_overrides[scenario] = {}
+        self.dirty.mark_column(scenario)
+
+        if self._summary is not None:
+            summary = (self._summary[parent].to_numpy() if parent is not None
+                       else self._column_summary(scenario).reindex(self._summary.index).to_numpy())
+            following = self.scenario_order[index + 1] if index + 1 < len(self.scenario_order) else ID_HEADER
+            self._summary.insert(self._summary.columns.get_loc(following), scenario, summary)
+        if self._violations is not None:
+            violations = (self._violations[parent].to_numpy() if parent is not None
+                          else self._violation_column(scenario))
+            self._violations.insert(index, scenario, violations)
+
+    def drop_scenarios(self, scenarios):
+        # undone as one action
+        with self.history.action():
+            for scenario in scenarios:
+                if self.history.recording:
+                    # the values are kept as a column, the children no longer need the scenario
+                    self.history.record(DropScenarioDelta(scenario, self.scenario_order.index(scenario),
+                                                          np.array(self.column_values(scenario)),
+                                                          dict(self.name_overrides[scenario])))
+                for child in self._children(scenario):
+                    if scenario in self.virtual:
+                        # the child now shares the wells of its grandparent
+                        dropped, virtual = self.virtual[scenario], self.virtual[child]
+                        for well, values in dropped.wells.items():
+                            virtual.wells.setdefault(well, values.copy())
+                        virtual.parent = dropped.parent
+                        self._maybe_materialize(child)
+                    else:
+                        self.materialize(child)
+                self.virtual.pop(scenario, None)
+                self.scenario_order.remove(scenario)
+                self.name_overrides.pop(scenario, None)
+
+        columns = [scenario for scenario in scenarios if scenario in self.df.columns]
+        if columns:
+            self.df.drop(labels=columns, axis=1, inplace=True)
+            self._nbytes = None
+        if self._summary is not None:
+            self._summary = self._summary.drop(columns=scenarios)
+        if self._violations is not None:
+            self._violations = self._violations.drop(columns=scenarios)
+
+    def to_frame(self, rows=slice(None)):
+
+        """
+        Table with one 'Variable Name - <scenario>' column per scenario, as in the dataset,
+        or a slice of its rows
+        """
+
+        start, stop, _ = rows.indices(len(self.df))
+        df = self.df.iloc[start:stop, [i for i, col in enumerate(self.df.columns) if col not in self.scenario_order]]
+        df = df.copy(deep=False)
+        original = self.df[VARIABLE_NAME_ORIGINAL].to_numpy()[start:stop]
+        for scenario in self.scenario_order:
+            names = original.copy()
+            overrides = self.name_overrides.get(scenario)
+            if overrides:
+                positions = self.index.positions(list(overrides))
+                in_rows = (positions >= start) & (positions < stop)
+                names[positions[in_rows] - start] = np.asarray(list(overrides.values()), dtype=object)[in_rows]
+            df[scenario] = self.column_values(scenario)[start:stop]
+            df[variable_name_col(scenario)] = names
+        return df
@@ -0,0 +1,230 @@
+import math, operator, re
+from functools import lru_cache
+
+import pandas as pd
+
+TOKEN_RE = re.compile(r'''\s*(?:
+    (?P<field>\{[^}]*\})
+   |(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`(?:[^`\\]|\\.)*`)
+   |(?P<number>-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?(?![^\s(){}&|]))
+   |(?P<symbol>&&|\|\||>=|<=|!=|=|<|>|\(|\)|!)
+   |(?P<word>[^\s(){}"'`]+)
+)''', re.X)
+
+RELATIONAL_OPERATORS = {
+    '=': operator.eq, 'eq': operator.eq,
+    '!=': operator.ne, 'ne': operator.ne,
+    '<': operator.lt, 'lt': operator.lt,
+    '<=': operator.le, 'le': operator.le,
+    '>': operator.gt, 'gt': operator.gt,
+    '>=': operator.ge, 'ge': operator.ge,
+}
+STRING_OPERATORS = ['contains', 'datestartswith']
+UNARY_OPERATORS = ['blank', 'nil', 'num', 'str']
+OPERATOR_RE = re.compile(r'^(?P<case>[is]?)(?P<op>=|!=|<=|>=|<|>|eq|ne|lt|le|gt|ge|contains|datestartswith)$')
+
+
+def tokenize(query):
+    tokens, pos = [], 0
+    query = query.rstrip()
+    while pos < len(query):
+        match = TOKEN_RE.match(query, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"Invalid filter query at: {query[pos:]}")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+
+def _numeric(series):
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series
+    return pd.to_numeric(series, errors='coerce')
+
+
+def _text(series, case_insensitive):
+    text = series.astype(str)
+    return text.str.lower() if case_insensitive else text
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _compare(op, case_insensitive, left, right):
+
+    """ Mask for 'left op right', left is a column and right a column or a constant """
+
+    if op in STRING_OPERATORS:
+        pattern = str(right).lower() if case_insensitive else str(right)
+        text = _text(left, case_insensitive)
+        if op == 'contains':
+            return text.str.contains(pattern, regex=False)
+        return text.str.startswith(pattern)
+
+    compare = RELATIONAL_OPERATORS[op]
+    if isinstance(right, pd.Series) or _is_number(right):
+        mask = compare(_numeric(left), _numeric(right) if isinstance(right, pd.Series) else right)
+    else:
+        right = str(right)
+        mask = compare(_text(left, case_insensitive), right.lower() if case_insensitive else right)
+
+    if compare is operator.ne:
+        return mask.fillna(True).astype(bool)
+    return mask.fillna(False).astype(bool)
+
+
+def _unary(op, series):
+    if op == 'nil':
+        return series.isna()
+    if op == 'blank':
+        return series.isna() | (series.astype(str).str.strip() == '')
+    is_number = _numeric(series).notna()
+    if op == 'num':
+        return is_number
+    return series.notna() & ~is_number
+
+
+class _Parser:
+
+    """ Recursive descent parser of the DataTable filter_query syntax into a mask function """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Unexpected token: {self.peek()[1]}")
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.peek()[1] in ('||', 'or'):
+            self.take()
+            left, right = node, self.parse_and()
+            node = lambda df, left=left, right=right: left(df) | right(df)
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.peek()[1] in ('&&', 'and'):
+            self.take()
+            left, right = node, self.parse_not()
+            node = lambda df, left=left, right=right: left(df) & right(df)
+        return node
+
+    def parse_not(self):
+        kind, value = self.peek()
+        if value in ('!', 'not'):
+            self.take()
+            inner = self.parse_not()
+            return lambda df: ~inner(df)
+        if value == '(':
+            self.take()
+            node = self.parse_or()
+            if self.take()[1] != ')':
+                raise ValueError("Missing closing parenthesis")
+            return node
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        kind, field = self.take()
+        if kind != 'field':
+            raise ValueError(f"Expected a column, got: {field}")
+        column = field[1:-1]
+
+        kind, op_token = self.take()
+        if op_token == 'is':
+            kind, op = self.take()
+            if op not in UNARY_OPERATORS:
+                raise ValueError(f"Unknown operator: is {op}")
+            return lambda df: _unary(op, df[column])
+
+        match = OPERATOR_RE.match(op_token or '')
+        if not match:
+            raise ValueError(f"Unknown operator: {op_token}")
+        op, case_insensitive = match.group('op'), match.group('case') == 'i'
+
+        kind, value = self.take()
+        if kind == 'field':
+            other = value[1:-1]
+            return lambda df: _compare(op, case_insensitive, df[column], df[other])
+        if kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'number':
+            value = float(value)
+            value = int(value) if value.is_integer() else value
+        elif kind != 'word':
+            raise ValueError(f"Expected a value, got: {value}")
+        return lambda df: _compare(op, case_insensitive, df[column], value)
+
+
+@lru_cache(maxsize=256)
+def compile_filter(filter_query):
+
+    """
+    Compile a DataTable filter_query into a function returning a boolean mask of a DataFrame.
+    Returns None for an empty or invalid query, like the DataTable ignores invalid queries.
+    """
+
+    if not filter_query or not filter_query.strip():
+        return None
+    try:
+        return _Parser(tokenize(filter_query)).parse()
+    except ValueError:
+        return None
+
+
+def filter_frame(df, filter_query):
+    predicate = compile_filter(filter_query or '')
+    if predicate is None:
+        return df
+    try:
+        mask = predicate(df)
+    except KeyError:
+        # unknown column, the query is ignored
+        return df
+    return df[mask.to_numpy()]
+
+
+def _sort_key(series):
+    numeric = pd.to_numeric(series, errors='coerce')
+    if numeric.notna().any():
+        # numbers first, text such as 'varying' goes last
+        return numeric
+    return series.astype(str)
+
+
+def sort_frame(df, sort_by):
+    if not sort_by:
+        return df
+    sort_by = [s for s in sort_by if s['column_id'] in df.columns]
+    if not sort_by:
+        return df
+    return df.sort_values(by=[s['column_id'] for s in sort_by],
+                          ascending=[s['direction'] == 'asc' for s in sort_by],
+                          key=_sort_key, kind='stable', na_position='last')
+
+
+def page_frame(df, page_current, page_size, sort_by=None, filter_query=None):
+
+    """
+    Filtered, sorted page of a table for the DataTable custom page / sort / filter actions.
+    Returns the page and the page count.
+    """
+
+    df = sort_frame(filter_frame(df, filter_query), sort_by)
+    page_size = page_size or len(df) or 1
+    page_count = max(1, math.ceil(len(df) / page_size))
+    start = (page_current or 0) * page_size
+    return df.iloc[start:start + page_size], page_count
@@ -8,11 +8,22 @@ import dash_bootstrap_components as dbc
 from ui.utils_opt import (PAGE_SIZE, ID_HEADER, VARIABLE_NAME_HEADER, INIT_VALUE_HEADER, WELL_NAME_HEADER,
                       WELL_TYPE_HEADER, LOWER_BOUND_HEADER, UPPER_BOUND_HEADER, SUBSET_COLS,
                       EDITABLE_COLS)
+from ui.table_query import page_frame
+from ui.encoding import records
+from ui.lru import LRUCache
+from ui.bulk import BULK_OPERATIONS, BULK_PARAMETERS, BULK_SCOPES, SCOPE_WELL, bulk_options
+
+# parameter rows keyed by (session, server table version, well), paging / sorting reuses them
+SUBSET_CACHE_SIZE = 64
+SUBSET_CACHE = LRUCache(SUBSET_CACHE_SIZE)
+# how often the page asks whether a save is on disk
+SAVE_POLL_MS = 250
 
 def make_modal_update_all():
 
     """
-    Pop-up to overwrite optimization parameters by a constant number.
+    Pop-up to transform an optimization parameter for all time steps (see ui.bulk),
+    for the selected well, the wells of its type or all wells.
     """
     parameter_select_options = [{'label': val, "value": val} for val in EDITABLE_COLS if val != VARIABLE_NAME_HEADER]
 
@@ -26,13 +37,30 @@ def make_modal_update_all():
                                 id="param-select",
                                 options=parameter_select_options
                             )
-                        ]
+                        ],
+                        className="mb-3"
                     ),
-                    dbc.Row(html.P("Enter value to overwrite optimization parameter for all time steps.")),
+                    dbc.InputGroup(children=[dbc.InputGroupText("Operation:"),
+                                             dbc.Select(id="bulk-operation", value='set',
+                                                        options=bulk_options(BULK_OPERATIONS))],
+                                   className="mb-3"),
+                    dbc.InputGroup(children=[dbc.InputGroupText("Wells:"),
+                                             dbc.Select(id="bulk-scope", value=SCOPE_WELL,
+                                                        options=bulk_options(BULK_SCOPES))],
+                                   className="mb-3"),
+                    dbc.Row(html.P("Enter values to update the optimization parameter for all time steps.")),
                     dbc.Row(dbc.InputGroup(children=[dbc.InputGroupText("Value:"),
                                                         dbc.Input(id="control-input",
                                                                   type="number")],
                                             className="mb-3")),
+                    dbc.Row(dbc.InputGroup(children=[dbc.InputGroupText("End Value:"),
+                                                        dbc.Input(id="control-input-end",
+                                                                  type="number")],
+                                            className="mb-3")),
+                    dbc.InputGroup(children=[dbc.InputGroupText("Copy From:"),
+                                             dbc.Select(id="bulk-source",
+                                                        options=parameter_select_options)],
+                                   className="mb-3"),
                     ]),
                 dbc.ModalFooter([
                     dbc.Row(children=[
@@ -74,24 +102,55 @@ def make_modal_reset_table():
     )
     return modal
 
-def make_main_datatable(df):
+def make_main_datatable(model, page_current=0, page_size=PAGE_SIZE, sort_by=None, filter_query=None):
 
-    df_main = df[[WELL_NAME_HEADER, WELL_TYPE_HEADER]].groupby(by=[WELL_NAME_HEADER]).first().reset_index()
+    # first row of each well, wells are contiguous in the table
+    df_main = model.df.iloc[model.index.starts][[WELL_NAME_HEADER, WELL_TYPE_HEADER]].reset_index(drop=True)
     df_main.insert(0, ID_HEADER, df_main[WELL_NAME_HEADER].values)
-    data_df = df_main.to_dict('records')
+
+    df_page, page_count = page_frame(df_main, page_current, page_size, sort_by, filter_query)
+    data_df = records(df_page)
 
     # create column specifications for datatable
     columns=[{'id': c, 'name': c} for c in df_main.columns if c != ID_HEADER]
 
-    return data_df, columns
+    return data_df, columns, page_count
+
+def make_subset_df(model, well, session=None, version=None):
+
+    """
+    Optimization parameters of a well. With a session and version the rows are cached
+    until the table version changes.
+    """
 
-def make_subset_datatable(df, well):
-    
     if well is None:
-        df_subset = pd.DataFrame(SUBSET_COLS)
-    else:
-        
-        df_subset = df[df[WELL_NAME_HEADER] == well][SUBSET_COLS]
+        return pd.DataFrame(SUBSET_COLS)
+
+    key = (session, version, well)
+    if None not in (session, version):
+        df_subset = SUBSET_CACHE.get(key)
+        if df_subset is not None:
+            return df_subset
+
+    df_subset = model.well_rows(well, SUBSET_COLS)
+    if None not in (session, version):
+        SUBSET_CACHE.put(key, df_subset)
+    return df_subset
+
+def make_subset_page(model, well, page_current=0, page_size=PAGE_SIZE, sort_by=None, filter_query=None,
+                     session=None, version=None):
+
+    """
+    Page of the optimization parameters of a well, paged, sorted and filtered on the server.
+    """
+
+    df_subset = make_subset_df(model, well, session, version)
+    df_page, page_count = page_frame(df_subset, page_current, page_size, sort_by, filter_query)
+    return records(df_page), page_count
+
+def make_subset_datatable(model, well):
+    
+    data, page_count = make_subset_page(model, well)
     
     # create column specifications for datatable
     columns=[{'id': c, 'name': c} for c in SUBSET_COLS if c != ID_HEADER]
@@ -118,9 +177,16 @@ def make_subset_datatable(df, well):
 
     table = dash_table.DataTable(
         id='datatable-subset',
+        page_current=0,
         page_size=PAGE_SIZE,
+        page_count=page_count,
+        page_action='custom',
+        sort_action='custom',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
         editable=True,
-        data = df_subset.to_dict('records'),
+        data = data,
         columns=columns,
         style_data_conditional=style_data_conditional,
         style_cell={'textAlign': 'center'}
@@ -128,23 +194,41 @@ def make_subset_datatable(df, well):
 
     return table
 
-def make_left_panel():
+def make_left_panel(model):
 
     """
-    Panel that includes the main table with well names.
+    Panel that includes the main table with well names, with its first page.
     """
 
+    data, columns, page_count = make_main_datatable(model)
+
     panel = dbc.Card([
     dbc.CardHeader("Wells"),
     dbc.CardBody([
         dbc.Row([
-            dbc.Col(html.P("Click on a well to edit optimization parameters."))
+            dbc.Col(html.P("Click on a well to edit optimization parameters."), width=8),
+            dbc.Col(html.Div(
+                children = [
+                    dbc.Button("Undo", id='undo', disabled=True, size="sm"),
+                    dbc.Button("Redo", id='redo', disabled=True, size="sm")
+                ],
+                className="d-grid gap-2 d-md-flex justify-content-md-end")
+                )
         ]),
         dbc.Row(html.Br()),
         dbc.Row([
             dash_table.DataTable(
                     id='datatable-main',
+                    data=data,
+                    columns=columns,
+                    page_current=0,
                     page_size=PAGE_SIZE,
+                    page_count=page_count,
+                    page_action='custom',
+                    sort_action='custom',
+                    sort_by=[],
+                    filter_action='custom',
+                    filter_query='',
                     style_table={'overflowX': 'auto'},
                     style_cell={
                         'minWidth': '70px', 'width': '70px', 'maxWidth': '70px',
@@ -156,26 +240,29 @@ def make_left_panel():
     ])
     return panel
 
-def make_right_panel(df, well=None):
+def make_subset_title(well):
+    return '' if well is None else f'Well Name:  **{well}**'
+
+def make_right_panel(model, well=None):
 
     """
     Panel that includes the subset table with optimization parameters.
+    Built once, selecting a well only updates the title and the table data.
     """
 
-    # dummy for initialization of the app
-    well_name = [html.Div()]
-
-    # after initialized we will have well defined
-    if well is not None:
-        well_name = [dbc.Row([
-                dcc.Markdown([f'Well Name:  **{well}**'],
+    # hidden until a well is selected
+    well_name = [html.Div(id="subset-header",
+                          style={} if well is not None else {'display': 'none'},
+                          children=[
+            dbc.Row([
+                dcc.Markdown(make_subset_title(well), id="subset-title",
                             style={'overflow': 'hidden'}),
                 dcc.Markdown(id="bound-frame",
                             style={'overflow': 'hidden'})
             ]),
-            dbc.Row(html.Hr())]
+            dbc.Row(html.Hr())])]
 
-    table = make_subset_datatable(df, well)
+    table = make_subset_datatable(model, well)
 
     header_and_table = [
         dbc.Row([dbc.Col(html.P("Change optimization parameters for each time \
@@ -183,7 +270,7 @@ def make_right_panel(df, well=None):
                                 constant value for a given parameter.")),
                         dbc.Col(html.Div(
                                 children = [
-                                    dbc.Button("Update All", id='update-all', disabled=True, size="sm"),
+                                    dbc.Button("Update All", id='update-all', disabled=well is None, size="sm"),
                                     dbc.Button("Save Table", id='save-table',size="sm"),
                                     dbc.Button("Reset Table", id='reset-table',size="sm")
                                 ],
@@ -199,6 +286,9 @@ def make_right_panel(df, well=None):
                                 is_open=False,
                                 style={"position": "fixed", "top": 10, "right": 10, 'width':250},
                             ),
+                            # save job written in the background, polled until it is on disk
+                            dcc.Store(id="save-job"),
+                            dcc.Interval(id="save-poll", interval=SAVE_POLL_MS, disabled=True),
                     ]),
         dbc.Row(table),
         html.Div(id='trigger-subset-table-update')
@@ -208,4 +298,14 @@ def make_right_panel(df, well=None):
     dbc.CardBody(well_name+header_and_table)
     ])
 
-    return panel
\ No newline at end of file
+    return panel
+
+def make_ui_metadata(model):
+
+    """
+    What the clientside callbacks (see assets/tables.js) need to know about the table,
+    sent once with the page: the bounds and the bulk parameters.
+    """
+
+    return {'bounds': [LOWER_BOUND_HEADER, UPPER_BOUND_HEADER],
+            'bulk_parameters': BULK_PARAMETERS}
@@ -5,26 +5,56 @@ import pandas as pd
 from dash import Dash, dcc, html, dash_table
 import dash_bootstrap_components as dbc
 
-from ui.utils import (PAGE_SIZE, ID_HEADER, TIME_HEADER, VALUE_HEADER, WELL_NAME_HEADER,
+from ui.utils import (PAGE_SIZE, ID_HEADER, TIME_HEADER, VALUE_HEADER,
                       LOWER_BOUND_HEADER, UPPER_BOUND_HEADER, WELL_CONTROL_HEADER,
                       VARIABLE_NAME_HEADER, VARIABLE_NAME_ORIGINAL)
 
-from ui.utils import  (make_table_conditional_formatting, get_avg_df,
-                       get_scenario_cols)
+from ui.utils import  (make_table_conditional_formatting, violation_field)
+from ui.table_query import page_frame
+from ui.encoding import records
+from ui.lru import LRUCache
+from ui.bulk import BULK_OPERATIONS, BULK_PARAMETERS, BULK_SCOPES, SCOPE_WELL, SCOPE_SELECTION, bulk_options
+
+# count of selected time steps of a well, in the main table rows only (not a column)
+SELECTED_FIELD = 'selected_rows'
+SELECTION_COLOR = '#fff3cd'
+
+# time step rows keyed by (session, server table version, well, scenario), paging / sorting reuses them
+SUBSET_CACHE_SIZE = 64
+SUBSET_CACHE = LRUCache(SUBSET_CACHE_SIZE)
+# how often the page asks whether a save is on disk
+SAVE_POLL_MS = 250
 
 def make_modal_update_all():
 
     """
-    Pop-up to overwrite control values by a constant number.
+    Pop-up to transform the control values of all time steps (see ui.bulk),
+    for the selected well, the wells of its type or all wells.
     """
 
     modal = dbc.Modal([
                 dbc.ModalBody([
-                    dbc.Row(html.P("Enter value to overwrite control for all time steps.")),
+                    dbc.Row(html.P("Select operation and wells to update the control for all time steps.")),
+                    dbc.InputGroup(children=[dbc.InputGroupText("Operation:"),
+                                             dbc.Select(id="bulk-operation", value='set',
+                                                        options=bulk_options(BULK_OPERATIONS))],
+                                   className="mb-3"),
+                    dbc.InputGroup(children=[dbc.InputGroupText("Wells:"),
+                                             dbc.Select(id="bulk-scope", value=SCOPE_WELL,
+                                                        options=bulk_options(dict(BULK_SCOPES, **{
+                                                            SCOPE_SELECTION: 'Selected time steps'})))],
+                                   className="mb-3"),
                     dbc.Row(dbc.InputGroup(children=[dbc.InputGroupText("Control Value:"),
                                                         dbc.Input(id="control-input",
                                                                   type="number")],
                                             className="mb-3")),
+                    dbc.Row(dbc.InputGroup(children=[dbc.InputGroupText("End Value:"),
+                                                        dbc.Input(id="control-input-end",
+                                                                  type="number")],
+                                            className="mb-3")),
+                    dbc.InputGroup(children=[dbc.InputGroupText("Copy From:"),
+                                             dbc.Select(id="bulk-source")],
+                                   className="mb-3"),
                     ]),
                 dbc.ModalFooter([
                     dbc.Row(children=[
@@ -95,13 +125,32 @@ def make_modal_reset_table():
     )
     return modal
 
-def make_main_datatable(df):
+def make_main_datatable(model, page_current=0, page_size=PAGE_SIZE, sort_by=None, filter_query=None,
+                        selection=None):
+
+    """
+    Makes the page of the main table, the table is paged, sorted and filtered on the server.
+    Wells with time steps in the selection (see ui.selection) are highlighted, scenarios
+    with time steps out of bounds are flagged with their count as tooltip.
+    """
+
+    scenario_cols = model.scenarios
 
-    scenario_cols = get_scenario_cols(df.head(0))
+    df_avg = model.summary()
 
-    df_avg = get_avg_df(df)
+    df_page, page_count = page_frame(df_avg, page_current, page_size, sort_by, filter_query)
+    data_df = records(df_page)
 
-    data_df = df_avg.to_dict('records')
+    violations = model.violations().loc[df_page[ID_HEADER].to_numpy(), scenario_cols]
+    tooltip_data = []
+    for record, counts in zip(data_df, violations.to_dict('records')):
+        record.update({violation_field(s_name): count for s_name, count in counts.items()})
+        tooltip_data.append({s_name: violation_tooltip(count) for s_name, count in counts.items() if count})
+
+    if selection is not None:
+        counts = dict(zip(model.wells, selection.well_counts.tolist()))
+        for record in data_df:
+            record[SELECTED_FIELD] = counts.get(record[ID_HEADER], 0)
 
     # create column specifications for datatable
     columns=[{'id': c, 'name': c} for c in df_avg.columns if c != 'id']
@@ -109,30 +158,61 @@ def make_main_datatable(df):
     [col_def.update({'deletable': True}) for col_def in columns if col_def['name'] in scenario_cols]
 
     style = make_table_conditional_formatting(df_avg.head(0))
-    return data_df, columns, style
+    if selection is not None:
+        # first, so the active cell color still shows
+        style.insert(0, {'if': {'filter_query': f'{{{SELECTED_FIELD}}} > 0'},
+                         'backgroundColor': SELECTION_COLOR})
+    return data_df, columns, style, tooltip_data, page_count
+
+def violation_tooltip(count):
+    return f"{count} time steps out of bounds"
 
-def make_subset_datatable(df, well, scenario):
+def make_subset_df(model, well, scenario, session=None, version=None):
 
     """
-    Makes time step datatable, includes formatting for out of bound values.
+    Time step rows of a well and scenario, with the scenario values in the 'Value' column.
+    With a session and version the rows are cached until the table version changes.
     """
 
     if None in [well, scenario]:
-        df_subset = pd.DataFrame([ID_HEADER, VARIABLE_NAME_ORIGINAL, TIME_HEADER, WELL_CONTROL_HEADER, VALUE_HEADER])
-    else:
-        
-        df_subset = df[df[WELL_NAME_HEADER] == well][[ID_HEADER, TIME_HEADER, WELL_CONTROL_HEADER, scenario,
-                                                      LOWER_BOUND_HEADER, UPPER_BOUND_HEADER]]
-        df_subset.rename(columns={scenario:VALUE_HEADER}, inplace=True)
-
-        variable_name_col = VARIABLE_NAME_ORIGINAL
-        for col in df.columns:
-            if col.startswith(VARIABLE_NAME_HEADER) and scenario in col:
-                variable_name_col = col
-                break
-        # fix dollar sign for markdown
-        df_subset.insert(1, VARIABLE_NAME_HEADER, df[variable_name_col])#.map(lambda x: x.replace("$", "\$")))
-        
+        return pd.DataFrame([ID_HEADER, VARIABLE_NAME_ORIGINAL, TIME_HEADER, WELL_CONTROL_HEADER, VALUE_HEADER])
+
+    key = (session, version, well, scenario)
+    if None not in (session, version):
+        df_subset = SUBSET_CACHE.get(key)
+        if df_subset is not None:
+            return df_subset
+
+    df_subset = model.well_rows(well, [ID_HEADER, TIME_HEADER, WELL_CONTROL_HEADER,
+                                       LOWER_BOUND_HEADER, UPPER_BOUND_HEADER])
+    # the scenario may share its values with its parent (see ScenarioTableModel)
+    df_subset.insert(3, VALUE_HEADER, model.scenario_values(scenario, well))
+
+    # fix dollar sign for markdown
+    df_subset.insert(1, VARIABLE_NAME_HEADER, model.variable_names(scenario, well))#.map(lambda x: x.replace("$", "\$")))
+    if None not in (session, version):
+        SUBSET_CACHE.put(key, df_subset)
+    return df_subset
+
+def make_subset_page(model, well, scenario, page_current=0, page_size=PAGE_SIZE, sort_by=None, filter_query=None,
+                     session=None, version=None):
+
+    """
+    Page of the time step table, paged, sorted and filtered on the server.
+    """
+
+    df_page, page_count = page_frame(make_subset_df(model, well, scenario, session, version),
+                                     page_current, page_size, sort_by, filter_query)
+    return records(df_page), page_count
+
+def make_subset_datatable(model, well, scenario):
+
+    """
+    Makes time step datatable, includes formatting for out of bound values.
+    """
+
+    data, page_count = make_subset_page(model, well, scenario)
+
     column = [
         {'id': VARIABLE_NAME_HEADER, 'name': VARIABLE_NAME_HEADER, 'editable':True},
         {'id': TIME_HEADER, 'name': TIME_HEADER, 'editable':False},
@@ -160,9 +240,16 @@ def make_subset_datatable(df, well, scenario):
 
     table = dash_table.DataTable(
         id='datatable-subset',
+        page_current=0,
         page_size=PAGE_SIZE,
+        page_count=page_count,
+        page_action='custom',
+        sort_action='custom',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
         editable=True,
-        data = df_subset.to_dict('records'),
+        data = data,
         columns=column,
         style_data_conditional=style_data_conditional,
         style_cell={'textAlign': 'center'}
@@ -170,12 +257,36 @@ def make_subset_datatable(df, well, scenario):
 
     return table
 
-def make_left_panel():
+def make_selection_bar():
 
     """
-    Panel that includes the main table with well names.
+    Selection of time steps by a query over the table columns (see ui.selection),
+    to update or export them for several scenarios at once.
     """
 
+    bar = html.Div([
+        dbc.InputGroup(children=[
+            dbc.InputGroupText("Select:"),
+            dbc.Input(id="selection-query", type="text", debounce=True,
+                      placeholder='Well Type == "Injector" and Time >= 365'),
+            dbc.Button("Update Selection", id="update-selection", disabled=True),
+            dbc.Button("Export Selection", id="export-selection", disabled=True),
+            ], size="sm", className="mb-2"),
+        dcc.Dropdown(id="selection-scenarios", multi=True,
+                     placeholder="Scenarios to update / export (all when exporting)"),
+        html.Small(id="selection-info", className="text-muted"),
+        dcc.Download(id="download-selection"),
+    ])
+    return bar
+
+def make_left_panel(model):
+
+    """
+    Panel that includes the main table with well names, with its first page.
+    """
+
+    data, columns, style, tooltip_data, page_count = make_main_datatable(model)
+
     panel = dbc.Card([
     dbc.CardHeader("Scenario Control per Well"),
     dbc.CardBody([
@@ -184,6 +295,8 @@ def make_left_panel():
                         for each time step."), width=8),
             dbc.Col(html.Div(
                 children = [
+                    dbc.Button("Undo", id='undo', disabled=True, size="sm"),
+                    dbc.Button("Redo", id='redo', disabled=True, size="sm"),
                     dbc.Button("Add Scenario", id='add-scenario',size="sm"),
                     dbc.Button("Save Scenarios", id='save-scenarios', size="sm"),
                     dbc.Button("Reset Table", id='reset-table',size="sm")
@@ -198,13 +311,29 @@ def make_left_panel():
                     is_open=False,
                     style={"position": "fixed", "top": 10, "right": 10, 'width':250},
                 ),
+                # save job written in the background, polled until it is on disk
+                dcc.Store(id="save-job"),
+                dcc.Interval(id="save-poll", interval=SAVE_POLL_MS, disabled=True),
         ]),
         dbc.Row(html.Br()),
+        dbc.Row(make_selection_bar()),
+        dbc.Row(html.Br()),
         dbc.Row([
             html.Div(id='trigger-table-update'),
             dash_table.DataTable(
                     id='datatable-main',
+                    data=data,
+                    columns=columns,
+                    style_data_conditional=style,
+                    tooltip_data=tooltip_data,
+                    page_current=0,
                     page_size=PAGE_SIZE,
+                    page_count=page_count,
+                    page_action='custom',
+                    sort_action='custom',
+                    sort_by=[],
+                    filter_action='custom',
+                    filter_query='',
                     style_table={'overflowX': 'auto'},
                     style_cell={
                         'minWidth': '80px', 'width': '80px', 'maxWidth': '80px',
@@ -218,26 +347,31 @@ def make_left_panel():
     ])
     return panel
 
-def make_right_panel(df, well=None, scenario=None):
+def make_subset_title(well, scenario):
+    if None in [well, scenario]:
+        return ''
+    return f'Well Name:  **{well}**  \nScenario:  **{scenario}**'
+
+def make_right_panel(model, well=None, scenario=None):
 
     """
     Panel that includes the subset table with time steps.
+    Built once, selecting a well and scenario only updates the title and the table data.
     """
 
-    # dummy for initialization of the app
-    well_scenario_name = [html.Div()]
-
-    # after initialized we will have well and scenario defined
-    if None not in [well, scenario]:
-        well_scenario_name = [dbc.Row([
-                dcc.Markdown([f'Well Name:  **{well}**  \nScenario:  **{scenario}**'],
+    # hidden until a well and scenario are selected (see assets/tables.js)
+    well_scenario_name = [html.Div(id="subset-header",
+                                   style={} if None not in [well, scenario] else {'display': 'none'},
+                                   children=[
+            dbc.Row([
+                dcc.Markdown(make_subset_title(well, scenario), id="subset-title",
                             style={'overflow': 'hidden'}),
                 dcc.Markdown(id="bound-frame",
                             style={'overflow': 'hidden'})
             ]),
-            dbc.Row(html.Hr())]
+            dbc.Row(html.Hr())])]
 
-    table = make_subset_datatable(df, well, scenario)
+    table = make_subset_datatable(model, well, scenario)
 
     header_and_table = [
         dbc.Row([dbc.Col(html.P("Enter control value for each time \
@@ -245,7 +379,7 @@ def make_right_panel(df, well=None, scenario=None):
                                 constant value."), width=8),
                     dbc.Col([dbc.Button("Update All",
                                         id='update-all',
-                                    disabled=True,
+                                    disabled=None in [well, scenario],
                                     size="sm"
                                     ),
                         make_modal_update_all(),
@@ -261,8 +395,14 @@ def make_right_panel(df, well=None, scenario=None):
 
     return panel
 
-def make_bound_frame(lower, upper):
+def make_ui_metadata(model):
 
-    content = [f'Lower Bound:  **{lower}**  \nUpper Bound:  **{upper}**']
+    """
+    What the clientside callbacks (see assets/tables.js) need to know about the table,
+    sent once with the page: the column names, the bounds and the bulk parameters.
+    """
 
-    return content
\ No newline at end of file
+    return {'columns': [col for col in model.df.columns if col not in model.scenarios],
+            'bounds': [LOWER_BOUND_HEADER, UPPER_BOUND_HEADER],
+            'bulk_parameters': BULK_PARAMETERS,
+            'modal_scopes': {'update-all': SCOPE_WELL, 'update-selection': SCOPE_SELECTION}}
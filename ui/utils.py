@@ -1,5 +1,6 @@
 import os
-import pandas as pd, numpy as np
+
+from ui.summary import group_stats, constant_or_varying
 
 PAGE_SIZE = 10
 ID_HEADER = 'id'
@@ -13,16 +14,11 @@ VALUE_HEADER = "Value"
 VARIABLE_NAME_ORIGINAL = "Variable Name - Original"
 DEFAULT_SCENARIO_COL = "Default Scenario"
 VARIABLE_NAME_HEADER = "Variable Name"
+VIOLATIONS_HEADER = "Violations"
 FIXED_HEADERS = [ID_HEADER, WELL_NAME_HEADER, WELL_TYPE_HEADER, WELL_CONTROL_HEADER,
                  LOWER_BOUND_HEADER, UPPER_BOUND_HEADER, TIME_HEADER, VARIABLE_NAME_ORIGINAL]
 
 
-def well_agg_main_table(x: pd.Series):
-    all_equal = all(abs(item - x.iloc[0])<1e-10 for item in x.values)
-    if all_equal: return x.iloc[0]
-    else: return "varying"
-
-
 def get_scenario_cols(df):
     scenario_cols = []
     for col in df.columns:
@@ -36,15 +32,22 @@ def get_avg_df(df):
     """ Return the data for the main table """
 
     scenario_columns = get_scenario_cols(df)
-    cols = [WELL_NAME_HEADER, WELL_TYPE_HEADER] + scenario_columns
 
-    df_main = df[cols].groupby(by=[WELL_NAME_HEADER,WELL_TYPE_HEADER])[scenario_columns].agg(func=well_agg_main_table).reset_index()
+    stats = group_stats(df, [WELL_NAME_HEADER, WELL_TYPE_HEADER], scenario_columns)
+    df_main = constant_or_varying(stats, scenario_columns).reset_index()
 
     df_main[ID_HEADER] = df_main[WELL_NAME_HEADER]
     df_main.set_index(ID_HEADER, inplace=True, drop=False)
     return df_main
 
 
+def violation_field(scenario):
+
+    """ Main table row field with the number of time steps out of bounds of a scenario (not a column) """
+
+    return f"{VIOLATIONS_HEADER} - {scenario}"
+
+
 def make_table_conditional_formatting(df_cols):
 
     scenario_cols = get_scenario_cols(df_cols)
@@ -70,4 +73,16 @@ def make_table_conditional_formatting(df_cols):
 
     condition.extend(cond)
 
+    # scenarios with time steps out of bounds in red, like in the time step table
+    cond = [{
+        'if': {
+            'filter_query': f'{{{violation_field(c)}}} > 0',
+            'column_id': c
+        },
+        'color': 'red',
+        'fontWeight': 'bold'
+    } for c in scenario_cols]
+
+    condition.extend(cond)
+
     return condition
\ No newline at end of file
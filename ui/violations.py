@@ -0,0 +1,34 @@
+import pandas as pd, numpy as np
+
+
+def out_of_bounds(values, lower, upper):
+
+    """ Mask of the values outside of their bounds, a missing value or bound is never a violation """
+
+    return (values < lower) | (values > upper)
+
+
+def violation_counts(values, lower, upper, starts):
+
+    """
+    Out-of-bound rows per column and group in one pass: values is columns x rows,
+    lower / upper are per row, groups are contiguous and start at starts.
+    Returns columns x groups counts.
+    """
+
+    values = np.atleast_2d(values)
+    if not values.shape[1]:
+        return np.zeros((values.shape[0], 0), dtype=np.int64)
+    mask = out_of_bounds(values, lower[np.newaxis, :], upper[np.newaxis, :])
+    return np.add.reduceat(mask, starts, axis=1, dtype=np.int64)
+
+
+def violation_frame(columns, lower, upper, starts, wells):
+
+    """
+    Out-of-bound time steps per well (rows) and scenario (columns) from a mapping
+    of scenario to its values, one vectorized pass per scenario.
+    """
+
+    data = {col: violation_counts(values, lower, upper, starts)[0] for col, values in columns.items()}
+    return pd.DataFrame(data, index=pd.Index(wells), columns=list(columns), dtype=np.int64)
@@ -0,0 +1,83 @@
+import base64, json
+
+import pandas as pd, numpy as np
+
+FLOAT_ENCODING = 'float64'
+DICTIONARY_ENCODING = 'dictionary'
+
+# explicit byte order, the same on every machine and in the browser (Float64Array / Int32Array)
+FLOAT_DTYPE = np.dtype('<f8')
+CODE_DTYPE = np.dtype('<i4')
+
+
+def _pack(values, dtype):
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode('ascii')
+
+
+def _unpack(data, dtype):
+    return np.frombuffer(base64.b64decode(data), dtype=dtype)
+
+
+def encode_column(series):
+
+    """
+    Numeric and boolean columns become base64 packed little-endian float64,
+    any other column is dictionary encoded (distinct values + base64 int32 codes, -1 for missing).
+    """
+
+    dtype = str(series.dtype)
+    if pd.api.types.is_numeric_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+        return {'encoding': FLOAT_ENCODING, 'dtype': dtype,
+                'values': _pack(series.to_numpy(dtype=np.float64, na_value=np.nan), FLOAT_DTYPE)}
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, categories = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, categories = pd.factorize(series, use_na_sentinel=True)
+    return {'encoding': DICTIONARY_ENCODING, 'dtype': dtype,
+            'categories': pd.Index(categories).astype(object).tolist(),
+            'codes': _pack(codes, CODE_DTYPE)}
+
+
+def decode_column(column):
+    if column['encoding'] == FLOAT_ENCODING:
+        values = _unpack(column['values'], FLOAT_DTYPE)
+        dtype = np.dtype(column['dtype'])
+        if dtype.kind in 'iub' and np.isnan(values).any():
+            # missing values can't go back into an integer column
+            return values.copy()
+        return values.astype(dtype)
+
+    codes = _unpack(column['codes'], CODE_DTYPE)
+    if column['dtype'] == 'category':
+        return pd.Categorical.from_codes(codes, categories=column['categories'])
+    categories = np.empty(len(column['categories']) + 1, dtype=object)
+    categories[:-1] = column['categories']
+    categories[-1] = np.nan
+    # code -1 picks the trailing missing value
+    return categories[codes]
+
+
+def encode_frame(df):
+
+    """ Columnar, JSON serializable encoding of a DataFrame (see encode_column) """
+
+    return {'length': len(df),
+            'columns': [str(col) for col in df.columns],
+            'data': [encode_column(df.iloc[:, i]) for i in range(df.shape[1])]}
+
+
+def decode_frame(encoded):
+
+    """ Rebuild the DataFrame of encode_frame, one array operation per column """
+
+    data = {col: decode_column(column) for col, column in zip(encoded['columns'], encoded['data'])}
+    return pd.DataFrame(data, index=pd.RangeIndex(encoded['length']), columns=encoded['columns'])
+
+
+def dumps_frame(df):
+    return json.dumps(encode_frame(df), separators=(',', ':')).encode('utf-8')
+
+
+def loads_frame(data):
+    return decode_frame(json.loads(data))